@@ -0,0 +1,107 @@
+from __future__ import division
+from mrjob.job import MRJob
+from itertools import combinations, groupby
+import zlib
+
+
+def partition(item, n_partitions):
+    # Same partition for an item in every
+    # mapper, unlike hash() on Python 3.
+    return (zlib.crc32(item.encode("utf-8")) & 0xffffffff) % n_partitions
+
+
+class AssociationRules(MRJob):
+    """
+    Rules a -> b between pairs of items with their support,
+    confidence and lift, in a single job, by order inversion.
+
+    Keys are pseudo partitions and values are [left, right, count]
+    records. Every pair goes to the partition of its first item.
+    Each mapper also sends its item counts and its number of
+    baskets to every partition with "*" as the left item. Values
+    are sorted, so those marginals reach a reducer before any pair,
+    and the rules of a pair in both directions can be worked out as
+    the pairs go by, without a separate item count job and a join.
+    """
+    SORT_VALUES = True
+
+    def configure_options(self):
+        super(AssociationRules, self).configure_options()
+
+        self.add_passthrough_option(
+            '--support',
+            default=100,
+            type='int',
+            help="Minimum count of the pairs to make rules from")
+
+        self.add_passthrough_option(
+            '--min-confidence',
+            default=0.0,
+            type='float',
+            help="Minimum confidence of the rules to output")
+
+        self.add_passthrough_option(
+            '--reduce.tasks',
+            dest='reducers',
+            default=4,
+            type='int',
+            help="Number of reducers to use. Controls the number of pseudo " +
+                 "partitions, each of which gets a copy of the item counts")
+
+    def mapper_init(self):
+        self.item_counts = {}
+        self.total_baskets = 0
+
+    def mapper(self, _, lines):
+        self.total_baskets += 1
+        products = sorted(set(lines.split()))
+        n_partitions = self.options.reducers
+        for item in products:
+            self.item_counts[item] = self.item_counts.get(item, 0) + 1
+        for item, other_item in combinations(products, 2):
+            yield partition(item, n_partitions), [item, other_item, 1]
+
+    def mapper_final(self):
+        # "*" sorts before the items, and
+        # "" before any item, so the number
+        # of baskets comes first of all.
+        for k in range(self.options.reducers):
+            yield k, ["*", "", self.total_baskets]
+            for item, count in self.item_counts.items():
+                yield k, ["*", item, count]
+
+    def combiner(self, key, values):
+        counts = {}
+        for left, right, count in values:
+            counts[(left, right)] = counts.get((left, right), 0) + count
+        for (left, right), count in counts.items():
+            yield key, [left, right, count]
+
+    def reducer_init(self):
+        self.support = self.options.support
+        self.min_confidence = self.options.min_confidence
+
+    def reducer(self, key, values):
+        item_counts = {}
+        total_baskets = 0
+        for (left, right), group in groupby(values, key=lambda x: (x[0], x[1])):
+            count = sum(val[2] for val in group)
+            if left == "*":
+                if right == "":
+                    total_baskets = count
+                else:
+                    item_counts[right] = count
+            elif count >= self.support:
+                support = count/total_baskets
+                for item, other_item in [(left, right), (right, left)]:
+                    confidence = count/item_counts[item]
+                    if confidence < self.min_confidence:
+                        continue
+                    self.increment_counter("job stats", "number of rules")
+                    lift = confidence*total_baskets/item_counts[other_item]
+                    yield ("%s -> %s" % (item, other_item),
+                           (count, round(support, 4),
+                            round(confidence, 4), round(lift, 4)))
+
+if __name__ == "__main__":
+    AssociationRules.run()
@@ -1,7 +1,10 @@
 from mrjob.job import MRJob
+# Needs --file buffered_counters.py outside
+# of the inline runner.
+from buffered_counters import BufferedCounters
 from mrjob.step import MRStep
 
-class ComplaintDistribution(MRJob):
+class ComplaintDistribution(BufferedCounters, MRJob):
     def mapper(self, _, lines):
         line = lines[:30]
         if "Debt collection" in line:
@@ -0,0 +1,37 @@
+from mrjob.job import MRJob
+
+
+class FrequentItems(MRJob):
+    """
+    First pass of a-priori. Counts how many times each item was
+    purchased and only outputs the items with a count of at least
+    --support, so that PairsRecommender and StripesRecommender can
+    skip every pair that contains an infrequent item.
+    """
+    def configure_options(self):
+        super(FrequentItems, self).configure_options()
+
+        self.add_passthrough_option(
+            '--support',
+            default=100,
+            type='int',
+            help="Minimum number of purchases of a frequent item")
+
+    def mapper(self, _, lines):
+        for prod in lines.split():
+            yield (prod, 1)
+
+    def combiner(self, key, values):
+        yield key, sum(values)
+
+    def reducer(self, key, values):
+        values_sum = sum(values)
+        if values_sum >= self.options.support:
+            self.increment_counter("job stats", "number of frequent items")
+            yield key, values_sum
+        else:
+            self.increment_counter("job stats", "number of infrequent items")
+
+
+if __name__ == "__main__":
+    FrequentItems.run()
@@ -0,0 +1,205 @@
+from mrjob.job import MRJob
+from mrjob.step import MRStep
+from itertools import combinations
+
+
+def pcy_bitmap(baskets, threshold, n_buckets):
+    """
+    First pass of PCY. Counts the items and hashes every pair of a
+    basket into one of n_buckets. Returns the item counts and a
+    bitmap of the buckets with a count of at least threshold: a
+    pair in any other bucket can't be frequent.
+    """
+    item_counts = {}
+    bucket_counts = [0]*n_buckets
+    for basket in baskets:
+        for item in basket:
+            item_counts[item] = item_counts.get(item, 0) + 1
+        for pair in combinations(basket, 2):
+            bucket_counts[hash(pair) % n_buckets] += 1
+    bitmap = bytearray(count >= threshold for count in bucket_counts)
+    return item_counts, bitmap
+
+
+def next_candidates(frequent, size):
+    """
+    Apriori candidates of the given size: unions of two frequent
+    itemsets of size - 1 that share all but their last item, kept
+    only if all of their subsets of size - 1 are frequent.
+    """
+    ordered = sorted(frequent)
+    candidates = set()
+    for index, itemset in enumerate(ordered):
+        for other in ordered[index+1:]:
+            if itemset[:-1] != other[:-1]:
+                break
+            candidate = itemset + other[-1:]
+            if all(subset in frequent
+                   for subset in combinations(candidate, size - 1)):
+                candidates.add(candidate)
+    return candidates
+
+
+def local_frequent_itemsets(baskets, threshold, n_buckets, max_size=0):
+    """
+    Generator of every itemset (as a sorted tuple) with a count of
+    at least threshold in baskets, by Apriori with a PCY bitmap for
+    the pairs. Baskets are sorted tuples of unique items.
+    """
+    item_counts, bitmap = pcy_bitmap(baskets, threshold, n_buckets)
+    frequent = set((item,) for item, count in item_counts.items()
+                   if count >= threshold)
+    size = 1
+    while frequent:
+        for itemset in frequent:
+            yield itemset
+        size += 1
+        if max_size and size > max_size:
+            break
+        if size == 2:
+            candidates = None
+        else:
+            candidates = next_candidates(frequent, size)
+            if not candidates:
+                break
+        items = set(item for itemset in frequent for item in itemset)
+        counts = {}
+        for basket in baskets:
+            basket = [item for item in basket if item in items]
+            for itemset in combinations(basket, size):
+                if candidates is None:
+                    # Pairs of frequent items
+                    # in a frequent bucket.
+                    if not bitmap[hash(itemset) % n_buckets]:
+                        continue
+                elif itemset not in candidates:
+                    continue
+                counts[itemset] = counts.get(itemset, 0) + 1
+        frequent = set(itemset for itemset, count in counts.items()
+                       if count >= threshold)
+
+
+class FrequentItemsets(MRJob):
+    """
+    Frequent itemsets of any size with the SON algorithm, in two
+    runs (see son_driver.py):
+
+    1. Without --candidates, each mapper keeps the baskets of its
+       split and runs Apriori on them with the support scaled to
+       the split. Any itemset frequent in the whole data is
+       frequent in at least one split, so the union of the local
+       results is the list of candidates.
+    2. With --candidates, the mappers count the candidates each
+       basket contains and the reducers keep the ones whose count
+       is at least --min-support of --baskets.
+    """
+    def configure_options(self):
+        super(FrequentItemsets, self).configure_options()
+
+        self.add_passthrough_option(
+            '--min-support',
+            default=0.005,
+            type='float',
+            help="Minimum fraction of the baskets an itemset must be in")
+
+        self.add_passthrough_option(
+            '--max-size',
+            default=0,
+            type='int',
+            help="Largest itemsets to look for. 0 means no limit")
+
+        self.add_passthrough_option(
+            '--buckets',
+            default=100003,
+            type='int',
+            help="Number of PCY hash buckets for the pairs of a split")
+
+        self.add_file_option(
+            '--candidates',
+            help="Output of the first run, one itemset per line. If given, " +
+                 "runs the counting pass")
+
+        self.add_passthrough_option(
+            '--baskets',
+            type='int',
+            help="Total number of baskets, reported by the first run. " +
+                 "Needed with --candidates")
+
+    def mapper_init(self):
+        # The baskets of a split are
+        # expected to fit in memory.
+        self.baskets = []
+
+    def mapper(self, _, lines):
+        self.baskets.append(tuple(sorted(set(lines.split()))))
+
+    def mapper_final(self):
+        n_baskets = len(self.baskets)
+        self.increment_counter("job stats", "number of baskets", n_baskets)
+        threshold = self.options.min_support*n_baskets
+        n_itemsets = 0
+        for itemset in local_frequent_itemsets(self.baskets, threshold,
+                                               self.options.buckets,
+                                               self.options.max_size):
+            n_itemsets += 1
+            yield " ".join(itemset), None
+        self.increment_counter("job stats", "number of local itemsets",
+                               n_itemsets)
+
+    def reducer(self, key, values):
+        self.increment_counter("job stats", "number of candidates")
+        yield key, None
+
+    def count_mapper_init(self):
+        if not self.options.baskets:
+            msg = """--baskets is required
+                     with --candidates"""
+            raise Exception(msg)
+        # Candidates of every size by their
+        # first item, so that a basket only
+        # looks at the ones it could hold.
+        self.candidates = {}
+        with open(self.options.candidates) as candidates:
+            for line in candidates:
+                itemset = tuple(line.split())
+                if itemset:
+                    self.candidates.setdefault(itemset[0], []).append(itemset)
+        self.counts = {}
+
+    def count_mapper(self, _, lines):
+        basket = set(lines.split())
+        counts = self.counts
+        for item in basket:
+            for itemset in self.candidates.get(item, ()):
+                if basket.issuperset(itemset[1:]):
+                    counts[itemset] = counts.get(itemset, 0) + 1
+
+    def count_mapper_final(self):
+        # Counts were combined in memory.
+        for itemset, count in self.counts.items():
+            yield " ".join(itemset), count
+
+    def count_combiner(self, key, values):
+        yield key, sum(values)
+
+    def count_reducer(self, key, values):
+        values_sum = sum(values)
+        support = values_sum/float(self.options.baskets)
+        if support >= self.options.min_support:
+            self.increment_counter("job stats", "number of frequent itemsets")
+            yield key, (values_sum, round(support, 4))
+
+    def steps(self):
+        if self.options.candidates:
+            return [MRStep(mapper_init=self.count_mapper_init,
+                           mapper=self.count_mapper,
+                           mapper_final=self.count_mapper_final,
+                           combiner=self.count_combiner,
+                           reducer=self.count_reducer)]
+        return [MRStep(mapper_init=self.mapper_init,
+                       mapper=self.mapper,
+                       mapper_final=self.mapper_final,
+                       reducer=self.reducer)]
+
+if __name__ == "__main__":
+    FrequentItemsets.run()
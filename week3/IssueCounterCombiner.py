@@ -1,10 +1,13 @@
 
 from mrjob.job import MRJob
+# Needs --file buffered_counters.py outside
+# of the inline runner.
+from buffered_counters import BufferedCounters
 from mrjob.step import MRStep
 import csv
 import sys
 
-class IssueCounterCombiner(MRJob):
+class IssueCounterCombiner(BufferedCounters, MRJob):
     
     def mapper(self, _, lines):
         self.increment_counter("Mappers", "Tasks", 1)
@@ -17,7 +20,10 @@ class IssueCounterCombiner(MRJob):
     
     def reducer(self, word, count):
         self.increment_counter("Reducers", "Tasks", 1)
-        self.increment_counter("Reducers", "Lines processed", len(list(count)))
+        # count is a generator, so it
+        # can only be read once.
+        count = list(count)
+        self.increment_counter("Reducers", "Lines processed", len(count))
         yield (word, sum(count))
         
 if __name__ == "__main__":
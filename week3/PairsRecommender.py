@@ -1,5 +1,8 @@
 
 from mrjob.job import MRJob
+# Needs --file buffered_counters.py outside
+# of the inline runner.
+from buffered_counters import BufferedCounters
 from mrjob.step import MRStep
 import heapq
 import sys
@@ -29,35 +32,54 @@ class TopList(list):
         """
         Just like a list, except the append method adds the new value to the 
         list only if it is larger than the smallest value (or if the size of 
-        the list is less than max_size). If each element of the list is an int
-        or float, uses that value for comparison. If the first element is a 
-        list or tuple, uses the first element of the list or tuple for the 
-        comparison.
+        the list is less than max_size). Values are compared whole, so ties 
+        on the first element of a list or tuple are broken by the next ones 
+        and the same values are kept whatever order they arrive in.
         """
         self.max_size = max_size
         
-    def _get_key(self, x):
-        return x[0] if isinstance(x, (list, tuple)) else x
-        
     def append(self, val):
-        key=lambda x: x[0] if isinstance(x, (list, tuple)) else x
         if len(self) < self.max_size:
             heapq.heappush(self, val)
-        elif self._get_key(self[0]) < self._get_key(val):
+        elif self[0] < val:
             heapq.heapreplace(self, val)
             
     def final_sort(self):
-        return sorted(self, key=self._get_key, reverse=True)
+        return sorted(self, reverse=True)
     
                     
-class PairsRecommender(MRJob):
+class PairsRecommender(BufferedCounters, MRJob):
+    def configure_options(self):
+        super(PairsRecommender, self).configure_options()
+        
+        self.add_passthrough_option(
+            '--support', 
+            default=100, 
+            type='int',
+            help="Minimum count of the itemsets to keep")
+        
+        self.add_file_option(
+            '--frequent-items', 
+            help="File with one frequent item per line, made by FrequentItems " +
+                 "(see apriori_driver.py). If given, only pairs of two frequent " +
+                 "items are generated")
+        
     def mapper_init(self):
         self.total_baskets = 0
+        self.frequent_items = None
+        if self.options.frequent_items:
+            with open(self.options.frequent_items) as items:
+                self.frequent_items = set(line.strip() for line in items)
     
     def mapper(self, _, lines):
         self.total_baskets += 1
         products = lines.split()
         self.increment_counter("job stats", "number of items", len(products))
+        if self.frequent_items is not None:
+            # A pair can't be more frequent than
+            # either of its items, so drop the
+            # infrequent ones before pairing.
+            products = [prod for prod in products if prod in self.frequent_items]
         for itemset in all_itemsets_of_size_two(products):
             self.increment_counter("job stats", "number of item combos")
             yield (itemset, 1)
@@ -72,22 +94,46 @@ class PairsRecommender(MRJob):
     
     def reducer_init(self):
         self.top_values = TopList(50)
-        self.total_baskets = 0
     
     def reducer(self, key, values):
         values_sum = sum(values)
         if key == "*** Total":
-            self.total_baskets = values_sum
-        elif values_sum >= 100:
-            self.increment_counter("job stats", "number of itemsets >= 100")
-            basket_percent = values_sum/self.total_baskets
-            self.top_values.append([values_sum, round(basket_percent,3), key])
+            # Only one reducer gets the total,
+            # so the percentages wait for
+            # top_reducer.
+            yield None, [values_sum, key]
+        elif values_sum >= self.options.support:
+            self.increment_counter("job stats", "number of itemsets >= support")
+            self.top_values.append([values_sum, key])
         else:
-            self.increment_counter("job stats", "number of itemsets < 100")
+            self.increment_counter("job stats", "number of itemsets < support")
             
     def reducer_final(self):
-        for values_sum, basket_percent, key in self.top_values.final_sort():
-            yield key, (values_sum, basket_percent)
+        # Top of this reducer only.
+        for val in self.top_values.final_sort():
+            yield None, val
+    
+    def top_reducer(self, _, values):
+        top_values = TopList(50)
+        total_baskets = 0
+        for values_sum, key in values:
+            if key == "*** Total":
+                total_baskets = values_sum
+            else:
+                top_values.append([values_sum, key])
+        for values_sum, key in top_values.final_sort():
+            basket_percent = values_sum/total_baskets
+            yield key, (values_sum, round(basket_percent,3))
+    
+    def steps(self):
+        return [MRStep(mapper_init=self.mapper_init,
+                       mapper=self.mapper,
+                       mapper_final=self.mapper_final,
+                       combiner=self.combiner,
+                       reducer_init=self.reducer_init,
+                       reducer=self.reducer,
+                       reducer_final=self.reducer_final),
+                MRStep(reducer=self.top_reducer)]
         
 if __name__ == "__main__":
     PairsRecommender.run()
\ No newline at end of file
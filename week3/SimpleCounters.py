@@ -1,7 +1,10 @@
 
 from mrjob.job import MRJob
+# Needs --file buffered_counters.py outside
+# of the inline runner.
+from buffered_counters import BufferedCounters
 
-class SimpleCounters(MRJob):
+class SimpleCounters(BufferedCounters, MRJob):
     def mapper_init(self):
         self.increment_counter("Mappers", "Count", 1)
     
@@ -1,6 +1,7 @@
 
 from mrjob.job import MRJob
-from collections import Counter
+from mrjob.step import MRStep
+from stripes import ItemIds, Stripe
 import sys
 import heapq
 
@@ -20,65 +21,120 @@ class TopList(list):
         """
         Just like a list, except the append method adds the new value to the 
         list only if it is larger than the smallest value (or if the size of 
-        the list is less than max_size). If each element of the list is an int
-        or float, uses that value for comparison. If the first element is a 
-        list or tuple, uses the first element of the list or tuple for the 
-        comparison.
+        the list is less than max_size). Values are compared whole, so ties 
+        on the first element of a list or tuple are broken by the next ones 
+        and the same values are kept whatever order they arrive in.
         """
         self.max_size = max_size
         
-    def _get_key(self, x):
-        return x[0] if isinstance(x, (list, tuple)) else x
-        
     def append(self, val):
-        key=lambda x: x[0] if isinstance(x, (list, tuple)) else x
         if len(self) < self.max_size:
             heapq.heappush(self, val)
-        elif self._get_key(self[0]) < self._get_key(val):
+        elif self[0] < val:
             heapq.heapreplace(self, val)
             
     def final_sort(self):
-        return sorted(self, key=self._get_key, reverse=True)
+        return sorted(self, reverse=True)
     
         
 class StripesRecommender(MRJob):
+    # Uploaded next to the job
+    # outside of the inline runner.
+    FILES = ["stripes.py"]
+    
+    def configure_options(self):
+        super(StripesRecommender, self).configure_options()
+        
+        self.add_passthrough_option(
+            '--support', 
+            default=100, 
+            type='int',
+            help="Minimum count of the itemsets to keep")
+        
+        self.add_file_option(
+            '--frequent-items', 
+            help="File with one frequent item per line, made by FrequentItems " +
+                 "(see apriori_driver.py). If given, stripes only hold frequent " +
+                 "items, and travel as arrays of their ids")
+    
+    def load_item_ids(self):
+        # Same ids in every task, so that
+        # stripes can be sent as arrays.
+        self.item_ids = None
+        if self.options.frequent_items:
+            with open(self.options.frequent_items) as items:
+                self.item_ids = ItemIds(sorted(set(line.strip()
+                                                   for line in items)))
     
     def mapper_init(self):
         self.basket_count = 0
+        self.load_item_ids()
     
     def mapper(self, _, lines):
         self.basket_count += 1
         products = lines.split()
+        if self.item_ids is not None:
+            # Infrequent items can't be part
+            # of a frequent pair.
+            products = [prod for prod in products if prod in self.item_ids]
         for item, value in all_itemsets_of_size_two_stripes(products):
+            if self.item_ids is not None:
+                value = Stripe(value).encode(self.item_ids).to_arrays()
             yield item, value
             
     def mapper_final(self):
         yield ("*** Total", {"total": self.basket_count})
         
     def combiner(self, keys, values):
-        values_sum = Counter()
-        for val in values:
-            values_sum += Counter(val)
-        yield keys, dict(values_sum)
+        values_sum = Stripe.merge(values)
+        if self.options.frequent_items and keys != "*** Total":
+            values_sum = values_sum.to_arrays()
+        yield keys, values_sum
     
     def reducer_init(self):
         self.top = TopList(50)
+        self.load_item_ids()
     
     def reducer(self, keys, values):
-        values_sum = Counter()
-        for val in values:
-            values_sum += Counter(val)
+        values_sum = Stripe.merge(values)
 
         if keys == "*** Total":            
-            self.total = values_sum["total"]
+            # Only one reducer gets the total,
+            # so the percentages wait for
+            # top_reducer.
+            yield None, [values_sum["total"], keys]
         else:
+            if self.item_ids is not None:
+                values_sum = values_sum.decode(self.item_ids)
             for k, v in values_sum.items():
-                if v >= 100:
-                    self.top.append([v, round(v/self.total,3), keys+" "+k])
+                if v >= self.options.support:
+                    self.top.append([v, keys+" "+k])
 
     def reducer_final(self):
-        for count, perc, key in self.top.final_sort():
-            yield key, (count, perc)
+        # Top of this reducer only.
+        for val in self.top.final_sort():
+            yield None, val
+
+    def top_reducer(self, _, values):
+        top = TopList(50)
+        total = 0
+        for count, key in values:
+            if key == "*** Total":
+                total = count
+            else:
+                top.append([count, key])
+        for count, key in top.final_sort():
+            yield key, (count, round(count/total,3))
+
+    def steps(self):
+        return [MRStep(mapper_init=self.mapper_init,
+                       mapper=self.mapper,
+                       mapper_final=self.mapper_final,
+                       combiner=self.combiner,
+                       reducer_init=self.reducer_init,
+                       reducer=self.reducer,
+                       reducer_final=self.reducer_final),
+                MRStep(reducer=self.top_reducer)]
                     
 if __name__ == "__main__":
     StripesRecommender.run()
\ No newline at end of file
@@ -0,0 +1,41 @@
+from __future__ import print_function
+import argparse
+import os
+from FrequentItems import FrequentItems
+from PairsRecommender import PairsRecommender
+from StripesRecommender import StripesRecommender
+
+# Two pass a-priori: count the items, then only pair up the
+# frequent ones. Usage:
+#
+#   python apriori_driver.py ProductPurchaseData.txt --job pairs --support 100
+
+parser = argparse.ArgumentParser()
+parser.add_argument("path")
+parser.add_argument("--job", default="pairs", choices=["pairs", "stripes"])
+parser.add_argument("--support", default=100, type=int)
+parser.add_argument("--frequent-items", dest="frequent_items",
+                    default="frequent_items.txt",
+                    help="Where the frequent items of the first pass are written")
+args = parser.parse_args()
+support = ["--support", str(args.support)]
+
+# First pass: items with enough support
+mr_job = FrequentItems(args=[args.path] + support)
+with mr_job.make_runner() as runner:
+    runner.run()
+    with open(args.frequent_items, "w") as out:
+        for line in runner.stream_output():
+            item, count = mr_job.parse_output_line(line)
+            out.write("%s\n" % item)
+    print(runner.counters())
+
+# Second pass: pairs of frequent items only
+job_class = PairsRecommender if args.job == "pairs" else StripesRecommender
+mr_job = job_class(args=[args.path, "--frequent-items",
+                         os.path.abspath(args.frequent_items)] + support)
+with mr_job.make_runner() as runner:
+    runner.run()
+    print(runner.counters())
+    for line in runner.stream_output():
+        print(mr_job.parse_output_line(line))
@@ -0,0 +1,53 @@
+import time
+
+
+class BufferedCounters(object):
+    """
+    Mixin for MRJob that adds up counter increments in memory
+    instead of writing a reporter:counter line to stderr for each
+    one. The totals are written when the task ends, or every
+    FLUSH_SECONDS so that Hadoop still sees long tasks progress.
+    Goes before MRJob:
+
+        class IssueCounter(BufferedCounters, MRJob):
+
+    Outside of the inline runner the job needs
+    --file buffered_counters.py to import it.
+    """
+    FLUSH_SECONDS = 60
+
+    def __init__(self, *args, **kwargs):
+        super(BufferedCounters, self).__init__(*args, **kwargs)
+        self.counter_buffer = {}
+        self.last_flush = time.time()
+
+    def increment_counter(self, group, counter, amount=1):
+        key = (group, counter)
+        self.counter_buffer[key] = self.counter_buffer.get(key, 0) + amount
+        if time.time() - self.last_flush > self.FLUSH_SECONDS:
+            self.flush_counters()
+
+    def flush_counters(self):
+        for (group, counter), amount in self.counter_buffer.items():
+            super(BufferedCounters, self).increment_counter(group, counter,
+                                                            amount)
+        self.counter_buffer = {}
+        self.last_flush = time.time()
+
+    def run_mapper(self, step_num=0):
+        try:
+            super(BufferedCounters, self).run_mapper(step_num)
+        finally:
+            self.flush_counters()
+
+    def run_combiner(self, step_num=0):
+        try:
+            super(BufferedCounters, self).run_combiner(step_num)
+        finally:
+            self.flush_counters()
+
+    def run_reducer(self, step_num=0):
+        try:
+            super(BufferedCounters, self).run_reducer(step_num)
+        finally:
+            self.flush_counters()
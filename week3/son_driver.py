@@ -0,0 +1,43 @@
+from __future__ import print_function
+import argparse
+import os
+from FrequentItemsets import FrequentItemsets
+
+# Frequent itemsets of any size in two runs of FrequentItemsets
+# (the SON algorithm). Usage:
+#
+#   python son_driver.py ProductPurchaseData.txt --min-support 0.005
+
+parser = argparse.ArgumentParser()
+parser.add_argument("path")
+parser.add_argument("--min-support", dest="min_support", default=0.005,
+                    type=float)
+parser.add_argument("--max-size", dest="max_size", default=0, type=int)
+parser.add_argument("--candidates", default="candidate_itemsets.txt",
+                    help="Where the candidates of the first run are written")
+args = parser.parse_args()
+options = ["--min-support", str(args.min_support),
+           "--max-size", str(args.max_size)]
+
+# First run: itemsets frequent in at least one split
+mr_job = FrequentItemsets(args=[args.path] + options)
+with mr_job.make_runner() as runner:
+    runner.run()
+    with open(args.candidates, "w") as out:
+        for line in runner.stream_output():
+            itemset, _ = mr_job.parse_output_line(line)
+            out.write("%s\n" % itemset)
+    counters = runner.counters()
+    print(counters)
+n_baskets = sum(step.get("job stats", {}).get("number of baskets", 0)
+                for step in counters)
+
+# Second run: count the candidates over every basket
+mr_job = FrequentItemsets(args=[args.path, "--candidates",
+                                os.path.abspath(args.candidates),
+                                "--baskets", str(n_baskets)] + options)
+with mr_job.make_runner() as runner:
+    runner.run()
+    print(runner.counters())
+    for line in runner.stream_output():
+        print(mr_job.parse_output_line(line))
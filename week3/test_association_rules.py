@@ -0,0 +1,82 @@
+from __future__ import division
+import logging
+import os
+import sys
+from itertools import combinations
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from AssociationRules import AssociationRules
+
+# mrjob writes its log lines as bytes to an
+# unconfigured stderr handler otherwise.
+logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
+
+PURCHASES = os.path.join(HERE, os.pardir, "week4", "Data",
+                         "ProductPurchaseData.txt")
+
+
+def read_lines(n_lines):
+    lines = []
+    with open(PURCHASES) as f:
+        for line in f:
+            lines.append(line)
+            if len(lines) == n_lines:
+                break
+    return lines
+
+
+def brute_force_rules(lines, support, min_confidence):
+    """
+    The rules of the job, from item and pair
+    counts over all the baskets at once.
+    """
+    item_counts = {}
+    pair_counts = {}
+    for line in lines:
+        products = sorted(set(line.split()))
+        for item in products:
+            item_counts[item] = item_counts.get(item, 0) + 1
+        for pair in combinations(products, 2):
+            pair_counts[pair] = pair_counts.get(pair, 0) + 1
+    total = len(lines)
+    rules = {}
+    for (left, right), count in pair_counts.items():
+        if count < support:
+            continue
+        for item, other_item in [(left, right), (right, left)]:
+            confidence = count/item_counts[item]
+            if confidence < min_confidence:
+                continue
+            lift = confidence*total/item_counts[other_item]
+            rules["%s -> %s" % (item, other_item)] = [
+                count, round(count/total, 4),
+                round(confidence, 4), round(lift, 4)]
+    return rules
+
+
+def test_rules_match_brute_force(tmp_path):
+    lines = read_lines(2000)
+    # Two splits, so that the item counts
+    # of both mappers have to be summed.
+    paths = []
+    for part in range(2):
+        path = str(tmp_path / ("baskets-%d.txt" % part))
+        with open(path, "w") as f:
+            f.writelines(lines[part::2])
+        paths.append(path)
+    mr_job = AssociationRules(args=paths + ["--support", "20",
+                                            "--min-confidence", "0.3",
+                                            "--reduce.tasks", "3"])
+    with mr_job.make_runner() as runner:
+        runner.run()
+        rules = dict(mr_job.parse_output_line(line)
+                     for line in runner.stream_output())
+
+    expected = brute_force_rules(lines, 20, 0.3)
+    # Some pairs make a rule one way only.
+    reversed_rules = set(" -> ".join(rule.split(" -> ")[::-1])
+                         for rule in expected)
+    assert expected and set(expected) != reversed_rules
+    assert rules == expected
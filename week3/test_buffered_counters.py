@@ -0,0 +1,86 @@
+import logging
+import os
+import sys
+
+import pytest
+from mrjob.job import MRJob
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from buffered_counters import BufferedCounters
+from IssueCounter import IssueCounter
+from PairsRecommender import PairsRecommender
+
+# mrjob writes its log lines as bytes to an
+# unconfigured stderr handler otherwise.
+logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
+
+PURCHASES = os.path.join(HERE, os.pardir, "week4", "Data",
+                         "ProductPurchaseData.txt")
+
+
+def write_inputs(tmp_path, job_class):
+    # Two splits, so that there is more
+    # than one task of each kind.
+    if job_class is IssueCounter:
+        issues = ["Loan servicing", "Billing disputes", "Other"]
+        lines = ["%d,Mortgage,,%s\n" % (i, issues[i % 7 % 3])
+                 for i in range(500)]
+    else:
+        with open(PURCHASES) as f:
+            lines = [next(f) for _ in range(500)]
+    paths = []
+    for part in range(2):
+        path = str(tmp_path / ("input-%d.txt" % part))
+        with open(path, "w") as f:
+            f.writelines(lines[part::2])
+        paths.append(path)
+    return paths
+
+
+def run_job(job_class, args):
+    mr_job = job_class(args=args)
+    with mr_job.make_runner() as runner:
+        runner.run()
+        output = [mr_job.parse_output_line(line)
+                  for line in runner.stream_output()]
+        return output, runner.counters()
+
+
+@pytest.mark.parametrize("job_class, args", [
+    (IssueCounter, []),
+    (PairsRecommender, ["--support", "5"]),
+])
+def test_buffered_totals_match_per_record_counters(tmp_path, monkeypatch,
+                                                   job_class, args):
+    args = write_inputs(tmp_path, job_class) + args
+    writes = []
+    increment_counter = MRJob.increment_counter
+
+    def counted(self, group, counter, amount=1):
+        writes.append(amount)
+        increment_counter(self, group, counter, amount)
+
+    monkeypatch.setattr(MRJob, "increment_counter", counted)
+    buffered_output, buffered = run_job(job_class, args)
+    n_buffered = len(writes)
+
+    # Every increment written as it happens.
+    monkeypatch.setattr(BufferedCounters, "increment_counter", counted)
+    del writes[:]
+    output, per_record = run_job(job_class, args)
+
+    assert buffered_output == output
+    assert buffered == per_record
+    assert any(per_record)
+    assert n_buffered < len(writes)
+
+
+def test_flushes_on_the_way_when_tasks_run_long(tmp_path, monkeypatch):
+    args = write_inputs(tmp_path, IssueCounter)
+    _, expected = run_job(IssueCounter, args)
+    # Every increment is past the deadline.
+    monkeypatch.setattr(BufferedCounters, "FLUSH_SECONDS", -1)
+    _, counters = run_job(IssueCounter, args)
+    assert counters == expected
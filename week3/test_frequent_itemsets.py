@@ -0,0 +1,115 @@
+from __future__ import division
+import logging
+import os
+import sys
+from itertools import combinations
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from FrequentItemsets import FrequentItemsets, local_frequent_itemsets
+
+# mrjob writes its log lines as bytes to an
+# unconfigured stderr handler otherwise.
+logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
+
+PURCHASES = os.path.join(HERE, os.pardir, "week4", "Data",
+                         "ProductPurchaseData.txt")
+
+
+def read_baskets(n_baskets):
+    baskets = []
+    with open(PURCHASES) as f:
+        for line in f:
+            baskets.append(tuple(sorted(set(line.split()))))
+            if len(baskets) == n_baskets:
+                break
+    return baskets
+
+
+def brute_force_itemsets(baskets, threshold, max_size=0):
+    """
+    Every itemset with a count of at least
+    threshold (and at most max_size items
+    unless 0), by counting every subset of
+    the frequent items of every basket,
+    one size at a time.
+    """
+    frequent = {}
+    items = None
+    size = 1
+    while True:
+        counts = {}
+        for basket in baskets:
+            if items is not None:
+                # Any item of a frequent
+                # itemset is frequent.
+                basket = [item for item in basket if item in items]
+            for itemset in combinations(basket, size):
+                counts[itemset] = counts.get(itemset, 0) + 1
+        found = dict((itemset, count) for itemset, count in counts.items()
+                     if count >= threshold)
+        frequent.update(found)
+        if not found or size == max_size:
+            return frequent
+        if items is None:
+            items = set(item for (item,) in found)
+        size += 1
+
+
+def run_job(args):
+    mr_job = FrequentItemsets(args=args)
+    with mr_job.make_runner() as runner:
+        runner.run()
+        output = [mr_job.parse_output_line(line)
+                  for line in runner.stream_output()]
+        return output, runner.counters()
+
+
+def test_local_frequent_itemsets_match_brute_force():
+    baskets = read_baskets(1000)
+    expected = brute_force_itemsets(baskets, 15)
+    # Few buckets, so that some pairs
+    # share one with frequent pairs.
+    found = set(local_frequent_itemsets(baskets, 15, 101))
+    assert found == set(expected)
+    assert max(len(itemset) for itemset in found) >= 3
+
+
+def test_son_matches_brute_force(tmp_path):
+    baskets = read_baskets(2000)
+    # Two splits, so that the first run
+    # has two sets of local itemsets.
+    paths = []
+    for part in range(2):
+        path = str(tmp_path / ("baskets-%d.txt" % part))
+        with open(path, "w") as f:
+            for basket in baskets[part::2]:
+                f.write(" ".join(basket) + "\n")
+        paths.append(path)
+    # Some local itemsets are not frequent
+    # overall. The size limit keeps a few
+    # lookalike baskets in one split from
+    # making every subset a candidate.
+    options = ["--min-support", "0.02", "--max-size", "3"]
+
+    candidates, counters = run_job(paths + options)
+    n_baskets = sum(step.get("job stats", {}).get("number of baskets", 0)
+                    for step in counters)
+    assert n_baskets == len(baskets)
+    assert max(len(itemset.split()) for itemset, _ in candidates) >= 3
+    candidates_path = str(tmp_path / "candidates.txt")
+    with open(candidates_path, "w") as f:
+        for itemset, _ in candidates:
+            f.write("%s\n" % itemset)
+    output, _ = run_job(paths + options +
+                        ["--candidates", candidates_path,
+                         "--baskets", str(n_baskets)])
+
+    expected = brute_force_itemsets(baskets, 0.02*len(baskets), 3)
+    found = dict((tuple(itemset.split()), count)
+                 for itemset, (count, _) in output)
+    assert len(candidates) > len(output)
+    assert found == expected
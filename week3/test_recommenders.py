@@ -0,0 +1,90 @@
+from __future__ import division
+import logging
+import os
+import sys
+from itertools import combinations
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from PairsRecommender import PairsRecommender
+from StripesRecommender import StripesRecommender
+
+# mrjob writes its log lines as bytes to an
+# unconfigured stderr handler otherwise.
+logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
+
+PURCHASES = os.path.join(HERE, os.pardir, "week4", "Data",
+                         "ProductPurchaseData.txt")
+
+
+def read_baskets(n_baskets):
+    # A few baskets repeat an item, which
+    # the two jobs pair up differently.
+    baskets = []
+    with open(PURCHASES) as f:
+        for line in f:
+            baskets.append(sorted(set(line.split())))
+            if len(baskets) == n_baskets:
+                break
+    return baskets
+
+
+def brute_force_top(baskets, support, n_top=50):
+    """
+    The n_top pairs with a count of at least
+    support, ties broken by the larger pair
+    like the jobs.
+    """
+    counts = {}
+    for basket in baskets:
+        for pair in combinations(basket, 2):
+            pair = " ".join(pair)
+            counts[pair] = counts.get(pair, 0) + 1
+    top = sorted(((count, pair) for pair, count in counts.items()
+                  if count >= support), reverse=True)[:n_top]
+    return [(pair, [count, round(count/len(baskets), 3)])
+            for count, pair in top]
+
+
+def run_job(job_class, args):
+    mr_job = job_class(args=args)
+    with mr_job.make_runner() as runner:
+        runner.run()
+        return [mr_job.parse_output_line(line)
+                for line in runner.stream_output()]
+
+
+@pytest.mark.parametrize("job_class", [PairsRecommender, StripesRecommender])
+@pytest.mark.parametrize("support", [40, 60])
+def test_pruned_output_matches_unpruned(tmp_path, job_class, support):
+    baskets = read_baskets(2000)
+    # Two splits, so that there is more
+    # than one mapper and reducer.
+    paths = []
+    for part in range(2):
+        path = str(tmp_path / ("baskets-%d.txt" % part))
+        with open(path, "w") as f:
+            for basket in baskets[part::2]:
+                f.write(" ".join(basket) + "\n")
+        paths.append(path)
+    item_counts = {}
+    for basket in baskets:
+        for item in basket:
+            item_counts[item] = item_counts.get(item, 0) + 1
+    items_path = str(tmp_path / "frequent-items.txt")
+    with open(items_path, "w") as f:
+        for item, count in item_counts.items():
+            if count >= support:
+                f.write("%s\n" % item)
+    options = ["--support", str(support)]
+
+    unpruned = run_job(job_class, paths + options)
+    pruned = run_job(job_class, paths + options +
+                     ["--frequent-items", items_path])
+
+    expected = brute_force_top(baskets, support)
+    assert unpruned == expected
+    assert pruned == expected
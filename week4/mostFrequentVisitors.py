@@ -1,13 +1,22 @@
 #!/usr/bin/python
+import os
+import sys
 from mrjob.job import MRJob
 from mrjob.step import MRStep
 from mrjob.protocol import RawValueProtocol
 import re    
 import operator
+# stripes.py is shared with week3. The
+# tasks get it through FILES; the path is
+# for launching the job from the repo.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "week3"))
+from stripes import Stripe
  
 class mostFrequentVisitors(MRJob):
     
     OUTPUT_PROTOCOL = RawValueProtocol
+    FILES = ["../week3/stripes.py"]
     
     URLs = {}
 
@@ -26,12 +35,7 @@ class mostFrequentVisitors(MRJob):
         yield pageID,{custID:1}
         
     def combiner(self,pageID,visits):
-        allVisits = {}
-        for visit in visits:
-            for custID in visit.keys():
-                allVisits.setdefault(custID,0)
-                allVisits[custID] += visit[custID]
-        yield pageID,allVisits
+        yield pageID,Stripe.merge(visits)
         
     def reducer_init(self):
         with open("anonymous-msweb.data", "r") as IF:
@@ -46,11 +50,7 @@ class mostFrequentVisitors(MRJob):
                     pass
 
     def reducer(self,pageID,visits):
-        allVisits = {}
-        for visit in visits:
-            for custID in visit.keys():
-                allVisits.setdefault(custID,0)
-                allVisits[custID] += visit[custID]
+        allVisits = Stripe.merge(visits)
         custID = max(allVisits.items(), key=operator.itemgetter(1))[0]
         yield None,self.URLs[pageID]+","+pageID+","+custID+","+str(allVisits[custID])
         
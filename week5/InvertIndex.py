@@ -1,10 +1,18 @@
 
+import os
+import sys
 from mrjob.job import MRJob
 from mrjob.protocol import JSONProtocol
-from collections import Counter
+# stripes.py is shared with week3. The
+# tasks get it through FILES; the path is
+# for launching the job from the repo.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "week3"))
+from stripes import Stripe
 
 class InvertIndex(MRJob):
     MRJob.input_protocol = JSONProtocol
+    FILES = ["../week3/stripes.py"]
     
     def mapper(self, key, words):
         """
@@ -15,16 +23,10 @@ class InvertIndex(MRJob):
             yield (word, {key:n_words})
             
     def combiner(self, keys, values):
-        values_sum = Counter()
-        for val in values:
-            values_sum += Counter(val)
-        yield keys, dict(values_sum)
+        yield keys, Stripe.merge(values)
 
     def reducer(self, keys, values):
-        values_sum = Counter()
-        for val in values:
-            values_sum += Counter(val)
-        yield keys, dict(values_sum)
+        yield keys, dict(Stripe.merge(values))
         
 if __name__ == "__main__":
     InvertIndex.run()
\ No newline at end of file
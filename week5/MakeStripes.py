@@ -1,16 +1,23 @@
 
+import os
+import sys
 from mrjob.job import MRJob
-from collections import Counter
+# stripes.py is shared with week3. The
+# tasks get it through FILES; the path is
+# for launching the job from the repo.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "week3"))
+from stripes import ItemIds, Stripe
 from sys import stderr
 from re import findall
 
 class MakeStripes(MRJob):
-    def mapper_init(self):
+    FILES = ["../week3/stripes.py"]
+
+    def read_vocabs(self):
         """
         Read in index words and word list.
         """
-        self.stripes = {}
-        
         self.indexlist, self.wordslist = [],[]
         with open('vocabs', 'r') as vocabFile:
             for line in vocabFile:
@@ -23,6 +30,13 @@ class MakeStripes(MRJob):
         # Convert to sets to make lookups faster
         self.indexlist = set(self.indexlist)
         self.wordslist = set(self.wordslist)
+        # Same ids in every task, so that
+        # stripes can be sent as arrays.
+        self.word_ids = ItemIds(sorted(self.wordslist))
+
+    def mapper_init(self):
+        self.stripes = {}
+        self.read_vocabs()
     
     def mapper(self, _, lines):
         """
@@ -36,19 +50,18 @@ class MakeStripes(MRJob):
             if item in self.indexlist:
                 for val in terms:
                     if val != item and val in self.wordslist:
-                        yield item, {val:term_count}
+                        yield item, [[self.word_ids.intern(val)],
+                                     [term_count]]
         
     def combiner(self, keys, values):
-        values_sum = Counter()
-        for val in values:
-            values_sum += Counter(val)
-        yield keys, dict(values_sum)
+        yield keys, Stripe.merge(values).to_arrays()
+
+    def reducer_init(self):
+        self.read_vocabs()
 
     def reducer(self, keys, values):
-        values_sum = Counter()
-        for val in values:
-            values_sum += Counter(val)
-        yield keys, dict(values_sum)
+        stripe = Stripe.merge(values).decode(self.word_ids)
+        yield keys, dict(stripe)
         
 if __name__ == "__main__":
     MakeStripes.run()
\ No newline at end of file
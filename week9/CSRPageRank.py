@@ -0,0 +1,762 @@
+from __future__ import print_function, division
+import argparse
+import json
+import os
+from sys import stderr
+import numpy as np
+from pagerank_utils import (NodeStateProtocol, parse_adjacency_line,
+                            rank_order)
+
+
+# Per-job update rules so that each variant
+# reproduces the MR job it is named after.
+#   initial:    PR of the input nodes before
+#               the first iteration ("one" or
+#               1/n_nodes for "guess").
+#   normalized: teleport is (1-d)/n_nodes and
+#               the dangling mass is corrected
+#               by the excess total PR.
+#   discovered: what the reducer does with a
+#               node that only shows up as a
+#               link target ("reset" to PR=1,
+#               keep its incoming "mass" and
+#               emit the special keys, or
+#               "drop" it).
+#   smart:      (threshold, new weight, strict)
+#               used by --smart_updating.
+VARIANTS = {
+    "SimplePageRank": {"initial": "one",
+                       "normalized": False,
+                       "discovered": "reset",
+                       "smart": (.3, .8, True),
+                       "clamp": False},
+    "PageRank": {"initial": "guess",
+                 "normalized": True,
+                 "discovered": "mass",
+                 "smart": (.3, .75, False),
+                 "clamp": False},
+    "ComplexPageRank": {"initial": "guess",
+                        "normalized": True,
+                        "discovered": "mass",
+                        "smart": (.3, .8, True),
+                        "clamp": False},
+    "WikiPageRank": {"initial": "guess",
+                     "normalized": True,
+                     "discovered": "drop",
+                     "smart": (.3, .8, True),
+                     "clamp": True},
+}
+
+
+def update_rule(rules, d, smart, total, old_pr, n_nodes, total_pr,
+                distribute):
+    """
+    New PR of the nodes that received
+    total along their links, given the
+    mapper side totals of the iteration.
+    """
+    if rules["normalized"]:
+        excess_pr = total_pr - 1
+        to_distribute = (distribute - excess_pr)/n_nodes
+        teleport_pr = (1-d)/n_nodes
+    else:
+        to_distribute = distribute/n_nodes
+        teleport_pr = 1-d
+    new_pr = d*(total + to_distribute) + teleport_pr
+    if smart:
+        threshold, weight, strict = rules["smart"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent_diff = np.abs(new_pr - old_pr)/old_pr
+        percent_diff[old_pr == 0] = np.inf
+        if strict:
+            similar = percent_diff < threshold
+        else:
+            similar = percent_diff <= threshold
+        blended = weight*new_pr + (1-weight)*old_pr
+        new_pr = np.where(similar, blended, new_pr)
+    if rules["clamp"]:
+        new_pr[new_pr < 0] = 0
+    return new_pr
+
+
+def top_k(ids, pr, rows, k):
+    """
+    The k (node, PR) pairs of rows with
+    the highest PR, in rank_order like
+    the top k of the MapReduce jobs.
+    """
+    if k < len(rows):
+        # Only the rows tied with the k-th
+        # PR need the tie break.
+        cutoff = np.partition(pr[rows], len(rows) - k)[len(rows) - k]
+        rows = rows[pr[rows] >= cutoff]
+    pairs = [(ids[i], float(pr[i])) for i in rows]
+    return sorted(pairs, key=rank_order, reverse=True)[:k]
+
+
+class AdjacencyGraph(object):
+    def __init__(self, ids, indptr, indices, n_sources):
+        """
+        Graph in CSR form. Rows are nodes,
+        indices are link targets. The first
+        n_sources ids are the nodes that
+        appeared on the left hand side of
+        the input; the rest only appeared
+        as link targets.
+        """
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.n_sources = n_sources
+        self.n = len(ids)
+        # Nodes before with_edge_deltas
+        # added any.
+        self.n_old = self.n
+        self.out_degree = np.diff(indptr)
+        # Row index of every edge, so that
+        # scatters can be done with bincount.
+        self.edge_source = np.repeat(np.arange(self.n),
+                                     self.out_degree)
+
+    @classmethod
+    def from_file(cls, *paths):
+        index = {}
+        ids = []
+        rows = []
+        for path in paths:
+            with open(path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    key, links = parse_adjacency_line(line)
+                    if key not in index:
+                        index[key] = len(ids)
+                        ids.append(key)
+                        rows.append([])
+                    rows[index[key]].extend(links)
+        n_sources = len(ids)
+        for links in rows:
+            for link in links:
+                if link not in index:
+                    index[link] = len(ids)
+                    ids.append(link)
+        dtype = np.int32 if len(ids) < 2**31 else np.int64
+        degrees = [len(links) for links in rows]
+        degrees += [0]*(len(ids) - n_sources)
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        indices = np.fromiter((index[link] for links in rows
+                                           for link in links),
+                              dtype=dtype,
+                              count=int(indptr[-1]))
+        return cls(ids, indptr, indices, n_sources)
+
+    def save(self, cache_dir, paths=()):
+        """
+        Writes the graph to cache_dir:
+
+            indptr.npy   CSR row pointers
+            indices.npy  link targets
+            ids.json     node id of each index
+            meta.json    n_sources and the
+                         input files (path,
+                         size, mtime) it was
+                         parsed from
+
+        meta.json is written last, so a
+        cache without it is incomplete.
+        """
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        np.save(os.path.join(cache_dir, "indptr.npy"), self.indptr)
+        np.save(os.path.join(cache_dir, "indices.npy"), self.indices)
+        with open(os.path.join(cache_dir, "ids.json"), "w") as f:
+            json.dump(self.ids, f)
+        with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+            json.dump({"n_sources": self.n_sources,
+                       "inputs": _input_signature(paths)}, f)
+
+    @classmethod
+    def load(cls, cache_dir):
+        """
+        Graph saved by save(). The edge
+        arrays are memory mapped, so only
+        the ids are parsed.
+        """
+        indptr = np.load(os.path.join(cache_dir, "indptr.npy"),
+                         mmap_mode="r")
+        indices = np.load(os.path.join(cache_dir, "indices.npy"),
+                          mmap_mode="r")
+        with open(os.path.join(cache_dir, "ids.json"), "r") as f:
+            ids = json.load(f)
+        with open(os.path.join(cache_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        return cls(ids, indptr, indices, meta["n_sources"])
+
+    @classmethod
+    def from_cache(cls, cache_dir, *paths):
+        """
+        Loads the graph cached in cache_dir
+        if it was parsed from the same
+        input files, otherwise parses them
+        with from_file and caches the
+        result for the next run.
+        """
+        meta_path = os.path.join(cache_dir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta["inputs"] == _input_signature(paths):
+                return cls.load(cache_dir)
+            print("edge cache %s is stale, rebuilding" % cache_dir,
+                  file=stderr)
+            # Stops a failed rebuild from
+            # passing for complete.
+            os.remove(meta_path)
+        graph = cls.from_file(*paths)
+        graph.save(cache_dir, paths)
+        return graph
+
+    def with_edge_deltas(self, path):
+        """
+        Applies a file of edge changes, one
+        per line:
+
+            +\tsrc\tdst
+            -\tsrc\tdst
+
+        and returns the new graph with the
+        indices of the nodes whose incoming
+        PR changed: the old and new targets
+        of every source whose links
+        changed. Unknown nodes are added
+        after the existing ones, so old
+        indices stay valid, and n_old of
+        the new graph tells them apart.
+        """
+        ids = list(self.ids)
+        index = dict((node, i) for i, node in enumerate(ids))
+
+        def node_index(node):
+            if node not in index:
+                index[node] = len(ids)
+                ids.append(node)
+            return index[node]
+
+        added = []
+        deleted = []
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                op, src, dst = line.split()
+                if op == "+":
+                    added.append((node_index(src), node_index(dst)))
+                elif op == "-":
+                    deleted.append((node_index(src), node_index(dst)))
+                else:
+                    msg = "edge deltas should start with + or -"
+                    raise Exception(msg)
+
+        keep = np.ones(len(self.indices), dtype=bool)
+        for src, dst in deleted:
+            if src >= self.n:
+                continue
+            # Drop one copy of the link.
+            start, end = self.indptr[src], self.indptr[src + 1]
+            matches = np.flatnonzero(keep[start:end]
+                                     & (self.indices[start:end] == dst))
+            if len(matches):
+                keep[start + matches[0]] = False
+        sources = self.edge_source[keep]
+        targets = self.indices[keep]
+        if added:
+            new_edges = np.array(added, dtype=np.int64)
+            sources = np.concatenate([sources, new_edges[:, 0]])
+            targets = np.concatenate([targets, new_edges[:, 1]])
+        order = np.argsort(sources, kind="stable")
+        n = len(ids)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        dtype = np.int32 if n < 2**31 else np.int64
+        graph = AdjacencyGraph(ids, indptr,
+                               targets[order].astype(dtype),
+                               self.n_sources)
+        graph.n_old = self.n_old
+        changed = np.unique([src for src, _ in added + deleted])
+        changed = changed.astype(np.int64)
+        old_links, _ = _segments(self.indptr, changed[changed < self.n])
+        new_links, _ = _segments(graph.indptr, changed)
+        frontier = np.union1d(self.indices[old_links],
+                              graph.indices[new_links])
+        return graph, frontier.astype(np.int64)
+
+
+def _input_signature(paths):
+    # Changes whenever an input file does.
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append([os.path.abspath(path), stat.st_size,
+                          stat.st_mtime])
+    return signature
+
+
+def load_results(path):
+    """
+    Reads ranks written by CSRPageRank or
+    the MR jobs, with the PR either as a
+    number or inside a node dict. path
+    can also be a directory of parts, such
+    as an iteration of pagerank_driver.py
+    or the nodes of one of its checkpoints,
+    in JSON or binary node state. Special
+    keys and the slices of split hubs are
+    skipped.
+    """
+    protocol = NodeStateProtocol()
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name)
+                 for name in sorted(os.listdir(path))
+                 if not name.startswith((".", "_"))]
+    ranks = {}
+    for part in paths:
+        with open(part, "rb") as f:
+            for line in f:
+                line = line.rstrip(b"\r\n")
+                if not line.strip():
+                    continue
+                key, value = protocol.read(line)
+                if key.startswith("*"):
+                    continue
+                if isinstance(value, dict):
+                    if "hub" in value:
+                        continue
+                    value = value["PR"]
+                elif isinstance(value, list):
+                    # Links only, before the
+                    # first iteration.
+                    continue
+                ranks[key] = float(value)
+    return ranks
+
+
+def _segments(indptr, rows):
+    """
+    Positions of the entries of the given
+    CSR rows, with the row each belongs to.
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    offsets = np.cumsum(counts) - counts
+    segment = np.repeat(np.arange(len(rows)), counts)
+    positions = (np.arange(counts.sum())
+                 - np.repeat(offsets, counts)
+                 + np.repeat(starts, counts))
+    return positions, segment
+
+
+class IncrementalPageRank(object):
+    def __init__(self, graph, ranks, variant="SimplePageRank", d=.85,
+                 allow_partial=False):
+        """
+        Warm starts from the ranks of a
+        previous run (dict of node to PR)
+        and only recomputes the nodes that
+        can have moved. Follows the steady
+        state rule of variant. Every node
+        of the graph is known, so there is
+        no discovery and no smart updating.
+
+        ranks should hold every node, as a
+        full state dump does (load_results
+        of an iteration or checkpoint of
+        the MR job). A top k result file
+        does not: unless allow_partial is
+        set that is an error. If it is,
+        the missing nodes start at the
+        initial PR of the variant and are
+        all recomputed, so the run can be
+        about as long as a cold start.
+        Nodes added by with_edge_deltas
+        are never in ranks; they start the
+        same way without being an error.
+        """
+        if variant not in VARIANTS:
+            msg = "variant should be one of %s" % sorted(VARIANTS)
+            raise Exception(msg)
+        self.graph = graph
+        self.rules = VARIANTS[variant]
+        self.d = d
+        n = graph.n
+        if self.rules["initial"] == "one":
+            initial = 1.0
+        else:
+            initial = 1/n
+        self.pr = np.full(n, initial)
+        self.missing = np.ones(n, dtype=bool)
+        for i, node in enumerate(graph.ids):
+            if node in ranks:
+                self.pr[i] = ranks[node]
+                self.missing[i] = False
+        n_old = graph.n_old
+        n_missing = int(self.missing[:n_old].sum())
+        if n_missing and not allow_partial:
+            msg = """warm start is missing %d of
+                     %d nodes, use a full state
+                     dump""" % (n_missing, n_old)
+            raise Exception(msg)
+        self.dangling = graph.out_degree == 0
+        self.share = np.zeros(n)
+        has_links = ~self.dangling
+        self.share[has_links] = (self.pr[has_links]
+                                 / graph.out_degree[has_links])
+        # In-links, for pulling the PR of
+        # a few nodes at a time.
+        order = np.argsort(graph.indices, kind="stable")
+        self.in_sources = graph.edge_source[order]
+        self.in_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(graph.indices, minlength=n),
+                  out=self.in_indptr[1:])
+        self.rounds = 0
+        self.nodes_updated = 0
+
+    def dangling_term(self):
+        n = self.graph.n
+        distribute = self.pr[self.dangling].sum()
+        if self.rules["normalized"]:
+            excess_pr = self.pr.sum() - 1
+            return (distribute - excess_pr)/n
+        return distribute/n
+
+    def teleport(self):
+        if self.rules["normalized"]:
+            return (1-self.d)/self.graph.n
+        return 1-self.d
+
+    def out_links(self, rows):
+        positions, _ = _segments(self.graph.indptr, rows)
+        return np.unique(self.graph.indices[positions])
+
+    def run(self, frontier, tolerance=1e-6, max_rounds=100):
+        """
+        Recomputes the frontier nodes, then
+        the links of every node that moved
+        by more than tolerance, until none
+        did. A change in the dangling mass
+        moves every node, so it makes the
+        next round a full pass once it
+        adds up to more than tolerance.
+        """
+        graph = self.graph
+        d = self.d
+        teleport_pr = self.teleport()
+        frontier = np.union1d(frontier, np.flatnonzero(self.missing))
+        last_term = self.dangling_term()
+        for _ in range(max_rounds):
+            term = self.dangling_term()
+            if abs(d*(term - last_term)) > tolerance:
+                frontier = np.arange(graph.n)
+                last_term = term
+            if not len(frontier):
+                break
+            positions, segment = _segments(self.in_indptr, frontier)
+            incoming = np.bincount(
+                segment,
+                weights=self.share[self.in_sources[positions]],
+                minlength=len(frontier))
+            new_pr = d*(incoming + term) + teleport_pr
+            if self.rules["clamp"]:
+                new_pr[new_pr < 0] = 0
+            moved = np.abs(new_pr - self.pr[frontier]) > tolerance
+            self.pr[frontier] = new_pr
+            has_links = ~self.dangling[frontier]
+            rows = frontier[has_links]
+            self.share[rows] = self.pr[rows]/graph.out_degree[rows]
+            self.rounds += 1
+            self.nodes_updated += len(frontier)
+            frontier = self.out_links(frontier[moved])
+        return self
+
+    def results(self):
+        ids = self.graph.ids
+        for i in range(self.graph.n):
+            yield ids[i], float(self.pr[i])
+
+    def top_k(self, k):
+        return top_k(self.graph.ids, self.pr, np.arange(self.graph.n), k)
+
+
+class CSRPageRank(object):
+    def __init__(self, graph, variant="SimplePageRank", d=.85,
+                 smart_updating=False, n_nodes=None):
+        """
+        Vectorized power iteration over an
+        AdjacencyGraph that follows the
+        update rules of the MR job named by
+        variant, including the first
+        iteration discovery of dangling
+        nodes, so that results match the
+        MR path for the same options.
+
+        n_nodes is the --n_nodes guess used
+        by the normalized jobs for the
+        initial PR. Defaults to the exact
+        node count.
+        """
+        if variant not in VARIANTS:
+            msg = "variant should be one of %s" % sorted(VARIANTS)
+            raise Exception(msg)
+        self.graph = graph
+        self.variant = variant
+        self.rules = VARIANTS[variant]
+        self.d = d
+        self.smart = smart_updating
+        self.iteration = 0
+        n = graph.n
+        # Only nodes from the input are known
+        # to the mappers before the first
+        # iteration.
+        self.known = np.zeros(n, dtype=bool)
+        self.known[:graph.n_sources] = True
+        self.pr = np.zeros(n)
+        if self.rules["initial"] == "one":
+            self.pr[self.known] = 1.0
+        else:
+            n_nodes = n_nodes or n
+            self.pr[self.known] = 1/n_nodes
+        # Special key records that the
+        # reducer emits on discovery and the
+        # next mapper adds to its totals.
+        self.pending_distribute = 0.0
+        self.pending_n_nodes = 0.0
+        self.has_links = graph.out_degree > 0
+        self.has_inlinks = np.bincount(graph.indices,
+                                       minlength=n) > 0
+
+    def iterate(self):
+        graph = self.graph
+        known = self.known
+        pr = self.pr
+        d = self.d
+
+        # Mapper side totals
+        n_nodes = known.sum() + self.pending_n_nodes
+        total_pr = pr[known].sum()
+        dangling = known & ~self.has_links
+        distribute = pr[dangling].sum() + self.pending_distribute
+
+        # Distribute PR along the links
+        senders = known & self.has_links
+        to_send = np.zeros(graph.n)
+        to_send[senders] = pr[senders]/graph.out_degree[senders]
+        total = np.bincount(graph.indices,
+                            weights=to_send[graph.edge_source],
+                            minlength=graph.n)
+
+        # Reducer side update
+        new_pr = update_rule(self.rules, d, self.smart, total, pr,
+                             n_nodes, total_pr, distribute)
+
+        # Dangling nodes found as link
+        # targets for the first time
+        discovered = ~known & self.has_inlinks
+        self.pending_distribute = 0.0
+        self.pending_n_nodes = 0.0
+        rule = self.rules["discovered"]
+        if rule == "reset":
+            new_pr[discovered] = 1.0
+            known |= discovered
+        elif rule == "mass":
+            new_pr[discovered] = total[discovered]
+            self.pending_distribute = total[discovered].sum()
+            self.pending_n_nodes = float(discovered.sum())
+            known |= discovered
+        new_pr[~known] = 0
+        self.pr = new_pr
+        self.iteration += 1
+        return self
+
+    def run(self, iterations):
+        for _ in range(iterations):
+            self.iterate()
+        return self
+
+    def results(self):
+        ids = self.graph.ids
+        for i in np.flatnonzero(self.known):
+            yield ids[i], float(self.pr[i])
+
+    def top_k(self, k):
+        return top_k(self.graph.ids, self.pr, np.flatnonzero(self.known), k)
+
+
+def personalized_pagerank(graph, source, d=.85, tolerance=1e-12,
+                          max_iterations=1000):
+    """
+    Exact personalized PageRank of the
+    node at index source, by power
+    iteration. The teleport and the PR
+    of dangling nodes go back to source,
+    like the walks of PersonalizedPageRank.
+    Returns the PR of every index.
+    """
+    pr = np.zeros(graph.n)
+    pr[source] = 1
+    dangling = graph.out_degree == 0
+    # Dangling rows send nothing.
+    out_degree = np.maximum(graph.out_degree, 1)
+    for _ in range(max_iterations):
+        new_pr = d*np.bincount(graph.indices,
+                               weights=(pr/out_degree)[graph.edge_source],
+                               minlength=graph.n)
+        new_pr[source] += d*pr[dangling].sum() + 1-d
+        delta = np.abs(new_pr - pr).sum()
+        pr = new_pr
+        if delta < tolerance:
+            break
+    return pr
+
+
+def configure_options():
+    parser = argparse.ArgumentParser(
+        description="""In-memory PageRank
+        for graphs that fit in RAM.""")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument(
+        '--edge_cache',
+        dest='edge_cache',
+        help="""directory for a binary
+        copy of the graph. Built from
+        the input paths on the first
+        run, memory mapped on later
+        ones.""")
+    parser.add_argument(
+        '--variant',
+        dest='variant',
+        default="SimplePageRank",
+        choices=sorted(VARIANTS),
+        help="""MR job whose update
+        rules should be reproduced.""")
+    parser.add_argument(
+        '--n_nodes',
+        dest='n_nodes',
+        type=float,
+        help="""number of nodes used
+        for the initial PR of the
+        normalized variants. Defaults
+        to the exact node count.""")
+    parser.add_argument(
+        '--iterations',
+        dest='iterations',
+        default=5,
+        type=int,
+        help="""number of iterations
+        to perform.""")
+    parser.add_argument(
+        '--damping_factor',
+        dest='d',
+        default=.85,
+        type=float,
+        help="""Is the damping
+        factor. Must be between
+        0 and 1.""")
+    parser.add_argument(
+        '--smart_updating',
+        dest='smart_updating',
+        default="False",
+        choices=["True", "False"],
+        help="""Can be True or
+        False. If True, all updates
+        to the new PR will take into
+        account the value of the old
+        PR.""")
+    parser.add_argument(
+        '--return_top_k',
+        dest='return_top_k',
+        type=int,
+        default=100,
+        help="""Returns the results
+        with the top k highest
+        PageRank scores. 0 returns
+        every node, e.g. to warm
+        start a later run.""")
+    parser.add_argument(
+        '--warm_start',
+        dest='warm_start',
+        help="""full state of a previous
+        run to start from: an iteration
+        or checkpoint directory of
+        pagerank_driver.py (e.g. with
+        WikiPageRank), or the output of
+        --return_top_k 0.""")
+    parser.add_argument(
+        '--partial_warm_start',
+        dest='partial_warm_start',
+        action='store_true',
+        help="""accept a --warm_start
+        that lacks some nodes, such as
+        results/10-iterations.txt (top
+        100 only). The missing nodes
+        start at the initial PR.""")
+    parser.add_argument(
+        '--edge_deltas',
+        dest='edge_deltas',
+        help="""file of "+ src dst" and
+        "- src dst" lines applied to
+        the graph. With --warm_start,
+        only the nodes affected by
+        the changes are recomputed.""")
+    parser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        default=1e-6,
+        type=float,
+        help="""changes in PR below
+        this value are not passed on
+        when warm starting.""")
+    parser.add_argument(
+        '--max_rounds',
+        dest='max_rounds',
+        default=100,
+        type=int,
+        help="""upper bound on the
+        rounds of a warm started
+        update.""")
+    return parser
+
+
+if __name__ == "__main__":
+    options = configure_options().parse_args()
+    if options.edge_cache:
+        graph = AdjacencyGraph.from_cache(options.edge_cache, *options.paths)
+    else:
+        graph = AdjacencyGraph.from_file(*options.paths)
+    frontier = np.zeros(0, dtype=np.int64)
+    if options.edge_deltas:
+        graph, frontier = graph.with_edge_deltas(options.edge_deltas)
+    if options.warm_start:
+        ranks = load_results(options.warm_start)
+        page_rank = IncrementalPageRank(
+            graph, ranks, variant=options.variant, d=options.d,
+            allow_partial=options.partial_warm_start)
+        page_rank.run(frontier,
+                      tolerance=options.tolerance,
+                      max_rounds=options.max_rounds)
+        print("%d rounds, %d node updates for %d nodes"
+              % (page_rank.rounds, page_rank.nodes_updated, graph.n),
+              file=stderr)
+    else:
+        page_rank = CSRPageRank(graph,
+                                variant=options.variant,
+                                d=options.d,
+                                smart_updating=options.smart_updating == "True",
+                                n_nodes=options.n_nodes)
+        page_rank.run(options.iterations)
+    if options.return_top_k:
+        results = page_rank.top_k(options.return_top_k)
+    else:
+        results = page_rank.results()
+    for key, pr in results:
+        print("%s\t%s" % (json.dumps(key), json.dumps(pr)))
@@ -3,11 +3,17 @@ import itertools
 from mrjob.job import MRJob
 from mrjob.job import MRStep
 from mrjob.protocol import JSONProtocol
+# Needs --file pagerank_utils.py outside
+# of the inline runner.
+from pagerank_utils import (ExtrapolationOption,
+                            NodePartitioner,
+                            report_aggregates)
 from sys import stderr
 from random import random
 
-class ComplexPageRank(MRJob):
+class ComplexPageRank(ExtrapolationOption, MRJob):
     INPUT_PROTOCOL = JSONProtocol
+    SORT_VALUES = True
     
     def configure_options(self):
         super(ComplexPageRank, 
@@ -33,6 +39,14 @@ class ComplexPageRank(MRJob):
             space of the custom
             partitioner""")
         
+        self.add_file_option(
+            '--partition_file', 
+            dest='partition_file', 
+            help="""Range partitions made
+            by pagerank_utils.sample_range_partitions.
+            If not set, nodes are hashed
+            to a partition.""")
+        
         self.add_passthrough_option(
             '--iterations', 
             dest='iterations', 
@@ -60,26 +74,41 @@ class ComplexPageRank(MRJob):
             account the value of the old
             PR.""")
         
+        self.add_passthrough_option(
+            '--tolerance', 
+            dest='tolerance', 
+            type='float',
+            help="""If set, each iteration
+            reports the number of nodes
+            whose PR changed by more than
+            the tolerance in the
+            "convergence" counters and the
+            L1 change in PR in the
+            "convergence deltas" ones (see
+            pagerank_utils.report_aggregates).""")
+        
     def mapper_init(self):
         self.values = {"****Total PR": 0.0,
                        "***n_nodes": 0.0,
                        "**Distribute": 0.0}
         self.n_reducers = self.options.reducers
+        self.extrapolation = self.extrapolation_weights()
+        self.partition = NodePartitioner(self.n_reducers,
+                                         self.options.partition_file)
     
     def mapper(self, key, lines):
-        n_reducers = self.n_reducers
-        key_hash = hash(key)%n_reducers
+        key_hash = self.partition(key)
         # Handles special keys
         # Calculate new Total PR
         # each iteration
         if key in ["****Total PR"]:
-            raise StopIteration
+            return
         if key in ["**Distribute"]:
             self.values[key] += lines
-            raise StopIteration
+            return
         if key in ["***n_nodes"]:
             self.values[key] += lines
-            raise StopIteration
+            return
         # Handles the first time the 
         # mapper is called. The lists
         # are converted to dictionaries 
@@ -89,6 +118,11 @@ class ComplexPageRank(MRJob):
             default_PR = 1/n_nodes
             lines = {"links":lines, 
                      "PR": default_PR}
+        # Quadratic extrapolation picked by
+        # the driver, applied before the
+        # PR is sent on.
+        if self.extrapolation and len(lines.get("old_PR", [])) == 2:
+            lines["PR"] = self.extrapolate(lines)
         # Perform a node count each time
         self.values["***n_nodes"] += 1.0
         PR = lines["PR"]
@@ -104,10 +138,10 @@ class ComplexPageRank(MRJob):
         if n_links:
             PR_to_send = PR/n_links
             for link in links:
-                link_hash = hash(link)%n_reducers
+                link_hash = self.partition(link)
                 yield (link_hash, (link, PR_to_send))
         else:
-            self.values["**Distribute"] = PR
+            self.values["**Distribute"] += PR
 
     def mapper_final(self):
         for key, value in self.values.items():
@@ -128,10 +162,21 @@ class ComplexPageRank(MRJob):
         self.to_distribute = None
         self.n_nodes = None
         self.total_pr = None
+        self.tolerance = self.options.tolerance
+        self.extrapolate_every = self.options.extrapolate_every
+        if self.extrapolate_every and self.smart:
+            msg = """--smart_updating can not
+                       be used with --extrapolate_every"""
+            raise Exception(msg)
+        self.reporting = self.reporting_iteration()
 
     def reducer(self, hash_key, combo_values):
         gen_values = itertools.groupby(combo_values, 
                                        key=lambda x:x[0])
+        l1_delta = 0
+        n_above = 0
+        dots = {"y1.y1": 0.0, "y1.y2": 0.0, "y2.y2": 0.0,
+                "y1.y3": 0.0, "y2.y3": 0.0}
         for key, values in gen_values:
             total = 0
             node_info = None
@@ -159,6 +204,12 @@ class ComplexPageRank(MRJob):
                     percent_diff = diff/old_pr
                     if percent_diff < .3:
                         new_pr = .8*new_pr + .2*old_pr
+                if self.extrapolate_every:
+                    self.keep_iterates(node_info, new_pr, old_pr, dots)
+                delta = abs(new_pr - old_pr)
+                l1_delta += delta
+                if self.tolerance is not None and delta > self.tolerance:
+                    n_above += 1
                 node_info["PR"] = new_pr
                 yield (key, node_info)
             elif key == "****Total PR":
@@ -186,6 +237,13 @@ class ComplexPageRank(MRJob):
                 yield ("***n_nodes", 1.0)
                 yield (key, {"PR": total, 
                              "links": []})
+        if self.reporting:
+            self.report_extrapolation(dots)
+        if self.tolerance is not None:
+            report_aggregates(self, {"L1 delta": l1_delta},
+                              group="convergence deltas")
+            self.increment_counter("convergence", "nodes above tolerance",
+                                   n_above)
 
     def reducer_final(self):
         print_info = False
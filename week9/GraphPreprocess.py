@@ -0,0 +1,136 @@
+from __future__ import print_function, division
+from mrjob.job import MRJob, MRStep
+# Needs --file pagerank_utils.py outside
+# of the inline runner.
+from pagerank_utils import (GRAPH_META_FIELDS,
+                            GRAPH_META_KEY,
+                            NODE_NAME_KEY,
+                            node_partition,
+                            parse_adjacency_line)
+
+
+class GraphPreprocess(MRJob):
+    """
+    Relabels a graph with dense integer
+    ids. Nodes are hashed into pseudo
+    partitions and numbered within them;
+    every partition then gets the node
+    counts of all the others, so a node's
+    id is the number of nodes in the
+    partitions before its own plus its
+    place in it.
+
+    Link targets without a line of their
+    own get one with no links, so the
+    iterations never discover dangling
+    nodes, and every record carries its
+    out-degree as its links. The node,
+    edge and dangling counts go to the
+    graph meta file.
+    """
+    SORT_VALUES = True
+
+    def configure_options(self):
+        super(GraphPreprocess,
+              self).configure_options()
+
+        self.add_passthrough_option(
+            '--reduce.tasks',
+            dest='reducers',
+            type='int',
+            default=1,
+            help="""number of reducers
+            to use. Controls the number
+            of pseudo partitions the
+            ids are handed out in.""")
+
+    def emit_links(self, _, line):
+        if not line.strip():
+            return
+        key, links = parse_adjacency_line(line)
+        yield (key, links)
+        # Link targets without a line of
+        # their own are dangling nodes.
+        for link in links:
+            yield (link, None)
+
+    def merge_links(self, node, values):
+        links = []
+        for value in values:
+            if value is not None:
+                links.extend(value)
+        yield (node_partition(node, self.options.reducers), [node, links])
+
+    def number_nodes(self, part, nodes):
+        # Nodes arrive sorted, so the ids
+        # are the same on every run.
+        n_reducers = self.options.reducers
+        n_nodes = 0
+        n_edges = 0
+        n_dangling = 0
+        for node, links in nodes:
+            # Records start with 1 so that
+            # the counts (0) come first.
+            yield (part, [1, node, "id", part, n_nodes])
+            for link in links:
+                yield (node_partition(link, n_reducers),
+                       [1, link, "src", part, n_nodes])
+            n_nodes += 1
+            n_edges += len(links)
+            if not links:
+                n_dangling += 1
+        for k in range(n_reducers):
+            yield (k, [0, part, n_nodes, n_edges, n_dangling])
+
+    def relabel_targets(self, part, values):
+        counts = {}
+        offsets = None
+        node_id = None
+        for value in values:
+            if value[0] == 0:
+                counts[value[1]] = value[2:]
+                continue
+            if offsets is None:
+                # Every partition has sent
+                # its counts by now.
+                offsets = [0]
+                for k in range(self.options.reducers):
+                    n_nodes = counts.get(k, [0])[0]
+                    offsets.append(offsets[-1] + n_nodes)
+            _, node, tag, src_part, index = value
+            # "id" sorts before "src", so the
+            # id of the node comes first.
+            if tag == "id":
+                node_id = offsets[src_part] + index
+                yield (node_id, ["name", node])
+            else:
+                yield (offsets[src_part] + index, node_id)
+        if part == 0:
+            totals = [sum(x) for x in zip(*counts.values())]
+            for field, total in zip(GRAPH_META_FIELDS, totals):
+                yield (GRAPH_META_KEY, [field, total])
+
+    def collect_links(self, node_id, values):
+        if node_id == GRAPH_META_KEY:
+            for value in values:
+                yield (node_id, value)
+            return
+        links = []
+        for value in values:
+            if isinstance(value, list):
+                yield (NODE_NAME_KEY, [node_id, value[1]])
+            else:
+                links.append(value)
+        links.sort()
+        yield (str(node_id), [str(link) for link in links])
+
+    def steps(self):
+        return [MRStep(mapper=self.emit_links,
+                       reducer=self.merge_links),
+                MRStep(reducer=self.number_nodes),
+                MRStep(reducer=self.relabel_targets),
+                MRStep(reducer=self.collect_links)]
+
+
+if __name__ == "__main__":
+    GraphPreprocess.run()
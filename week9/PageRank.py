@@ -5,9 +5,21 @@ from mrjob.job import MRStep
 from mrjob.protocol import JSONProtocol
 from sys import stderr
 from random import random
+# Needs --file pagerank_utils.py outside
+# of the inline runner.
+from pagerank_utils import (HUB_PR_KEY,
+                            AggregatesOption,
+                            ExtrapolationOption,
+                            GraphMetaOption,
+                            NodePartitioner,
+                            SchimmyPartition,
+                            read_hub_ranks,
+                            report_aggregates)
 
-class PageRank(MRJob):
+class PageRank(GraphMetaOption, AggregatesOption, ExtrapolationOption,
+               MRJob):
     INPUT_PROTOCOL = JSONProtocol
+    SORT_VALUES = True
     
     def configure_options(self):
         super(PageRank, 
@@ -33,6 +45,14 @@ class PageRank(MRJob):
             space of the custom
             partitioner""")
         
+        self.add_file_option(
+            '--partition_file', 
+            dest='partition_file', 
+            help="""Range partitions made
+            by pagerank_utils.sample_range_partitions.
+            If not set, nodes are hashed
+            to a partition.""")
+        
         self.add_passthrough_option(
             '--iterations', 
             dest='iterations', 
@@ -60,42 +80,252 @@ class PageRank(MRJob):
             account the value of the old
             PR.""")
         
+        self.add_passthrough_option(
+            '--tolerance', 
+            dest='tolerance', 
+            type='float',
+            help="""If set, each iteration
+            reports the number of nodes
+            whose PR changed by more than
+            the tolerance in the
+            "convergence" counters and the
+            L1 change in PR in the
+            "convergence deltas" ones (see
+            pagerank_utils.report_aggregates).""")
+        
+        self.add_passthrough_option(
+            '--schimmy_dir', 
+            dest='schimmy_dir', 
+            type='str',
+            help="""Directory with the
+            adjacency lists split by
+            pseudo partition (see
+            pagerank_utils.write_schimmy_partitions).
+            If set, only PR travels through
+            the shuffle and the reducers
+            merge join the links from this
+            directory, which has to be
+            readable by every reducer.""")
+        
+        self.add_passthrough_option(
+            '--combine_buffer', 
+            dest='combine_buffer', 
+            type='int',
+            default=0,
+            help="""Max number of link
+            targets whose PR is summed
+            in the mapper before being
+            sent. 0 sends one record
+            per link.""")
+        
+        self.add_passthrough_option(
+            '--split_degree', 
+            dest='split_degree', 
+            type='int',
+            default=0,
+            help="""If set, nodes with more
+            links than this are split into
+            slices of at most this many
+            links, each on its own
+            partition, so that no reducer
+            gets all of a hub. The hub
+            keeps its PR under its own key
+            and the slices (keyed
+            "<hub>#<i>", with a "hub"
+            field) get it from --hub_ranks.
+            Needs pagerank_driver.py and
+            --iterations 1. Pair it with
+            --combine_buffer for hubs with
+            many in-links.""")
+        
+        self.add_file_option(
+            '--hub_ranks', 
+            dest='hub_ranks', 
+            help="""PR of every split hub,
+            collected from the "*Hub PR"
+            records of the previous
+            iteration by
+            pagerank_utils.write_hub_ranks.
+            Set by pagerank_driver.py.""")
+        
+    def check_options(self):
+        # Modes that can not be combined.
+        # Called by steps() and again in
+        # the tasks, which can be launched
+        # with options of their own.
+        options = self.options
+        if options.aggregates and options.iterations != 1:
+            msg = """--aggregates only holds
+                     for a single iteration"""
+            raise Exception(msg)
+        if options.aggregates and options.extrapolation:
+            # The totals were for the PRs
+            # before extrapolation.
+            msg = """--aggregates can not be
+                     used with --extrapolation"""
+            raise Exception(msg)
+        if options.extrapolation and not options.extrapolate_every:
+            # Without it there is no
+            # old_PR to extrapolate from.
+            msg = """--extrapolation needs
+                     --extrapolate_every"""
+            raise Exception(msg)
+        if options.extrapolate_every and options.smart_updating == "True":
+            msg = """--smart_updating can not
+                       be used with --extrapolate_every"""
+            raise Exception(msg)
+        if options.split_degree and (options.schimmy_dir or
+                                     options.extrapolate_every):
+            msg = """--split_degree can not be used
+                     with --schimmy_dir or
+                     --extrapolate_every"""
+            raise Exception(msg)
+        if options.split_degree and options.iterations != 1:
+            # The slices would keep the PR
+            # of the hub from the first one.
+            msg = """--split_degree needs
+                     --iterations 1, see
+                     pagerank_driver.py"""
+            raise Exception(msg)
+        
     def mapper_init(self):
+        self.check_options()
         self.values = {"****Total PR": 0.0,
                        "***n_nodes": 0.0,
                        "**Distribute": 0.0}
+        self.n_nodes = self.graph_n_nodes()
+        if self.n_nodes is not None:
+            # Nothing to count or send.
+            del self.values["***n_nodes"]
         self.n_reducers = self.options.reducers
+        self.extrapolation = self.extrapolation_weights()
+        self.aggregates = self.global_aggregates()
+        self.split_degree = self.options.split_degree
+        self.hub_ranks = {}
+        if self.options.hub_ranks:
+            self.hub_ranks = read_hub_ranks(self.options.hub_ranks)
+        self.partition = NodePartitioner(self.n_reducers,
+                                         self.options.partition_file)
+        # In-mapper combiner for the PR
+        # sent to each link.
+        self.buffer_size = self.options.combine_buffer
+        self.buffer = {}
+        self.n_messages = 0
+        
+    def flush_buffer(self):
+        self.n_messages += len(self.buffer)
+        for link, PR_to_send in self.buffer.items():
+            link_hash = self.partition(link)
+            yield (link_hash, (link, PR_to_send))
+        self.buffer = {}
+
+    def send_pr(self, links, PR_to_send):
+        if self.buffer_size:
+            buffer = self.buffer
+            for link in links:
+                buffer[link] = buffer.get(link, 0.0) + PR_to_send
+            if len(buffer) >= self.buffer_size:
+                for record in self.flush_buffer():
+                    yield record
+        else:
+            self.n_messages += len(links)
+            for link in links:
+                link_hash = self.partition(link)
+                yield (link_hash, (link, PR_to_send))
+
+    def split_node(self, key, lines):
+        """
+        Splits the links of a hub into
+        slices of --split_degree links.
+        Returns the hub, which keeps its PR
+        but no links, and the slices.
+        """
+        links = lines["links"]
+        size = self.split_degree
+        slices = []
+        for i, start in enumerate(range(0, len(links), size)):
+            slices.append(("%s#%d" % (key, i),
+                           {"PR": lines["PR"],
+                            "links": links[start:start + size],
+                            "hub": key,
+                            "part": i,
+                            "out_degree": len(links)}))
+        hub = {"PR": lines["PR"], "links": [], "split": len(slices)}
+        return hub, slices
+
+    def send_slice(self, key, lines):
+        # Slices go to the partitions after
+        # the one of their hub, so they do
+        # not share one with each other.
+        hub = lines["hub"]
+        slice_hash = ((self.partition(hub) + lines["part"] + 1)
+                      % self.n_reducers)
+        yield (slice_hash, (key, lines))
+        for record in self.send_pr(lines["links"],
+                                   lines["PR"]/lines["out_degree"]):
+            yield record
     
     def mapper(self, key, lines):
-        n_reducers = self.n_reducers
-        key_hash = hash(key)%n_reducers
+        key_hash = self.partition(key)
         # Handles special keys
         # Calculate new Total PR
         # each iteration
-        if key in ["****Total PR"]:
-            raise StopIteration
+        if key in ["****Total PR", HUB_PR_KEY]:
+            return
         if key in ["**Distribute"]:
             self.values[key] += lines
-            raise StopIteration
+            return
         if key in ["***n_nodes"]:
             self.values[key] += lines
-            raise StopIteration
+            return
         # Handles the first time the 
         # mapper is called. The lists
         # are converted to dictionaries 
         # with default PR values.
         if isinstance(lines, list):
-            n_nodes = self.options.n_nodes
+            n_nodes = self.n_nodes or self.options.n_nodes
             default_PR = 1/n_nodes
             lines = {"links":lines, 
                      "PR": default_PR}
+        # Quadratic extrapolation picked by
+        # the driver, applied before the
+        # PR is sent on.
+        if self.extrapolation and len(lines.get("old_PR", [])) == 2:
+            lines["PR"] = self.extrapolate(lines)
+        # Slices of a split hub only send
+        # PR. The hub itself is counted.
+        if "hub" in lines:
+            hub = lines["hub"]
+            if hub not in self.hub_ranks:
+                msg = """no --hub_ranks for the
+                         split hub %s""" % hub
+                raise Exception(msg)
+            lines["PR"] = self.hub_ranks[hub]
+            for record in self.send_slice(key, lines):
+                yield record
+            return
+        if self.split_degree and len(lines["links"]) > self.split_degree:
+            lines, slices = self.split_node(key, lines)
+            for slice_key, slice_lines in slices:
+                for record in self.send_slice(slice_key, slice_lines):
+                    yield record
         # Perform a node count each time
-        self.values["***n_nodes"] += 1.0
+        # unless it is already known.
+        if self.n_nodes is None:
+            self.values["***n_nodes"] += 1.0
         PR = lines["PR"]
         links = lines["links"]
         n_links = len(links)
-        # Pass node onward
-        yield (key_hash, (key, lines))
+        # Pass node onward. With schimmy
+        # the reducer already has the
+        # links on disk.
+        if self.options.schimmy_dir:
+            state = {"PR": PR}
+            if "old_PR" in lines:
+                state["old_PR"] = lines["old_PR"]
+            yield (key_hash, (key, state))
+        else:
+            yield (key_hash, (key, lines))
         # Track total PR in system
         self.values["****Total PR"] += PR
         # If it is not a dangling node
@@ -103,18 +333,27 @@ class PageRank(MRJob):
         # other links.
         if n_links:
             PR_to_send = PR/n_links
-            for link in links:
-                link_hash = hash(link)%n_reducers
-                yield (link_hash, (link, PR_to_send))
-        else:
-            self.values["**Distribute"] = PR
+            for record in self.send_pr(links, PR_to_send):
+                yield record
+        elif not lines.get("split"):
+            self.values["**Distribute"] += PR
 
     def mapper_final(self):
+        for record in self.flush_buffer():
+            yield record
+        if self.options.tolerance is not None:
+            self.increment_counter("convergence", "PR messages",
+                                   self.n_messages)
+        if self.aggregates is not None:
+            # The reducers already have
+            # the totals.
+            return
         for key, value in self.values.items():
             for k in range(self.n_reducers):
                 yield (k, (key, value))
             
     def reducer_init(self):
+        self.check_options()
         self.d = self.options.d
         smart = self.options.smart_updating
         if smart == "True":
@@ -126,12 +365,39 @@ class PageRank(MRJob):
                        be True or False"""
             raise Exception(msg)
         self.to_distribute = None
-        self.n_nodes = None
+        self.n_nodes = self.graph_n_nodes()
         self.total_pr = None
+        self.tolerance = self.options.tolerance
+        self.extrapolate_every = self.options.extrapolate_every
+        self.reporting = self.reporting_iteration()
+        self.schimmy_dir = self.options.schimmy_dir
+        aggregates = self.global_aggregates()
+        if aggregates is not None:
+            # Same values the special keys
+            # would carry, so the reducer
+            # can skip them.
+            self.total_pr = aggregates["****Total PR"]
+            if self.n_nodes is None:
+                self.n_nodes = aggregates["***n_nodes"]
+            excess_pr = self.total_pr - 1
+            weight = aggregates["**Distribute"] - excess_pr
+            self.to_distribute = weight/self.n_nodes
 
     def reducer(self, hash_key, combo_values):
         gen_values = itertools.groupby(combo_values, 
                                        key=lambda x:x[0])
+        graph = None
+        if self.schimmy_dir:
+            graph = SchimmyPartition(self.schimmy_dir, hash_key)
+        l1_delta = 0
+        n_above = 0
+        dots = {"y1.y1": 0.0, "y1.y2": 0.0, "y2.y2": 0.0,
+                "y1.y3": 0.0, "y2.y3": 0.0}
+        # Totals of the nodes sent on, for
+        # the reducers of the next iteration.
+        next_values = {"****Total PR": 0.0,
+                       "***n_nodes": 0.0,
+                       "**Distribute": 0.0}
         for key, values in gen_values:
             total = 0
             node_info = None
@@ -142,7 +408,13 @@ class PageRank(MRJob):
                 else:
                     node_info = val
 
-            if node_info:
+            if node_info and "hub" in node_info:
+                # A slice of a split hub. Its
+                # PR comes from the hub.
+                yield (key, node_info)
+            elif node_info:
+                if graph is not None:
+                    node_info["links"] = graph.links_for(key)
                 old_pr = node_info["PR"]
                 distribute = self.to_distribute or 0
                 pr = total + distribute
@@ -167,7 +439,21 @@ class PageRank(MRJob):
                     new_portion = new_pr * weight
                     old_portion = old_pr * (1-weight)
                     new_pr = new_portion + old_portion
+                if self.extrapolate_every:
+                    self.keep_iterates(node_info, new_pr, old_pr, dots)
+                delta = abs(new_pr - old_pr)
+                l1_delta += delta
+                if self.tolerance is not None and delta > self.tolerance:
+                    n_above += 1
                 node_info["PR"] = new_pr
+                next_values["****Total PR"] += new_pr
+                next_values["***n_nodes"] += 1.0
+                if node_info.get("split"):
+                    # Side record for the slices,
+                    # see write_hub_ranks.
+                    yield HUB_PR_KEY, [key, new_pr]
+                elif not node_info["links"]:
+                    next_values["**Distribute"] += new_pr
                 yield (key, node_info)
             elif key == "****Total PR":
                 self.total_pr = total
@@ -194,6 +480,21 @@ class PageRank(MRJob):
                 yield ("***n_nodes", 1.0)
                 yield (key, {"PR": total, 
                              "links": []})
+                # Counts the special records
+                # as well as the node.
+                next_values["****Total PR"] += total
+                next_values["***n_nodes"] += 2.0
+                next_values["**Distribute"] += 2*total
+        if graph is not None:
+            graph.close()
+        report_aggregates(self, next_values)
+        if self.reporting:
+            self.report_extrapolation(dots)
+        if self.tolerance is not None:
+            report_aggregates(self, {"L1 delta": l1_delta},
+                              group="convergence deltas")
+            self.increment_counter("convergence", "nodes above tolerance",
+                                   n_above)
 
     def reducer_final(self):
         print_info = False
@@ -201,6 +502,7 @@ class PageRank(MRJob):
             print("Total PageRank", self.total_pr)
         
     def steps(self):
+        self.check_options()
         iterations = self.options.iterations
         mr_steps = [MRStep(mapper_init=self.mapper_init,
                            mapper=self.mapper,
@@ -0,0 +1,340 @@
+from __future__ import print_function, division
+import argparse
+import json
+import multiprocessing
+import os
+from multiprocessing.connection import wait
+# Python 3.8+
+from multiprocessing import shared_memory
+import numpy as np
+from CSRPageRank import VARIANTS, AdjacencyGraph, top_k, update_rule
+
+# Columns of the per worker partial
+# totals of an iteration.
+KNOWN, TOTAL_PR, DANGLING_PR = 0, 1, 2
+# Columns of the totals a worker carries
+# over from discovered nodes.
+PENDING_DISTRIBUTE, PENDING_N_NODES = 0, 1
+
+
+class SharedArrays(object):
+    def __init__(self, arrays=None, specs=None):
+        """
+        numpy arrays backed by shared memory.
+        The parent builds them from arrays;
+        workers attach to them by the specs
+        (name, shape, dtype) of the parent.
+        """
+        self.blocks = {}
+        self.arrays = {}
+        if arrays is not None:
+            for key, array in arrays.items():
+                block = shared_memory.SharedMemory(create=True,
+                                                   size=max(array.nbytes, 1))
+                shared = np.ndarray(array.shape, array.dtype,
+                                    buffer=block.buf)
+                shared[...] = array
+                self.blocks[key] = block
+                self.arrays[key] = shared
+        else:
+            for key, (name, shape, dtype) in specs.items():
+                block = shared_memory.SharedMemory(name=name)
+                self.blocks[key] = block
+                self.arrays[key] = np.ndarray(shape, np.dtype(dtype),
+                                              buffer=block.buf)
+
+    def specs(self):
+        return dict((key, (self.blocks[key].name, array.shape,
+                           array.dtype.str))
+                    for key, array in self.arrays.items())
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+
+def run_worker(worker, specs, bounds, barrier, variant, d, smart,
+               iterations):
+    """
+    Updates the nodes in bounds[worker]
+    for every iteration, pulling the PR
+    of their in-links from shared memory.
+    Each iteration has two barriers: one
+    once every worker has published its
+    shares and partial totals, one once
+    the new PR is written.
+    """
+    shared = SharedArrays(specs=specs)
+    rules = VARIANTS[variant]
+    lo, hi = bounds[worker], bounds[worker + 1]
+    in_indptr = shared["in_indptr"]
+    in_sources = shared["in_sources"][in_indptr[lo]:in_indptr[hi]]
+    in_degree = np.diff(in_indptr[lo:hi + 1])
+    # Row of each in-link within the slice.
+    rows = np.repeat(np.arange(hi - lo), in_degree)
+    out_degree = shared["out_degree"][lo:hi]
+    has_links = out_degree > 0
+    has_inlinks = in_degree > 0
+    known = shared["known"][lo:hi]
+    share = shared["share"]
+    partials = shared["partials"]
+    pending = shared["pending"]
+    ranks = shared["pr"]
+
+    for iteration in range(iterations):
+        current, following = iteration % 2, (iteration + 1) % 2
+        pr = ranks[current][lo:hi]
+        is_known = known.astype(bool)
+
+        # Mapper side totals and the PR
+        # each node sends along a link.
+        senders = is_known & has_links
+        share[lo:hi] = 0
+        share[lo:hi][senders] = pr[senders]/out_degree[senders]
+        partials[worker, KNOWN] = is_known.sum()
+        partials[worker, TOTAL_PR] = pr[is_known].sum()
+        partials[worker, DANGLING_PR] = pr[is_known & ~has_links].sum()
+        barrier.wait()
+
+        carried = pending[current].sum(axis=0)
+        n_nodes = partials[:, KNOWN].sum() + carried[PENDING_N_NODES]
+        total_pr = partials[:, TOTAL_PR].sum()
+        distribute = (partials[:, DANGLING_PR].sum()
+                      + carried[PENDING_DISTRIBUTE])
+        total = np.bincount(rows, weights=share[in_sources],
+                            minlength=hi - lo)
+        new_pr = update_rule(rules, d, smart, total, pr,
+                             n_nodes, total_pr, distribute)
+
+        # Dangling nodes found as link
+        # targets for the first time.
+        discovered = ~is_known & has_inlinks
+        pending[following][worker] = 0
+        rule = rules["discovered"]
+        if rule == "reset":
+            new_pr[discovered] = 1.0
+            is_known |= discovered
+        elif rule == "mass":
+            new_pr[discovered] = total[discovered]
+            pending[following][worker, PENDING_DISTRIBUTE] = \
+                total[discovered].sum()
+            pending[following][worker, PENDING_N_NODES] = discovered.sum()
+            is_known |= discovered
+        new_pr[~is_known] = 0
+        ranks[following][lo:hi] = new_pr
+        known[:] = is_known
+        barrier.wait()
+    shared.close()
+
+
+class ParallelPageRank(object):
+    def __init__(self, graph, variant="SimplePageRank", d=.85,
+                 smart_updating=False, n_nodes=None, workers=None):
+        """
+        Runs the updates of CSRPageRank on
+        several processes. Nodes are split
+        into contiguous slices with about
+        the same number of in-links, and
+        the rank vectors live in shared
+        memory, so workers only meet at the
+        iteration barriers.
+        """
+        if variant not in VARIANTS:
+            msg = "variant should be one of %s" % sorted(VARIANTS)
+            raise Exception(msg)
+        self.graph = graph
+        self.variant = variant
+        self.rules = VARIANTS[variant]
+        self.d = d
+        self.smart = smart_updating
+        self.workers = workers or multiprocessing.cpu_count()
+        self.iteration = 0
+        n = graph.n
+        known = np.zeros(n, dtype=np.uint8)
+        known[:graph.n_sources] = 1
+        pr = np.zeros((2, n))
+        if self.rules["initial"] == "one":
+            pr[0, :graph.n_sources] = 1.0
+        else:
+            pr[0, :graph.n_sources] = 1/(n_nodes or n)
+
+        # In-links, in the order of the
+        # out-links, so sums match CSRPageRank.
+        order = np.argsort(graph.indices, kind="stable")
+        in_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(graph.indices, minlength=n),
+                  out=in_indptr[1:])
+        self.bounds = np.searchsorted(
+            in_indptr,
+            np.linspace(0, in_indptr[-1], self.workers + 1))
+        self.bounds[0] = 0
+        self.bounds[-1] = n
+        self.shared = SharedArrays({
+            "in_indptr": in_indptr,
+            "in_sources": graph.edge_source[order].astype(graph.indices.dtype),
+            "out_degree": graph.out_degree,
+            "known": known,
+            "pr": pr,
+            "share": np.zeros(n),
+            "partials": np.zeros((self.workers, 3)),
+            "pending": np.zeros((2, self.workers, 2)),
+        })
+
+    def run(self, iterations):
+        barrier = multiprocessing.Barrier(self.workers)
+        processes = [multiprocessing.Process(
+                         target=run_worker,
+                         args=(worker, self.shared.specs(),
+                               [int(x) for x in self.bounds], barrier,
+                               self.variant, self.d, self.smart,
+                               iterations))
+                     for worker in range(self.workers)]
+        for process in processes:
+            process.start()
+        # Waits on all the workers at once,
+        # so a failure in any of them stops
+        # the others instead of leaving them
+        # (and the parent) at the barrier.
+        running = dict((process.sentinel, process) for process in processes)
+        while running:
+            for sentinel in wait(list(running)):
+                process = running.pop(sentinel)
+                process.join()
+                if process.exitcode != 0:
+                    barrier.abort()
+                    for other in running.values():
+                        other.terminate()
+                    for other in running.values():
+                        other.join()
+                    msg = "worker failed with exit code %s" % process.exitcode
+                    raise Exception(msg)
+        # Carry on from where the workers
+        # stopped in a later run.
+        ranks = self.shared["pr"]
+        if iterations % 2:
+            ranks[0] = ranks[1]
+            self.shared["pending"][0] = self.shared["pending"][1]
+        self.iteration += iterations
+        return self
+
+    @property
+    def pr(self):
+        return self.shared["pr"][0]
+
+    @property
+    def known(self):
+        return self.shared["known"].astype(bool)
+
+    def results(self):
+        ids = self.graph.ids
+        pr = self.pr
+        for i in np.flatnonzero(self.known):
+            yield ids[i], float(pr[i])
+
+    def top_k(self, k):
+        return top_k(self.graph.ids, self.pr, np.flatnonzero(self.known), k)
+
+    def close(self):
+        self.shared.close(unlink=True)
+
+
+def configure_options():
+    parser = argparse.ArgumentParser(
+        description="""PageRank on all the
+        cores of one machine, for graphs
+        that fit in RAM.""")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument(
+        '--edge_cache',
+        dest='edge_cache',
+        help="""directory for a binary
+        copy of the graph (see
+        CSRPageRank.AdjacencyGraph.from_cache).""")
+    parser.add_argument(
+        '--variant',
+        dest='variant',
+        default="SimplePageRank",
+        choices=sorted(VARIANTS),
+        help="""MR job whose update
+        rules should be reproduced.""")
+    parser.add_argument(
+        '--n_nodes',
+        dest='n_nodes',
+        type=float,
+        help="""number of nodes used
+        for the initial PR of the
+        normalized variants. Defaults
+        to the exact node count.""")
+    parser.add_argument(
+        '--iterations',
+        dest='iterations',
+        default=5,
+        type=int,
+        help="""number of iterations
+        to perform.""")
+    parser.add_argument(
+        '--damping_factor',
+        dest='d',
+        default=.85,
+        type=float,
+        help="""Is the damping
+        factor. Must be between
+        0 and 1.""")
+    parser.add_argument(
+        '--smart_updating',
+        dest='smart_updating',
+        default="False",
+        choices=["True", "False"],
+        help="""Can be True or
+        False. If True, all updates
+        to the new PR will take into
+        account the value of the old
+        PR.""")
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=os.cpu_count(),
+        help="""number of worker
+        processes. Defaults to the
+        number of cores.""")
+    parser.add_argument(
+        '--return_top_k',
+        dest='return_top_k',
+        type=int,
+        default=100,
+        help="""Returns the results
+        with the top k highest
+        PageRank scores. 0 returns
+        every node.""")
+    return parser
+
+
+if __name__ == "__main__":
+    options = configure_options().parse_args()
+    if options.edge_cache:
+        graph = AdjacencyGraph.from_cache(options.edge_cache, *options.paths)
+    else:
+        graph = AdjacencyGraph.from_file(*options.paths)
+    page_rank = ParallelPageRank(graph,
+                                 variant=options.variant,
+                                 d=options.d,
+                                 smart_updating=options.smart_updating == "True",
+                                 n_nodes=options.n_nodes,
+                                 workers=options.workers)
+    try:
+        page_rank.run(options.iterations)
+        if options.return_top_k:
+            results = page_rank.top_k(options.return_top_k)
+        else:
+            results = list(page_rank.results())
+    finally:
+        page_rank.close()
+    for key, pr in results:
+        print("%s\t%s" % (json.dumps(key), json.dumps(pr)))
@@ -0,0 +1,209 @@
+from __future__ import print_function, division
+import argparse
+import json
+import os
+import time
+from sys import stderr
+import numpy as np
+from CSRPageRank import AdjacencyGraph
+
+
+def build_walk_index(graph, index_dir, n_walks=16, d=.85,
+                     seed=0, max_length=100):
+    """
+    Runs n_walks random walks from every
+    node of an AdjacencyGraph and saves
+    them in index_dir:
+
+        walks.npy     visited nodes, the
+                      walks of node i at
+                      walks[ptr[i]:ptr[i+1]]
+        walk_ptr.npy  ptr
+        ids.json      node id of each index
+        meta.json     n_walks and d
+
+    Each step continues with probability
+    d, so walks have a geometric length
+    (capped at max_length steps). Walks
+    at a dangling node jump back to their
+    source. All walks move together, one
+    numpy step at a time.
+    """
+    rng = np.random.RandomState(seed)
+    n = graph.n
+    n_total = n*n_walks
+    # Walk w starts at node w // n_walks.
+    source = np.repeat(np.arange(n, dtype=np.int64), n_walks)
+    position = source.copy()
+    alive = np.arange(n_total, dtype=np.int64)
+    walk_steps = [alive]
+    node_steps = [position.copy()]
+    for _ in range(max_length):
+        alive = alive[rng.random_sample(len(alive)) < d]
+        if not len(alive):
+            break
+        current = position[alive]
+        degree = graph.out_degree[current]
+        following = source[alive]
+        has_links = degree > 0
+        offset = (rng.random_sample(has_links.sum())
+                  * degree[has_links]).astype(np.int64)
+        start = graph.indptr[current[has_links]]
+        following[has_links] = graph.indices[start + offset]
+        position[alive] = following
+        walk_steps.append(alive)
+        node_steps.append(following)
+
+    walks = np.concatenate(walk_steps)
+    nodes = np.concatenate(node_steps)
+    # A stable sort keeps the steps of a
+    # walk in order, and the walks of a
+    # node next to each other.
+    order = np.argsort(walks, kind="stable")
+    nodes = nodes[order].astype(graph.indices.dtype)
+    lengths = np.bincount(walks, minlength=n_total)
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths.reshape(n, n_walks).sum(axis=1), out=ptr[1:])
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    np.save(os.path.join(index_dir, "walks.npy"), nodes)
+    np.save(os.path.join(index_dir, "walk_ptr.npy"), ptr)
+    with open(os.path.join(index_dir, "ids.json"), "w") as f:
+        json.dump(graph.ids, f)
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump({"n_walks": n_walks, "d": d,
+                   "max_length": max_length, "seed": seed}, f)
+
+
+class WalkIndex(object):
+    def __init__(self, index_dir):
+        """
+        Memory maps an index written by
+        build_walk_index. Only the walks
+        of the queried nodes are read from
+        disk.
+        """
+        self.walks = np.load(os.path.join(index_dir, "walks.npy"),
+                             mmap_mode="r")
+        self.ptr = np.load(os.path.join(index_dir, "walk_ptr.npy"),
+                           mmap_mode="r")
+        with open(os.path.join(index_dir, "ids.json"), "r") as f:
+            self.ids = json.load(f)
+        with open(os.path.join(index_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.n_walks = meta["n_walks"]
+        self.d = meta["d"]
+        self.index = dict((node, i) for i, node in enumerate(self.ids))
+
+    def top_k(self, node, k):
+        """
+        Top k of the personalized PageRank
+        of node. A walk visits v (1-d) times
+        PPR(v) on average, so the estimate
+        is (1-d)*visits/n_walks.
+        """
+        if node not in self.index:
+            raise Exception("unknown node %s" % node)
+        i = self.index[node]
+        visited = self.walks[self.ptr[i]:self.ptr[i + 1]]
+        nodes, visits = np.unique(visited, return_counts=True)
+        order = np.argsort(-visits, kind="stable")[:k]
+        scale = (1-self.d)/self.n_walks
+        return [(self.ids[nodes[j]], float(visits[j]*scale))
+                for j in order]
+
+
+def configure_options():
+    parser = argparse.ArgumentParser(
+        description="""Personalized PageRank
+        from precomputed random walks.
+        Given input paths, builds the
+        index. Given --query, answers
+        from the index.""")
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument(
+        '--edge_cache',
+        dest='edge_cache',
+        help="""directory for a binary
+        copy of the graph (see
+        CSRPageRank.AdjacencyGraph.from_cache).""")
+    parser.add_argument(
+        '--index_dir',
+        dest='index_dir',
+        default="walk_index",
+        help="""directory of the walk
+        index.""")
+    parser.add_argument(
+        '--n_walks',
+        dest='n_walks',
+        default=16,
+        type=int,
+        help="""number of walks stored
+        per node. The error of the
+        estimates shrinks with the
+        square root of it.""")
+    parser.add_argument(
+        '--damping_factor',
+        dest='d',
+        default=.85,
+        type=float,
+        help="""Is the damping
+        factor. Must be between
+        0 and 1.""")
+    parser.add_argument(
+        '--max_length',
+        dest='max_length',
+        default=100,
+        type=int,
+        help="""upper bound on the
+        steps of a walk.""")
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        default=0,
+        type=int)
+    parser.add_argument(
+        '--query',
+        dest='query',
+        action='append',
+        help="""node to compute the
+        personalized PageRank of.
+        Can be given more than
+        once.""")
+    parser.add_argument(
+        '--return_top_k',
+        dest='return_top_k',
+        type=int,
+        default=10,
+        help="""Returns the results
+        with the top k highest
+        PageRank scores.""")
+    return parser
+
+
+if __name__ == "__main__":
+    options = configure_options().parse_args()
+    if options.paths:
+        if options.edge_cache:
+            graph = AdjacencyGraph.from_cache(options.edge_cache,
+                                              *options.paths)
+        else:
+            graph = AdjacencyGraph.from_file(*options.paths)
+        build_walk_index(graph,
+                         options.index_dir,
+                         n_walks=options.n_walks,
+                         d=options.d,
+                         seed=options.seed,
+                         max_length=options.max_length)
+    if options.query:
+        index = WalkIndex(options.index_dir)
+        for node in options.query:
+            start = time.time()
+            results = index.top_k(node, options.return_top_k)
+            print("%s: %.2f ms" % (node, 1000*(time.time() - start)),
+                  file=stderr)
+            for key, pr in results:
+                print("%s\t%s\t%s" % (json.dumps(node),
+                                      json.dumps(key),
+                                      json.dumps(pr)))
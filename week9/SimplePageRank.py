@@ -2,12 +2,20 @@ from __future__ import division, print_function
 from sys import stderr
 import itertools
 from mrjob.job import MRJob, MRStep
+# Needs --file pagerank_utils.py outside
+# of the inline runner.
+from pagerank_utils import (GraphMetaOption,
+                            NodePartitioner,
+                            NodeProtocolOption,
+                            parse_adjacency_line,
+                            rank_order,
+                            report_aggregates)
 import json
 import heapq
 
 
 class TopList(list):
-    def __init__(self, max_size, num_position=0):
+    def __init__(self, max_size, num_position=0, order=None):
         """
         Just like a list, except the append method adds the new value to the 
         list only if it is larger than the smallest value (or if the size of 
@@ -16,25 +24,35 @@ class TopList(list):
         If each element of the list is an int or float, uses that value for 
         comparison. If the elements in the list are lists or tuples, uses the 
         list_position element of the list or tuple for the comparison.
+        If order is given, order(element) is compared instead.
         """
         self.max_size = max_size
         self.pos = num_position
+        self.order = order
         
     def _get_key(self, x):
+        if self.order is not None:
+            return self.order(x)
         return x[self.pos] if isinstance(x, (list, tuple)) else x
         
     def append(self, val):
+        # The heap holds (key, val) pairs so
+        # that it is ordered by the compared
+        # value rather than the whole tuple.
+        item = (self._get_key(val), val)
         if len(self) < self.max_size:
-            heapq.heappush(self, val)
-        elif self._get_key(self[0]) < self._get_key(val):
-            heapq.heapreplace(self, val)
+            heapq.heappush(self, item)
+        elif self[0][0] < item[0]:
+            heapq.heapreplace(self, item)
             
     def final_sort(self):
-        return sorted(self, key=self._get_key, reverse=True)
+        return [val for _, val in sorted(self, reverse=True)]
     
     
-class SimplePageRank(MRJob):
+class SimplePageRank(NodeProtocolOption, GraphMetaOption, MRJob):
     MRJob.SORT_VALUES = True
+    PHASES = ["clean", "iterate", "collect"]
+
     def configure_options(self):
         super(SimplePageRank, 
               self).configure_options()
@@ -48,6 +66,14 @@ class SimplePageRank(MRJob):
             space of the custom
             partitioner""")
         
+        self.add_file_option(
+            '--partition_file', 
+            dest='partition_file', 
+            help="""Range partitions made
+            by pagerank_utils.sample_range_partitions.
+            If not set, nodes are hashed
+            to a partition.""")
+        
         self.add_passthrough_option(
             '--iterations', 
             dest='iterations',
@@ -85,48 +111,147 @@ class SimplePageRank(MRJob):
             with the top k highest 
             PageRank scores.""")
         
+        self.add_passthrough_option(
+            '--tolerance', 
+            dest='tolerance', 
+            type='float',
+            help="""If set, each iteration
+            reports the number of nodes
+            whose PR changed by more than
+            the tolerance in the
+            "convergence" counters and the
+            L1 change in PR in the
+            "convergence deltas" ones (see
+            pagerank_utils.report_aggregates).""")
+        
+        self.add_passthrough_option(
+            '--phase', 
+            dest='phase', 
+            type='str',
+            default="all",
+            help="""Can be all, clean,
+            iterate or collect. Used by
+            pagerank_driver.py to launch
+            the steps one at a time.""")
+        
+        self.add_passthrough_option(
+            '--combine_buffer', 
+            dest='combine_buffer', 
+            type='int',
+            default=0,
+            help="""Max number of link
+            targets whose PR is summed
+            in the mapper before being
+            sent. 0 sends one record
+            per link.""")
+        
+        self.add_passthrough_option(
+            '--delta_epsilon', 
+            dest='delta_epsilon', 
+            type='float',
+            help="""If set, nodes only send
+            the change in their PR since
+            the last time they sent it,
+            and only once it is larger
+            than this value. The unsent
+            change is reported in the
+            "convergence deltas" counters.""")
+        
     def clean_data(self, _, lines):
-        key, value = lines.split("\t")
-        value = json.loads(value.replace("'", '"'))
-        links = value.keys()
+        # Also reads the output of
+        # GraphPreprocess.
+        key, links = parse_adjacency_line(lines)
         values = {"PR":1,"links":links}
-        yield (str(key), values)
+        yield (key, values)
         
     def mapper_init(self):
         self.values = {"***n_nodes": 0,
                        "**Distribute": 0}
+        self.n_nodes = self.graph_n_nodes()
+        if self.n_nodes is not None:
+            # Nothing to count or send.
+            del self.values["***n_nodes"]
         self.n_reducers = self.options.reducers
+        self.partition = NodePartitioner(self.n_reducers,
+                                         self.options.partition_file)
+        # In-mapper combiner for the PR
+        # sent to each link.
+        self.buffer_size = self.options.combine_buffer
+        self.buffer = {}
+        # Delta mode and what it left
+        # unsent, for the error bound.
+        self.epsilon = self.options.delta_epsilon
+        self.unsent = 0
+        self.n_messages = 0
+        
+    def flush_buffer(self):
+        self.n_messages += len(self.buffer)
+        for link, PR_to_send in self.buffer.items():
+            link_hash = self.partition(link)
+            yield (int(link_hash), (link, PR_to_send))
+        self.buffer = {}
     
     def mapper(self, key, line):
         
-        n_reducers = self.n_reducers
-        key_hash = hash(key)%n_reducers
+        key_hash = self.partition(key)
         
         # Perform a node count each time
-        self.values["***n_nodes"] += 1
+        # unless it is already known.
+        if self.n_nodes is None:
+            self.values["***n_nodes"] += 1
         PR = line["PR"]
         links = line["links"]
         n_links = len(links)
         
+        # In delta mode only the change
+        # since the PR last sent goes out,
+        # if it is large enough.
+        if n_links and self.epsilon is not None:
+            change = PR - line.get("sent", 0)
+            if abs(change) > self.epsilon:
+                line["sent"] = PR
+                PR = change
+            else:
+                self.unsent += abs(change)
+                # Nothing to send this time.
+                n_links = 0
+        
         # If it is not a dangling node
         # distribute its PR to the 
         # other links.
         if n_links:
             PR_to_send = PR/n_links
-            for link in links:
-                link_hash = hash(link)%n_reducers
-                yield (int(link_hash), (link, 
-                                   PR_to_send))
+            if self.buffer_size:
+                buffer = self.buffer
+                for link in links:
+                    buffer[link] = buffer.get(link, 0) + PR_to_send
+                if len(buffer) >= self.buffer_size:
+                    for record in self.flush_buffer():
+                        yield record
+            else:
+                self.n_messages += n_links
+                for link in links:
+                    link_hash = self.partition(link)
+                    yield (int(link_hash), (link, 
+                                       PR_to_send))
         # If it is a dangling node, 
         # distribute its PR to all
         # other links
-        else:
+        elif not links:
             self.values["**Distribute"] += PR
             
         # Pass original node onward
         yield (int(key_hash), (key, line))
 
     def mapper_final(self):
+        for record in self.flush_buffer():
+            yield record
+        if self.options.tolerance is not None or self.epsilon is not None:
+            self.increment_counter("convergence", "PR messages",
+                                   self.n_messages)
+        if self.epsilon is not None:
+            report_aggregates(self, {"unsent PR": self.unsent},
+                              group="convergence deltas")
         # Push special keys to each unique hash
         for key, value in self.values.items():
             for k in range(self.n_reducers):
@@ -145,8 +270,10 @@ class SimplePageRank(MRJob):
                        be True or False"""
             raise Exception(msg)
         self.to_distribute = None
-        self.n_nodes = None
+        self.n_nodes = self.graph_n_nodes()
         self.total_pr = None
+        self.tolerance = self.options.tolerance
+        self.delta = self.options.delta_epsilon is not None
 
     def reducer(self, hash_key, combo_values):
         gen_values = itertools.groupby(combo_values, 
@@ -157,6 +284,8 @@ class SimplePageRank(MRJob):
         # mrjob functionality.
         # gen_values should be treated as the standard
         # generator made available in the reduce step
+        l1_delta = 0
+        n_above = 0
         for key, values in gen_values:
             total = 0
             node_info = None
@@ -177,6 +306,11 @@ class SimplePageRank(MRJob):
             if node_info:
                 old_pr = node_info["PR"]
                 distribute = self.to_distribute or 0
+                if self.delta:
+                    # total only holds the changes,
+                    # so keep the running sum.
+                    total += node_info.get("in", 0)
+                    node_info["in"] = total
                 pr = total + distribute
                 decayed_pr = self.d * pr
                 teleport_pr = 1-self.d
@@ -191,6 +325,10 @@ class SimplePageRank(MRJob):
                     percent_diff = diff/old_pr
                     if percent_diff < .3:
                         new_pr = .8*new_pr + .2*old_pr
+                delta = abs(new_pr - old_pr)
+                l1_delta += delta
+                if self.tolerance is not None and delta > self.tolerance:
+                    n_above += 1
                 node_info["PR"] = new_pr
                 yield (key, node_info)
             elif key == "***n_nodes":
@@ -212,44 +350,70 @@ class SimplePageRank(MRJob):
                 # iteration. By making them
                 # explicitly tracked, the mapper
                 # can handle them from now on.
-                yield (key, {"PR": 1, 
-                             "links": []})
+                node_info = {"PR": 1, 
+                             "links": []}
+                if self.delta:
+                    node_info["in"] = total
+                yield (key, node_info)
+        if self.tolerance is not None:
+            report_aggregates(self, {"L1 delta": l1_delta},
+                              group="convergence deltas")
+            self.increment_counter("convergence", "nodes above tolerance",
+                                   n_above)
                 
-    def reduce_file_size(self, key, value):
-        val = value["PR"]
-        if val > .1:
-            yield ("top", (key, round(val,4)))
+    def top_in_mapper_init(self):
+        top_k = self.options.return_top_k
+        self.top_vals = TopList(top_k, order=rank_order)
+        
+    def top_in_mapper(self, key, value):
+        self.top_vals.append((key, value["PR"]))
+        
+    def top_in_mapper_final(self):
+        # Only the top k of each mapper
+        # goes to the single reducer.
+        for val in self.top_vals.final_sort():
+            yield ("top", val)
     
     def collect_in_one_file_init(self):
         top_k = self.options.return_top_k
-        self.top_vals = TopList(top_k, 1)
+        self.top_vals = TopList(top_k, order=rank_order)
     
     def collect_in_one_file(self, key, values):
         for val in values:
             self.top_vals.append(val)
             
     def collect_in_one_file_final(self):
-        for val in self.top_vals.final_sort():
-            yield val
+        for key, val in self.top_vals.final_sort():
+            yield (key, round(val,4))
 
     def steps(self):
         iterations = self.options.iterations
-        mr_steps = ([MRStep(mapper=self.clean_data)] 
-                    +
-                    [MRStep(
-                           mapper_init=self.mapper_init,
-                           mapper=self.mapper,
-                           mapper_final=self.mapper_final,
-                           reducer_init=self.reducer_init,
-                           reducer=self.reducer
-                            )]*iterations
-                    +
-                    [MRStep(mapper=self.reduce_file_size,
-                            reducer_init=self.collect_in_one_file_init,
-                            reducer=self.collect_in_one_file,
-                            reducer_final=self.collect_in_one_file_final)]
-                    )
-        return mr_steps
+        phase = self.options.phase
+        clean = [MRStep(mapper=self.clean_data)]
+        iterate = [MRStep(
+                          mapper_init=self.mapper_init,
+                          mapper=self.mapper,
+                          mapper_final=self.mapper_final,
+                          reducer_init=self.reducer_init,
+                          reducer=self.reducer
+                         )]*iterations
+        collect = [MRStep(mapper_init=self.top_in_mapper_init,
+                          mapper=self.top_in_mapper,
+                          mapper_final=self.top_in_mapper_final,
+                          reducer_init=self.collect_in_one_file_init,
+                          reducer=self.collect_in_one_file,
+                          reducer_final=self.collect_in_one_file_final)]
+        if phase == "clean":
+            return clean
+        elif phase == "iterate":
+            return iterate
+        elif phase == "collect":
+            return collect
+        elif phase == "all":
+            return clean + iterate + collect
+        msg = """--phase should be all,
+                   clean, iterate or collect"""
+        raise Exception(msg)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,24 @@
 from __future__ import division
 import itertools
 from mrjob.job import MRJob, MRStep
+# Needs --file pagerank_utils.py outside
+# of the inline runner.
+from pagerank_utils import (AggregatesOption,
+                            NodePartitioner,
+                            NodeProtocolOption,
+                            TopicLookup,
+                            parse_adjacency_line,
+                            rank_order,
+                            report_aggregates)
 import json
-from collections import defaultdict, Counter
 import heapq
 
 
 class TopList(list):
     def __init__(self, 
                  max_size, 
-                 num_position=0):
+                 num_position=0,
+                 order=None):
         """
         Just like a list, except 
         the append method adds 
@@ -27,34 +36,45 @@ class TopList(list):
         are lists or tuples, uses the 
         list_position element of the 
         list or tuple for the 
-        comparison.
+        comparison. If order is 
+        given, order(element) is 
+        compared instead.
         """
         self.max_size = max_size
         self.pos = num_position
+        self.order = order
         
     def _get_key(self, x):
+        if self.order is not None:
+            return self.order(x)
         if isinstance(x, (list, tuple)):
             return x[self.pos]
         else:
             return x
         
     def append(self, val):
+        # The heap holds (key, val) 
+        # pairs so that it is ordered
+        # by the compared value 
+        # rather than the whole tuple.
+        item = (self._get_key(val), val)
         if len(self) < self.max_size:
-            heapq.heappush(self, val)
+            heapq.heappush(self, item)
         else:
-            lowest_val = self._get_key(self[0])
-            current_val = self._get_key(val)
+            lowest_val = self[0][0]
+            current_val = item[0]
             if current_val > lowest_val:
-                heapq.heapreplace(self, val)
+                heapq.heapreplace(self, item)
                 
     def final_sort(self):
-        return sorted(self, 
-                      key=self._get_key, 
-                      reverse=True)
+        return [val for _, val in 
+                sorted(self, reverse=True)]
     
     
-class TopicPageRank(MRJob):
+class TopicPageRank(NodeProtocolOption, AggregatesOption, MRJob):
     MRJob.SORT_VALUES = True
+    PHASES = ["clean", "iterate", "collect"]
+
     def configure_options(self):
         super(TopicPageRank, 
               self).configure_options()
@@ -68,6 +88,14 @@ class TopicPageRank(MRJob):
             space of the custom
             partitioner""")
         
+        self.add_file_option(
+            '--partition_file', 
+            dest='partition_file', 
+            help="""Range partitions made
+            by pagerank_utils.sample_range_partitions.
+            If not set, nodes are hashed
+            to a partition.""")
+        
         self.add_passthrough_option(
             '--iterations', 
             dest='iterations',
@@ -96,6 +124,26 @@ class TopicPageRank(MRJob):
             account the value of the old
             PR.""")
         
+        self.add_file_option(
+            '--topics_file', 
+            dest='topics_file', 
+            help="""File with the topic of
+            every node, one "node topic"
+            pair per line as in
+            randNet_topics.txt.""")
+        
+        self.add_passthrough_option(
+            '--topic_bias', 
+            dest='topic_bias', 
+            default=.99,
+            type='float',
+            help="""Share of the teleport
+            that goes to the nodes of a
+            topic when computing its
+            vector (beta). Above .5 is
+            topic sensitive, below .5
+            anti topic sensitive.""")
+        
         self.add_passthrough_option(
             '--return_top_k', 
             dest='return_top_k', 
@@ -103,62 +151,102 @@ class TopicPageRank(MRJob):
             default=100,
             help="""Returns the results
             with the top k highest 
-            PageRank scores.""")
+            PageRank scores for each
+            topic.""")
         
-    def clean_init(self):
-        # Lazy mode
-        self.topic_map = {'24': '9', '25': '7', '26': '1', '27': '1', '20': '3', '21': '9', '22': '4', '23': '6', '28': '7', '29': '1', '4': '5', '8': '8', '59': '2', '58': '2', '55': '7', '54': '8', '57': '9', '56': '6', '51': '5', '50': '7', '53': '7', '52': '1', '88': '5', '89': '4', '82': '2', '83': '4', '80': '5', '81': '1', '86': '3', '87': '8', '84': '4', '85': '7', '3': '10', '7': '10', '100': '8', '39': '8', '38': '4', '33': '1', '32': '1', '31': '3', '30': '7', '37': '6', '36': '1', '35': '7', '34': '5', '60': '10', '61': '8', '62': '8', '63': '4', '64': '10', '65': '4', '66': '3', '67': '1', '68': '10', '69': '6', '2': '3', '6': '8', '99': '5', '98': '1', '91': '3', '90': '5', '93': '4', '92': '1', '95': '10', '94': '9', '97': '7', '96': '9', '11': '6', '10': '1', '13': '6', '12': '2', '15': '3', '14': '9', '17': '10', '16': '1', '19': '1', '18': '8', '48': '10', '49': '10', '46': '1', '47': '7', '44': '1', '45': '5', '42': '9', '43': '10', '40': '3', '41': '4', '1': '10', '5': '5', '9': '2', '77': '1', '76': '4', '75': '2', '74': '10', '73': '2', '72': '4', '71': '2', '70': '3', '79': '4', '78': '4'}
+        self.add_passthrough_option(
+            '--tolerance', 
+            dest='tolerance', 
+            type='float',
+            help="""If set, each iteration
+            reports the number of nodes
+            whose PR changed by more than
+            the tolerance in the
+            "convergence" counters and the
+            L1 change in PR in the
+            "convergence deltas" ones (see
+            pagerank_utils.report_aggregates).""")
+        
+        self.add_passthrough_option(
+            '--phase', 
+            dest='phase', 
+            type='str',
+            default="all",
+            help="""Can be all, clean,
+            iterate or collect. Used by
+            pagerank_driver.py to launch
+            the steps one at a time.""")
+        
+    def load_topics(self):
+        if not self.options.topics_file:
+            msg = """--topics_file is required,
+                       e.g. data/randNet_topics.txt"""
+            raise Exception(msg)
+        self.topics = TopicLookup(self.options.topics_file)
+        self.n_topics = len(self.topics.topics)
         
     def clean_data(self, _, lines):
-        key, value = lines.split("\t")
-        value = json.loads(value.replace("'", '"'))
-        links = value.keys()
-        values = {"PR":1,"links":links,"topic":self.topic_map[str(key)]}
-        yield (str(key), values)
+        key, links = parse_adjacency_line(lines)
+        # Every topic vector starts
+        # out uniform.
+        PR = [1/self.topics.n_nodes]*self.n_topics
+        values = {"PR":PR,"links":links,"topic":self.topic_label(key)}
+        yield (key, values)
         
+    def topic_label(self, key):
+        topic = self.topics[key]
+        if topic is None:
+            return None
+        return self.topics.topics[topic]
+
     def mapper_init(self):
-        self.values = {"***n_nodes_topics": defaultdict(int),
-                       "**Distribute_topics": defaultdict(int)}
+        self.load_topics()
+        # Dangling mass of each topic
+        # vector.
+        self.distribute = [0.0]*self.n_topics
         self.n_reducers = self.options.reducers
+        self.partition = NodePartitioner(self.n_reducers,
+                                         self.options.partition_file)
     
     def mapper(self, key, line):
-        n_reducers = self.n_reducers
-        key_hash = hash(key)%n_reducers
+        key_hash = self.partition(key)
         
-        # Perform a node count each time
         PR = line["PR"]
         links = line["links"]
-        topic = line["topic"]
         n_links = len(links)
         
         # If it is not a dangling node
         # distribute its PR to the 
-        # other links.
+        # other links, every topic
+        # in the same record.
         if n_links:
-            PR_to_send = PR/n_links
+            PR_to_send = [pr/n_links for pr in PR]
             for link in links:
-                link_hash = hash(link)%n_reducers
+                link_hash = self.partition(link)
                 yield (int(link_hash), (link, 
                                    PR_to_send))
         # If it is a dangling node, 
         # distribute its PR to all
         # other links
         else:
-            self.values["**Distribute_topics"][topic] += PR
+            for j, pr in enumerate(PR):
+                self.distribute[j] += pr
             
         # Pass original node onward
         yield (int(key_hash), (key, line))
 
     def mapper_final(self):
+        if self.global_aggregates() is not None:
+            # The reducers already have
+            # the dangling mass.
+            return
         # Push special keys to each unique hash
-        for key, value in self.values.items():
-            for k in range(self.n_reducers):
-                yield (int(k), (key, value))
+        for k in range(self.n_reducers):
+            yield (int(k), ("**Distribute", self.distribute))
                 
             
     def reducer_init(self):
-        # Lazy mode
-        self.topic_map = {'24': '9', '25': '7', '26': '1', '27': '1', '20': '3', '21': '9', '22': '4', '23': '6', '28': '7', '29': '1', '4': '5', '8': '8', '59': '2', '58': '2', '55': '7', '54': '8', '57': '9', '56': '6', '51': '5', '50': '7', '53': '7', '52': '1', '88': '5', '89': '4', '82': '2', '83': '4', '80': '5', '81': '1', '86': '3', '87': '8', '84': '4', '85': '7', '3': '10', '7': '10', '100': '8', '39': '8', '38': '4', '33': '1', '32': '1', '31': '3', '30': '7', '37': '6', '36': '1', '35': '7', '34': '5', '60': '10', '61': '8', '62': '8', '63': '4', '64': '10', '65': '4', '66': '3', '67': '1', '68': '10', '69': '6', '2': '3', '6': '8', '99': '5', '98': '1', '91': '3', '90': '5', '93': '4', '92': '1', '95': '10', '94': '9', '97': '7', '96': '9', '11': '6', '10': '1', '13': '6', '12': '2', '15': '3', '14': '9', '17': '10', '16': '1', '19': '1', '18': '8', '48': '10', '49': '10', '46': '1', '47': '7', '44': '1', '45': '5', '42': '9', '43': '10', '40': '3', '41': '4', '1': '10', '5': '5', '9': '2', '77': '1', '76': '4', '75': '2', '74': '10', '73': '2', '72': '4', '71': '2', '70': '3', '79': '4', '78': '4'}
+        self.load_topics()
         self.d = self.options.d
         smart = self.options.smart_updating
         if smart == "True":
@@ -169,8 +257,51 @@ class TopicPageRank(MRJob):
             msg = """--smart_updating should 
                        be True or False"""
             raise Exception(msg)
-        self.to_distribute_topics = Counter()
-        self.n_nodes_topics = Counter()
+        self.to_distribute = [0.0]*self.n_topics
+        aggregates = self.global_aggregates()
+        if aggregates is not None:
+            # Same value the special key
+            # would carry.
+            self.to_distribute = [
+                aggregates["**Distribute %d" % j]/self.topics.n_nodes
+                for j in range(self.n_topics)]
+        self.tolerance = self.options.tolerance
+        # Teleport vector of each topic:
+        # beta/|Tj| inside the topic and
+        # (1-beta)/(N-|Tj|) outside of it.
+        beta = self.options.topic_bias
+        n_nodes = self.topics.n_nodes
+        self.teleport_in = []
+        self.teleport_out = []
+        for size in self.topics.sizes:
+            self.teleport_in.append((1-self.d)*beta/size)
+            if n_nodes > size:
+                out = (1-self.d)*(1-beta)/(n_nodes - size)
+            else:
+                out = 0.0
+            self.teleport_out.append(out)
+
+    def update_pr(self, key, total, old_pr=None):
+        """
+        New PR of key for every topic.
+        """
+        topic = self.topics[key]
+        new_pr = []
+        for j in range(self.n_topics):
+            pr = total[j] + self.to_distribute[j]
+            if j == topic:
+                teleport_pr = self.teleport_in[j]
+            else:
+                teleport_pr = self.teleport_out[j]
+            new = self.d * pr + teleport_pr
+            if self.smart and old_pr is not None:
+                # Use old PR to inform
+                # new PR.
+                diff = abs(new - old_pr[j])
+                if old_pr[j] and diff/old_pr[j] < .3:
+                    new = .8*new + .2*old_pr[j]
+            new_pr.append(new)
+        return new_pr
 
     def reducer(self, hash_key, combo_values):
         gen_values = itertools.groupby(combo_values, 
@@ -178,93 +309,124 @@ class TopicPageRank(MRJob):
         # Hask key is a pseudo partitioner.
         # Unpack old keys as separate
         # generators.
+        n_nodes = self.topics.n_nodes
+        l1_delta = 0
+        n_above = 0
+        # Dangling mass of the nodes sent
+        # on, for the next iteration.
+        next_distribute = [0.0]*self.n_topics
         for key, values in gen_values:
-            total = 0
+            total = [0.0]*self.n_topics
             node_info = None
 
             for key, val in values:
-                # If the val is a number,
-                # accumulate total.
-                if isinstance(val, (float, int)):
-                    total += val
-                elif isinstance(val, defaultdict):
-                    if key == "**Distribute_topics":
-                        for k in val:
-                            val[k] = val[k]/self.n_nodes_topics[k]
-                        self.to_distribute_topics += Counter(val)
-                    elif key == "***n_nodes_topics":
-                        self.n_nodes_topics += Counter(val)
+                # PR sent along a link, or
+                # the dangling mass.
+                if isinstance(val, list):
+                    for j, pr in enumerate(val):
+                        total[j] += pr
                 else:
-                    if key == "**Distribute_topics":
-                        continue
                     # Means that the key-value
                     # pair corresponds to a node
                     # of the form. 
-                    # {"PR": ..., "links: [...]}
+                    # {"PR": [...], "links: [...]}
                     node_info = val
             # Most keys will reference a node, so
             # put this check first.
             if node_info:
                 old_pr = node_info["PR"]
-                distribute = self.to_distribute_topics.get(node_info["topic"]) or 0
-                pr = total + distribute
-                decayed_pr = self.d * pr
-                teleport_pr = 1-self.d
-                new_pr = decayed_pr + teleport_pr
-                if self.smart:
-                    # Use old PR to inform
-                    # new PR.
-                    diff = abs(new_pr - old_pr)
-                    percent_diff = diff/old_pr
-                    if percent_diff < .3:
-                        new_pr = .8*new_pr + .2*old_pr
+                new_pr = self.update_pr(key, total, old_pr)
+                delta = [abs(new - old) for new, old in zip(new_pr, old_pr)]
+                l1_delta += sum(delta)
+                if self.tolerance is not None and max(delta) > self.tolerance:
+                    n_above += 1
                 node_info["PR"] = new_pr
+                if not node_info["links"]:
+                    for j, pr in enumerate(new_pr):
+                        next_distribute[j] += pr
                 yield (key, node_info)
+            elif key == "**Distribute":
+                # Special keys sort before the
+                # nodes of the partition.
+                self.to_distribute = [mass/n_nodes for mass in total]
             else:
-                if key in ["***n_nodes_topics", "**Distribute_topics"]:
-                    continue
                 # Track dangling nodes.
-                yield (key, {"PR": 1, 
+                new_pr = self.update_pr(key, total)
+                for j, pr in enumerate(new_pr):
+                    next_distribute[j] += pr
+                yield (key, {"PR": new_pr, 
                              "links": [],
-                             "topic": self.topic_map[key]})
+                             "topic": self.topic_label(key)})
+        report_aggregates(self, dict(("**Distribute %d" % j, mass)
+                                     for j, mass
+                                     in enumerate(next_distribute)))
+        if self.tolerance is not None:
+            report_aggregates(self, {"L1 delta": l1_delta},
+                              group="convergence deltas")
+            self.increment_counter("convergence", "nodes above tolerance",
+                                   n_above)
                 
-    def decrease_file_size(self, key, value):
-        val = value["PR"]
-        if val > .1:
-            yield ("top", (key, round(val,4)))
+    def top_in_mapper_init(self):
+        self.load_topics()
+        top_k = self.options.return_top_k
+        self.top_vals = [TopList(top_k, order=rank_order) 
+                         for _ in self.topics.topics]
+        
+    def top_in_mapper(self, key, value):
+        for top_vals, pr in zip(self.top_vals, value["PR"]):
+            top_vals.append((key, pr))
+            
+    def top_in_mapper_final(self):
+        # Only the top k of each topic
+        # leaves the mapper.
+        for topic, top_vals in zip(self.topics.topics, 
+                                   self.top_vals):
+            for val in top_vals.final_sort():
+                yield (topic, val)
     
     def collect_init(self):
-        top_k = self.options.return_top_k
-        self.top_vals = TopList(top_k, 1)
+        self.top_k = self.options.return_top_k
     
-    def collect(self, key, values):
+    def collect(self, topic, values):
+        top_vals = TopList(self.top_k, order=rank_order)
         for val in values:
-            self.top_vals.append(val)
-            
-    def collect_final(self):
-        for val in self.top_vals.final_sort():
-            yield val
+            top_vals.append(val)
+        for val in top_vals.final_sort():
+            yield (topic, val)
 
     def steps(self):
         iterations = self.options.iterations
-        mr_steps = (
-            [MRStep(mapper_init=self.clean_init,
-                    mapper=self.clean_data)] 
-            +
-            [MRStep(
-                   mapper_init=self.mapper_init,
-                   mapper=self.mapper,
-                   mapper_final=self.mapper_final,
-                   reducer_init=self.reducer_init,
-                   reducer=self.reducer
-                    )]*iterations
-            +
-            [MRStep(mapper=self.decrease_file_size,
-                    reducer_init=self.collect_init,
-                    reducer=self.collect,
-                    reducer_final=self.collect_final)]
-                    )
-        return mr_steps
+        phase = self.options.phase
+        if self.options.aggregates and (phase != "iterate"
+                                        or iterations != 1):
+            msg = """--aggregates only holds
+                     for a single iteration"""
+            raise Exception(msg)
+        clean = [MRStep(mapper_init=self.load_topics,
+                        mapper=self.clean_data)]
+        iterate = [MRStep(
+                          mapper_init=self.mapper_init,
+                          mapper=self.mapper,
+                          mapper_final=self.mapper_final,
+                          reducer_init=self.reducer_init,
+                          reducer=self.reducer
+                         )]*iterations
+        collect = [MRStep(mapper_init=self.top_in_mapper_init,
+                          mapper=self.top_in_mapper,
+                          mapper_final=self.top_in_mapper_final,
+                          reducer_init=self.collect_init,
+                          reducer=self.collect)]
+        if phase == "clean":
+            return clean
+        elif phase == "iterate":
+            return iterate
+        elif phase == "collect":
+            return collect
+        elif phase == "all":
+            return clean + iterate + collect
+        msg = """--phase should be all,
+                   clean, iterate or collect"""
+        raise Exception(msg)
 
 
 if __name__ == "__main__":
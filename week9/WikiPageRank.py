@@ -2,12 +2,24 @@ from __future__ import print_function, division
 import itertools
 from mrjob.job import MRJob
 from mrjob.job import MRStep
-from mrjob.protocol import JSONProtocol
 from sys import stderr
 from random import random
+# Needs --file pagerank_utils.py outside
+# of the inline runner.
+from pagerank_utils import (AggregatesOption,
+                            GraphMetaOption,
+                            NodePartitioner,
+                            NodeProtocolOption,
+                            SchimmyPartition,
+                            parse_adjacency_line,
+                            report_aggregates)
 import json
 
-class WikiPageRank(MRJob):    
+class WikiPageRank(NodeProtocolOption, GraphMetaOption, AggregatesOption,
+                   MRJob):
+    SORT_VALUES = True
+    PHASES = ["clean", "iterate"]
+
     def configure_options(self):
         super(WikiPageRank, 
               self).configure_options()
@@ -32,6 +44,14 @@ class WikiPageRank(MRJob):
             space of the custom
             partitioner""")
         
+        self.add_file_option(
+            '--partition_file', 
+            dest='partition_file', 
+            help="""Range partitions made
+            by pagerank_utils.sample_range_partitions.
+            If not set, nodes are hashed
+            to a partition.""")
+        
         self.add_passthrough_option(
             '--iterations', 
             dest='iterations', 
@@ -59,48 +79,124 @@ class WikiPageRank(MRJob):
             account the value of the old
             PR.""")
         
+        self.add_passthrough_option(
+            '--tolerance', 
+            dest='tolerance', 
+            type='float',
+            help="""If set, each iteration
+            reports the number of nodes
+            whose PR changed by more than
+            the tolerance in the
+            "convergence" counters and the
+            L1 change in PR in the
+            "convergence deltas" ones (see
+            pagerank_utils.report_aggregates).""")
+        
+        self.add_passthrough_option(
+            '--phase', 
+            dest='phase', 
+            type='str',
+            default="all",
+            help="""Can be all, clean
+            or iterate. Used by
+            pagerank_driver.py to launch
+            the steps one at a time.""")
+        
+        self.add_passthrough_option(
+            '--schimmy_dir', 
+            dest='schimmy_dir', 
+            type='str',
+            help="""Directory with the
+            adjacency lists split by
+            pseudo partition (see
+            pagerank_utils.write_schimmy_partitions).
+            If set, only PR travels through
+            the shuffle and the reducers
+            merge join the links from this
+            directory, which has to be
+            readable by every reducer.""")
+        
+        self.add_passthrough_option(
+            '--block_iterations', 
+            dest='block_iterations', 
+            type='int',
+            default=0,
+            help="""If set, each reducer
+            runs up to this many
+            Gauss-Seidel sweeps over the
+            links inside its partition
+            before the next global
+            exchange. Works best with
+            --partition_file so that
+            linked nodes share a
+            partition. Every partition
+            has to fit in memory.""")
+        
+        self.add_passthrough_option(
+            '--block_tolerance', 
+            dest='block_tolerance', 
+            type='float',
+            default=1e-6,
+            help="""Stops the sweeps of a
+            partition once its L1 change
+            in PR falls below this
+            value.""")
+        
     def clean_data(self, _, lines):
-        key, value = lines.split("\t")
-        value = json.loads(value.replace("'", '"'))
-        values = value.keys()
-        yield (str(key), values)
+        # Also reads the output of
+        # GraphPreprocess.
+        key, values = parse_adjacency_line(lines)
+        yield (key, values)
         
     def mapper_init(self):
         self.values = {"****Total PR": 0.0,
                        "***n_nodes": 0.0,
                        "**Distribute": 0.0}
+        self.n_nodes = self.graph_n_nodes()
+        if self.n_nodes is not None:
+            # Nothing to count or send.
+            del self.values["***n_nodes"]
         self.n_reducers = self.options.reducers
+        self.partition = NodePartitioner(self.n_reducers,
+                                         self.options.partition_file)
+        self.block_mode = bool(self.options.block_iterations)
     
     def mapper(self, key, lines):
-        n_reducers = self.n_reducers
-        key_hash = hash(key)%n_reducers
+        key_hash = self.partition(key)
         # Handles special keys
         # Calculate new Total PR
         # each iteration
         if key in ["****Total PR"]:
-            raise StopIteration
+            return
         if key in ["**Distribute"]:
             self.values[key] += lines
-            raise StopIteration
+            return
         if key in ["***n_nodes"]:
             self.values[key] += lines
-            raise StopIteration
+            return
         # Handles the first time the 
         # mapper is called. The lists
         # are converted to dictionaries 
         # with default PR values.
         if isinstance(lines, list):
-            n_nodes = self.options.n_nodes
+            n_nodes = self.n_nodes or self.options.n_nodes
             default_PR = 1/n_nodes
             lines = {"links":lines, 
                      "PR": default_PR}
         # Perform a node count each time
-        self.values["***n_nodes"] += 1.0
+        # unless it is already known.
+        if self.n_nodes is None:
+            self.values["***n_nodes"] += 1.0
         PR = lines["PR"]
         links = lines["links"]
         n_links = len(links)
-        # Pass node onward
-        yield (key_hash, (key, lines))
+        # Pass node onward. With schimmy
+        # the reducer already has the
+        # links on disk.
+        if self.options.schimmy_dir:
+            yield (key_hash, (key, {"PR": PR}))
+        else:
+            yield (key_hash, (key, lines))
         # Track total PR in system
         self.values["****Total PR"] += PR
         # If it is not a dangling node
@@ -109,12 +205,21 @@ class WikiPageRank(MRJob):
         if n_links:
             PR_to_send = PR/n_links
             for link in links:
-                link_hash = hash(link)%n_reducers
+                link_hash = self.partition(link)
+                # In block mode the reducer
+                # handles links inside the
+                # partition itself.
+                if self.block_mode and link_hash == key_hash:
+                    continue
                 yield (link_hash, (link, PR_to_send))
         else:
-            self.values["**Distribute"] = PR
+            self.values["**Distribute"] += PR
 
     def mapper_final(self):
+        if self.global_aggregates() is not None:
+            # The reducers already have
+            # the totals.
+            return
         for key, value in self.values.items():
             for k in range(self.n_reducers):
                 yield (k, (key, value))
@@ -131,12 +236,48 @@ class WikiPageRank(MRJob):
                        be True or False"""
             raise Exception(msg)
         self.to_distribute = None
-        self.n_nodes = None
+        self.n_nodes = self.graph_n_nodes()
         self.total_pr = None
+        self.tolerance = self.options.tolerance
+        self.schimmy_dir = self.options.schimmy_dir
+        self.block_iterations = self.options.block_iterations
+        self.block_tolerance = self.options.block_tolerance
+        if self.block_iterations and self.smart:
+            msg = """--smart_updating can not
+                       be used with --block_iterations"""
+            raise Exception(msg)
+        aggregates = self.global_aggregates()
+        if aggregates is not None:
+            # Same values the special keys
+            # would carry, so the reducer
+            # can skip them.
+            self.total_pr = aggregates["****Total PR"]
+            if self.n_nodes is None:
+                self.n_nodes = aggregates["***n_nodes"]
+            extra_mass = aggregates["**Distribute"]
+            excess_pr = self.total_pr - 1
+            weight = extra_mass - excess_pr
+            self.to_distribute = weight/self.n_nodes
+
+    def count_node(self, next_values, node_info):
+        # Totals of the nodes sent on, for
+        # the reducers of the next iteration.
+        next_values["****Total PR"] += node_info["PR"]
+        next_values["***n_nodes"] += 1.0
+        if not node_info["links"]:
+            next_values["**Distribute"] += node_info["PR"]
 
     def reducer(self, hash_key, combo_values):
         gen_values = itertools.groupby(combo_values, 
                                        key=lambda x:x[0])
+        graph = None
+        if self.schimmy_dir:
+            graph = SchimmyPartition(self.schimmy_dir, hash_key)
+        l1_delta = 0
+        n_above = 0
+        next_values = {"****Total PR": 0.0,
+                       "***n_nodes": 0.0,
+                       "**Distribute": 0.0}
         for key, values in gen_values:
             total = 0
             node_info = None
@@ -148,6 +289,8 @@ class WikiPageRank(MRJob):
                     node_info = val
 
             if node_info:
+                if graph is not None:
+                    node_info["links"] = graph.links_for(key)
                 old_pr = node_info["PR"]
                 distribute = self.to_distribute or 0
                 pr = total + distribute
@@ -166,7 +309,12 @@ class WikiPageRank(MRJob):
                         new_pr = .8*new_pr + .2*old_pr
                 if new_pr < 0:
                     new_pr = 0
+                delta = abs(new_pr - old_pr)
+                l1_delta += delta
+                if self.tolerance is not None and delta > self.tolerance:
+                    n_above += 1
                 node_info["PR"] = new_pr
+                self.count_node(next_values, node_info)
                 yield (key, node_info)
             elif key == "****Total PR":
                 self.total_pr = total
@@ -194,6 +342,132 @@ class WikiPageRank(MRJob):
                 yield ("***n_nodes", 1.0)
                 yield (key, {"PR": total, 
                              "links": []})
+        if graph is not None:
+            graph.close()
+        report_aggregates(self, next_values)
+        if self.tolerance is not None:
+            report_aggregates(self, {"L1 delta": l1_delta},
+                              group="convergence deltas")
+            self.increment_counter("convergence", "nodes above tolerance",
+                                   n_above)
+
+    def block_reducer(self, hash_key, combo_values):
+        """
+        Block mode. Gathers the nodes of the
+        partition with the PR sent from other
+        partitions, then runs Gauss-Seidel
+        sweeps over the links inside the
+        partition. The PR from outside stays
+        fixed until the next global exchange.
+        The dangling and excess PR spread over
+        every node starts from the global
+        totals and follows the changes made
+        in the partition.
+        """
+        gen_values = itertools.groupby(combo_values, 
+                                       key=lambda x:x[0])
+        graph = None
+        if self.schimmy_dir:
+            graph = SchimmyPartition(self.schimmy_dir, hash_key)
+        nodes = []
+        node_infos = {}
+        external = {}
+        for key, values in gen_values:
+            total = 0
+            node_info = None
+
+            for key, val in values:
+                if isinstance(val, float):
+                    total += val
+                else:
+                    node_info = val
+
+            if node_info:
+                if graph is not None:
+                    node_info["links"] = graph.links_for(key)
+                nodes.append(key)
+                node_infos[key] = node_info
+                external[key] = total
+            elif key == "****Total PR":
+                self.total_pr = total
+            elif key == "***n_nodes":
+                self.n_nodes = total
+            elif key == "**Distribute":
+                # Same correction for excess
+                # PR as the global mode, or
+                # the total would only decay
+                # towards 1 at rate d.
+                excess_pr = self.total_pr - 1
+                weight = total - excess_pr
+                self.to_distribute = weight/self.n_nodes
+            # Dangling nodes found as link
+            # targets are dropped, as in the
+            # global mode.
+        if graph is not None:
+            graph.close()
+
+        # Links inside the partition,
+        # reversed, and the current PR
+        # of every node.
+        inlinks = dict((key, []) for key in nodes)
+        pr = {}
+        n_links = {}
+        for key in nodes:
+            links = node_infos[key]["links"]
+            pr[key] = node_infos[key]["PR"]
+            n_links[key] = len(links)
+            for link in links:
+                if link in inlinks:
+                    inlinks[link].append(key)
+
+        distribute = self.to_distribute or 0
+        teleport_pr = (1-self.d)/self.n_nodes
+        sweeps = 0
+        for sweep in range(self.block_iterations):
+            sweeps += 1
+            local_delta = 0
+            for key in nodes:
+                # Updated values are used as
+                # soon as they are known.
+                internal = 0
+                for link in inlinks[key]:
+                    internal += pr[link]/n_links[link]
+                new_pr = self.d*(external[key] + internal + distribute)
+                new_pr += teleport_pr
+                if new_pr < 0:
+                    new_pr = 0
+                local_delta += abs(new_pr - pr[key])
+                if n_links[key]:
+                    # The dangling share is what
+                    # the nodes with links do not
+                    # pass on, so it moves with
+                    # them as in the global mode.
+                    distribute -= (new_pr - pr[key])/self.n_nodes
+                pr[key] = new_pr
+            if local_delta < self.block_tolerance:
+                break
+
+        l1_delta = 0
+        n_above = 0
+        next_values = {"****Total PR": 0.0,
+                       "***n_nodes": 0.0,
+                       "**Distribute": 0.0}
+        for key in nodes:
+            node_info = node_infos[key]
+            delta = abs(pr[key] - node_info["PR"])
+            l1_delta += delta
+            if self.tolerance is not None and delta > self.tolerance:
+                n_above += 1
+            node_info["PR"] = pr[key]
+            self.count_node(next_values, node_info)
+            yield (key, node_info)
+        report_aggregates(self, next_values)
+        self.increment_counter("convergence", "block sweeps", sweeps)
+        if self.tolerance is not None:
+            report_aggregates(self, {"L1 delta": l1_delta},
+                              group="convergence deltas")
+            self.increment_counter("convergence", "nodes above tolerance",
+                                   n_above)
 
     def reducer_final(self):
         print_info = False
@@ -204,18 +478,33 @@ class WikiPageRank(MRJob):
         
     def steps(self):
         iterations = self.options.iterations
-        mr_steps = ([MRStep(mapper=self.clean_data)] 
-                    +
-                    [MRStep(
-                           mapper_init=self.mapper_init,
-                           mapper=self.mapper,
-                           mapper_final=self.mapper_final,
-                           reducer_init=self.reducer_init,
-                           reducer=self.reducer,
-                           reducer_final=self.reducer_final
-                            )]*iterations
-                   )
-        return mr_steps
+        phase = self.options.phase
+        if self.options.aggregates and (phase != "iterate"
+                                        or iterations != 1):
+            msg = """--aggregates only holds
+                     for a single iteration"""
+            raise Exception(msg)
+        clean = [MRStep(mapper=self.clean_data)]
+        if phase == "clean":
+            return clean
+        reducer = self.reducer
+        if self.options.block_iterations:
+            reducer = self.block_reducer
+        iterate = [MRStep(
+                          mapper_init=self.mapper_init,
+                          mapper=self.mapper,
+                          mapper_final=self.mapper_final,
+                          reducer_init=self.reducer_init,
+                          reducer=reducer,
+                          reducer_final=self.reducer_final
+                         )]*iterations
+        if phase == "iterate":
+            return iterate
+        elif phase == "all":
+            return clean + iterate
+        msg = """--phase should be all,
+                   clean or iterate"""
+        raise Exception(msg)
 
 
 if __name__ == "__main__":
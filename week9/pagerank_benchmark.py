@@ -0,0 +1,463 @@
+from __future__ import print_function, division
+import argparse
+import glob
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from sys import stderr
+import numpy as np
+from CSRPageRank import AdjacencyGraph, CSRPageRank
+from pagerank_driver import run_until_converged
+from pagerank_utils import TopicLookup
+
+JOBS = ["SimplePageRank", "PageRank", "ComplexPageRank",
+        "WikiPageRank", "TopicPageRank"]
+# Jobs that take a --n_nodes guess.
+N_NODES_JOBS = ["PageRank", "ComplexPageRank", "WikiPageRank"]
+
+
+def dedupe_edges(n_nodes, sources, targets):
+    """
+    Drops repeated edges. The edges come
+    back sorted by source, then target.
+    """
+    keys = np.unique(sources.astype(np.int64)*n_nodes + targets)
+    return keys // n_nodes, keys % n_nodes
+
+
+def rmat_edges(n_nodes, edge_factor=8, a=.57, b=.19, c=.19, seed=0):
+    """
+    Edges of an R-MAT graph with about
+    edge_factor*n_nodes edges. Every
+    edge picks a quadrant of the
+    adjacency matrix for each bit of
+    the node ids, with probabilities a,
+    b, c and 1-a-b-c, which gives power
+    law in and out degrees. Ids are
+    shuffled so that the hubs are not
+    all small numbers. Self loops and
+    repeated edges are dropped.
+    """
+    rng = np.random.RandomState(seed)
+    scale = max(1, int(np.ceil(np.log2(n_nodes))))
+    n_edges = int(edge_factor*n_nodes)
+    sources = []
+    targets = []
+    found = 0
+    while found < n_edges:
+        size = n_edges - found
+        src = np.zeros(size, dtype=np.int64)
+        dst = np.zeros(size, dtype=np.int64)
+        for level in range(scale):
+            r = rng.random_sample(size)
+            src_bit = r >= a + b
+            dst_bit = ((r >= a) & (r < a + b)) | (r >= a + b + c)
+            src |= src_bit.astype(np.int64) << level
+            dst |= dst_bit.astype(np.int64) << level
+        # Ids past n_nodes only exist when
+        # it is not a power of two.
+        keep = (src < n_nodes) & (dst < n_nodes) & (src != dst)
+        sources.append(src[keep])
+        targets.append(dst[keep])
+        found += keep.sum()
+    relabel = rng.permutation(n_nodes)
+    return dedupe_edges(n_nodes,
+                        relabel[np.concatenate(sources)],
+                        relabel[np.concatenate(targets)])
+
+
+def barabasi_albert_edges(n_nodes, m=4, seed=0):
+    """
+    Edges of a Barabasi-Albert graph.
+    Starting from a fully linked core of
+    m+1 nodes, every new node links to m
+    nodes picked in proportion to their
+    degree, so in-degrees follow a power
+    law. Nodes are added in batches of up
+    to an eighth of the graph so far,
+    all drawing from the degrees at the
+    start of the batch, which keeps it
+    vectorized.
+    """
+    if n_nodes <= m:
+        raise Exception("n_nodes should be larger than m")
+    rng = np.random.RandomState(seed)
+    core = m + 1
+    core_sources = np.repeat(np.arange(core), m)
+    core_targets = (core_sources + 1 + np.tile(np.arange(m), core)) % core
+    n_edges = len(core_sources) + (n_nodes - core)*m
+    sources = np.empty(n_edges, dtype=np.int64)
+    targets = np.empty(n_edges, dtype=np.int64)
+    # Both ends of every edge, so that a
+    # uniform pick is a pick by degree.
+    endpoints = np.empty(2*n_edges, dtype=np.int64)
+    n_core = len(core_sources)
+    sources[:n_core] = core_sources
+    targets[:n_core] = core_targets
+    endpoints[:2*n_core] = np.concatenate([core_sources, core_targets])
+    start = core
+    done = n_core
+    while start < n_nodes:
+        batch = min(n_nodes - start, max(1, start // 8))
+        size = batch*m
+        new = np.repeat(np.arange(start, start + batch), m)
+        picks = endpoints[rng.randint(0, 2*done, size=size)]
+        sources[done:done + size] = new
+        targets[done:done + size] = picks
+        endpoints[2*done:2*done + size] = new
+        endpoints[2*done + size:2*(done + size)] = picks
+        done += size
+        start += batch
+    return dedupe_edges(n_nodes, sources, targets)
+
+
+def make_graph(generator, n_nodes, edge_factor=8, seed=0):
+    """
+    AdjacencyGraph from one of the
+    generators. Node i has id str(i) and
+    every node is a source, dangling or
+    not, so no job discovers nodes on
+    its first iteration.
+    """
+    if generator == "rmat":
+        sources, targets = rmat_edges(n_nodes, edge_factor, seed=seed)
+    elif generator == "ba":
+        sources, targets = barabasi_albert_edges(n_nodes,
+                                                 max(1, edge_factor // 2),
+                                                 seed=seed)
+    else:
+        raise Exception("generator should be rmat or ba")
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n_nodes), out=indptr[1:])
+    dtype = np.int32 if n_nodes < 2**31 else np.int64
+    ids = [str(node) for node in range(n_nodes)]
+    return AdjacencyGraph(ids, indptr, targets.astype(dtype), n_nodes)
+
+
+def write_graph(graph, path):
+    # Same format as PageRank-test.txt,
+    # which every job can read.
+    with open(path, "w") as f:
+        for node in range(graph.n):
+            links = graph.indices[graph.indptr[node]:graph.indptr[node + 1]]
+            f.write('"%d"\t[%s]\n' % (node, ", ".join('"%d"' % link
+                                                    for link in links)))
+
+
+def write_topics(graph, path, n_topics, seed=0):
+    # Same format as randNet_topics.txt.
+    rng = np.random.RandomState(seed)
+    topics = rng.randint(1, n_topics + 1, size=graph.n)
+    with open(path, "w") as f:
+        for node, topic in enumerate(topics):
+            f.write("%d\t%d\n" % (node, topic))
+
+
+def topic_reference(graph, topics, d=.85, topic_bias=.99,
+                    tolerance=1e-12, max_iterations=1000):
+    """
+    Topic sensitive PageRank as computed
+    by TopicPageRank, iterated until the
+    L1 change of every vector is below
+    tolerance. Returns an n x topics
+    array.
+    """
+    n = graph.n
+    n_topics = len(topics.topics)
+    n_nodes = topics.n_nodes
+    sizes = np.array(topics.sizes, dtype=float)
+    topic_of = np.array([-1 if topics[node] is None else topics[node]
+                         for node in graph.ids])
+    outside = np.where(n_nodes > sizes, n_nodes - sizes, 1)
+    teleport = np.where(topic_of[:, None] == np.arange(n_topics),
+                        (1-d)*topic_bias/sizes,
+                        np.where(n_nodes > sizes,
+                                 (1-d)*(1-topic_bias)/outside, 0))
+    has_links = graph.out_degree > 0
+    pr = np.full((n, n_topics), 1/n_nodes)
+    for _ in range(max_iterations):
+        share = np.zeros((n, n_topics))
+        share[has_links] = pr[has_links]/graph.out_degree[has_links, None]
+        total = np.column_stack([
+            np.bincount(graph.indices,
+                        weights=share[graph.edge_source, j],
+                        minlength=n)
+            for j in range(n_topics)])
+        distribute = pr[~has_links].sum(axis=0)/n_nodes
+        new_pr = d*(total + distribute) + teleport
+        change = np.abs(new_pr - pr).sum(axis=0).max()
+        pr = new_pr
+        if change < tolerance:
+            break
+    return pr
+
+
+def reference_ranks(job, graph, topics=None, d=.85,
+                    tolerance=1e-12, max_iterations=1000):
+    """
+    Converged ranks for the update rules
+    of job, from CSRPageRank (or
+    topic_reference for TopicPageRank).
+    """
+    if job == "TopicPageRank":
+        return topic_reference(graph, topics, d,
+                               tolerance=tolerance,
+                               max_iterations=max_iterations)
+    page_rank = CSRPageRank(graph, variant=job, d=d)
+    for _ in range(max_iterations):
+        old_pr = page_rank.pr
+        page_rank.iterate()
+        if np.abs(page_rank.pr - old_pr).sum() < tolerance*graph.n:
+            break
+    return page_rank.pr
+
+
+def iteration_protocol(job_class, job_args):
+    """
+    Output protocol of the iterations
+    run_until_converged runs, which is
+    binary with --node_protocol binary.
+    """
+    args = list(job_args)
+    if getattr(job_class, "PHASES", None):
+        args += ["--phase", "iterate"]
+    return job_class(args=args).output_protocol()
+
+
+def read_ranks(output_dir, shape, protocol):
+    """
+    Ranks in the output of an iteration,
+    by node index, decoded with the
+    output protocol of the job. Nodes
+    missing from the output are 0.
+    """
+    ranks = np.zeros(shape)
+    for path in glob.glob(os.path.join(output_dir, "part-*")):
+        with open(path, "rb") as f:
+            for line in f:
+                key, value = protocol.read(line.rstrip(b"\r\n"))
+                if key.startswith("*"):
+                    continue
+                ranks[int(key)] = value["PR"]
+    return ranks
+
+
+def rank_error(ranks, reference, top_k=100):
+    """
+    Relative L1 and max error of ranks,
+    and the share of the reference top k
+    found in the top k of ranks (averaged
+    over topics).
+    """
+    if reference.ndim == 1:
+        ranks = ranks[:, None]
+        reference = reference[:, None]
+    k = min(top_k, len(reference))
+    overlap = []
+    for j in range(reference.shape[1]):
+        found = set(np.argsort(-ranks[:, j], kind="stable")[:k])
+        expected = np.argsort(-reference[:, j], kind="stable")[:k]
+        overlap.append(len(found.intersection(expected))/k)
+    error = np.abs(ranks - reference)
+    return {"relative L1 error": float(error.sum()/np.abs(reference).sum()),
+            "max error": float(error.max()),
+            "top %d overlap" % k: float(np.mean(overlap))}
+
+
+def run_case(job, graph_path, topics_path, n_nodes, work_dir, job_args,
+             tolerance, max_iterations):
+    """
+    Runs job with pagerank_driver.py.
+    Meant for a fresh process, so that
+    the peak RSS is the job's own.
+    """
+    # A fresh process has no handler
+    # for the mrjob logs.
+    logging.basicConfig(level=logging.WARNING)
+    module = importlib.import_module(job)
+    job_class = getattr(module, job)
+    job_args = list(job_args)
+    if job in N_NODES_JOBS:
+        job_args += ["--n_nodes", str(n_nodes)]
+    if job == "TopicPageRank":
+        job_args += ["--topics_file", topics_path]
+    start = time.time()
+    _, history = run_until_converged(job_class, [graph_path], work_dir,
+                                     job_args=job_args,
+                                     tolerance=tolerance,
+                                     max_iterations=max_iterations)
+    seconds = time.time() - start
+    return {"seconds": seconds,
+            "iterations": history,
+            "output_dir": os.path.join(work_dir, "iteration-%03d"
+                                       % history[-1]["iteration"]),
+            # Kilobytes on Linux.
+            "peak rss kb":
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "peak task rss kb":
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+def configure_options():
+    parser = argparse.ArgumentParser(
+        description="""Runs the week9
+        PageRank jobs on synthetic power
+        law graphs and writes a JSON
+        report with the time and shuffle
+        bytes of every iteration, the
+        peak RSS and the error against
+        a converged reference. Any
+        option not listed here is passed
+        on to the jobs.""")
+    parser.add_argument(
+        '--generator',
+        dest='generators',
+        action='append',
+        choices=["rmat", "ba"],
+        help="""rmat (R-MAT) or ba
+        (Barabasi-Albert). Can be given
+        more than once. Defaults to
+        rmat.""")
+    parser.add_argument(
+        '--sizes',
+        dest='sizes',
+        nargs='+',
+        type=float,
+        default=[1e4],
+        help="""node counts to try,
+        e.g. 1e4 1e5 1e6 1e7.""")
+    parser.add_argument(
+        '--jobs',
+        dest='jobs',
+        nargs='+',
+        choices=JOBS,
+        default=JOBS)
+    parser.add_argument(
+        '--edge_factor',
+        dest='edge_factor',
+        type=int,
+        default=8,
+        help="""edges per node for
+        rmat. ba links every new
+        node to half as many.""")
+    parser.add_argument(
+        '--n_topics',
+        dest='n_topics',
+        type=int,
+        default=10,
+        help="""number of topics
+        for TopicPageRank.""")
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=0)
+    parser.add_argument(
+        '--reduce.tasks',
+        dest='reducers',
+        type=int,
+        default=4)
+    parser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        type=float,
+        default=1e-6,
+        help="""L1 change at which the
+        driver stops, per rank vector
+        that sums to one. Scaled by the
+        node count for SimplePageRank
+        and by the topic count for
+        TopicPageRank.""")
+    parser.add_argument(
+        '--max_iterations',
+        dest='max_iterations',
+        type=int,
+        default=50)
+    parser.add_argument(
+        '--work_dir',
+        dest='work_dir',
+        default="benchmark_runs",
+        help="""directory for the
+        graphs and the job output.""")
+    parser.add_argument(
+        '--report',
+        dest='report',
+        default="benchmark.json",
+        help="""where the JSON report
+        goes. It is rewritten after
+        every run.""")
+    return parser
+
+
+def main():
+    options, job_args = configure_options().parse_known_args()
+    job_args += ["--reduce.tasks", str(options.reducers)]
+    report = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "host": platform.node(),
+              "python": platform.python_version(),
+              "options": vars(options),
+              "job args": job_args,
+              "runs": []}
+    spawn = multiprocessing.get_context("spawn")
+    for generator in options.generators or ["rmat"]:
+        for size in options.sizes:
+            n_nodes = int(size)
+            name = "%s-%d" % (generator, n_nodes)
+            graph_dir = os.path.join(options.work_dir, name)
+            if not os.path.isdir(graph_dir):
+                os.makedirs(graph_dir)
+            start = time.time()
+            graph = make_graph(generator, n_nodes,
+                               options.edge_factor, options.seed)
+            graph_path = os.path.join(graph_dir, "graph.txt")
+            topics_path = os.path.join(graph_dir, "topics.txt")
+            write_graph(graph, graph_path)
+            write_topics(graph, topics_path, options.n_topics,
+                         options.seed)
+            topics = TopicLookup(topics_path)
+            graph_seconds = time.time() - start
+            for job in options.jobs:
+                scale = 1
+                if job == "SimplePageRank":
+                    scale = n_nodes
+                elif job == "TopicPageRank":
+                    scale = len(topics.topics)
+                with ProcessPoolExecutor(max_workers=1,
+                                         mp_context=spawn) as executor:
+                    result = executor.submit(
+                        run_case, job, graph_path, topics_path, n_nodes,
+                        os.path.join(graph_dir, job), job_args,
+                        options.tolerance*scale,
+                        options.max_iterations).result()
+                start = time.time()
+                reference = reference_ranks(job, graph, topics)
+                reference_seconds = time.time() - start
+                job_class = getattr(importlib.import_module(job), job)
+                ranks = read_ranks(result.pop("output_dir"),
+                                   reference.shape,
+                                   iteration_protocol(job_class, job_args))
+                result.update(rank_error(ranks, reference))
+                result.update({"job": job,
+                               "generator": generator,
+                               "n_nodes": n_nodes,
+                               "n_edges": int(graph.indptr[-1]),
+                               "graph seconds": graph_seconds,
+                               "reference seconds": reference_seconds})
+                report["runs"].append(result)
+                print("%s %s: %d iterations in %.1fs, relative L1 "
+                      "error %.2g" % (name, job, len(result["iterations"]),
+                                      result["seconds"],
+                                      result["relative L1 error"]),
+                      file=stderr)
+                with open(options.report, "w") as f:
+                    json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
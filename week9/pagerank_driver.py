@@ -0,0 +1,622 @@
+from __future__ import print_function, division
+import argparse
+import importlib
+import json
+import logging
+import os
+import shutil
+import time
+from sys import stderr
+import pagerank_utils
+from pagerank_utils import (NodePartitioner,
+                            NodeStateProtocol,
+                            quadratic_extrapolation_weights,
+                            read_aggregates,
+                            read_graph_meta,
+                            sample_range_partitions,
+                            split_graph_meta,
+                            write_hub_ranks,
+                            write_schimmy_partitions)
+from GraphPreprocess import GraphPreprocess
+
+
+# The jobs import pagerank_utils, so it
+# has to travel with them.
+UTILS_PATH = os.path.splitext(pagerank_utils.__file__)[0] + ".py"
+
+
+def sum_counter(counters, group, name):
+    """
+    Adds up a counter over all the
+    steps reported by runner.counters().
+    """
+    return sum(step.get(group, {}).get(name, 0)
+               for step in counters)
+
+
+# Counters Hadoop reports the shuffle
+# in, best first. Map output bytes is
+# before compression and combiners.
+SHUFFLE_COUNTERS = [("Map-Reduce Framework", "Reduce shuffle bytes"),
+                    ("Map-Reduce Framework", "Map output bytes")]
+
+
+def shuffle_bytes(counters):
+    """
+    Bytes sent from the mappers to the
+    reducers over every step, from the
+    counters of the run. None if the
+    runner does not report them (the
+    inline and local runners).
+    """
+    for group, name in SHUFFLE_COUNTERS:
+        if any(name in step.get(group, {}) for step in counters):
+            return sum_counter(counters, group, name)
+    return None
+
+
+def run_job(job_class, input_paths, output_dir, job_args, stats=None):
+    """
+    Runs a job to completion, leaving
+    its output in output_dir. Returns
+    the counters of every step. If
+    stats is a dict, the shuffle bytes
+    of the run are added to it.
+    """
+    args = (list(input_paths)
+            + ["--output-dir", output_dir, "--no-output"]
+            + ["--file", UTILS_PATH]
+            + list(job_args))
+    mr_job = job_class(args=args)
+    with mr_job.make_runner() as runner:
+        runner.run()
+        counters = runner.counters()
+        if stats is not None:
+            stats["shuffle bytes"] = shuffle_bytes(counters)
+        return counters
+
+
+def preprocess_graph(input_paths, work_dir, n_reducers=None):
+    """
+    Runs GraphPreprocess once and splits
+    its output into work_dir/graph, the
+    adjacency lists keyed by dense id,
+    work_dir/graph_meta.txt, for the
+    --graph_meta option of the jobs, and
+    work_dir/names.txt, the name of each
+    id.
+    """
+    graph_dir = os.path.join(work_dir, "graph")
+    meta_path = os.path.join(work_dir, "graph_meta.txt")
+    names_path = os.path.join(work_dir, "names.txt")
+    args = []
+    if n_reducers:
+        args = ["--reduce.tasks", str(n_reducers)]
+    run_job(GraphPreprocess, input_paths, graph_dir, args)
+    split_graph_meta(graph_dir, meta_path, names_path)
+    return graph_dir, meta_path
+
+
+def first_aggregates(meta_path):
+    """
+    Totals the mappers of the first
+    iteration would send, from a graph
+    meta file. Every node starts with
+    1/n_nodes (PageRank, WikiPageRank)
+    and the dangling ones have a record
+    of their own, so no record has to
+    be read to know them.
+    """
+    meta = read_graph_meta(meta_path)
+    n_nodes = meta["n_nodes"]
+    return {"****Total PR": n_nodes*(1/n_nodes),
+            "***n_nodes": n_nodes,
+            "**Distribute": meta["n_dangling"]*(1/n_nodes)}
+
+
+def output_parts(output_dir):
+    for name in sorted(os.listdir(output_dir)):
+        if not name.startswith((".", "_")):
+            yield os.path.join(output_dir, name)
+
+
+def input_files(paths):
+    """
+    The files of input paths that can
+    also be output directories, such as
+    the graph of preprocess_graph.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(output_parts(path))
+        else:
+            files.append(path)
+    return files
+
+
+def write_checkpoint(output_dir, checkpoint_dir, manifest):
+    """
+    Saves the node state in output_dir
+    to checkpoint_dir/nodes with
+    NodeStateProtocol. Special key
+    records are summed into the
+    "aggregates" of the manifest, which
+    is written last, so a checkpoint
+    without manifest.json is incomplete.
+    """
+    protocol = NodeStateProtocol()
+    nodes_dir = os.path.join(checkpoint_dir, "nodes")
+    if os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    os.makedirs(nodes_dir)
+    aggregates = {}
+    for part, path in enumerate(output_parts(output_dir)):
+        out_path = os.path.join(nodes_dir, "part-%05d" % part)
+        with open(path, "rb") as f, open(out_path, "wb") as out:
+            for line in f:
+                line = line.rstrip(b"\r\n")
+                if not line:
+                    continue
+                key, value = protocol.read(line)
+                if key.startswith("*") and isinstance(value, (int, float)):
+                    aggregates[key] = aggregates.get(key, 0) + value
+                else:
+                    out.write(protocol.write(key, value) + b"\n")
+    manifest = dict(manifest, aggregates=aggregates)
+    with open(os.path.join(checkpoint_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+
+def read_checkpoint(resume_from):
+    """
+    Returns the checkpoint directory and
+    manifest to resume from. resume_from
+    is either one checkpoint or the
+    directory holding them, in which case
+    the latest complete one is used.
+    """
+    if os.path.exists(os.path.join(resume_from, "manifest.json")):
+        checkpoint_dir = resume_from
+    else:
+        complete = [name for name in sorted(os.listdir(resume_from))
+                    if os.path.exists(os.path.join(resume_from, name,
+                                                   "manifest.json"))]
+        if not complete:
+            msg = """no complete checkpoint
+                     in %s""" % resume_from
+            raise Exception(msg)
+        checkpoint_dir = os.path.join(resume_from, complete[-1])
+    with open(os.path.join(checkpoint_dir, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+    return checkpoint_dir, manifest
+
+
+def restore_checkpoint(job_class, checkpoint_dir, manifest, work_dir):
+    """
+    Turns a checkpoint back into input
+    paths for the next iteration. Jobs
+    with --node_protocol read the nodes
+    as they are; for the others they are
+    decoded to JSON first.
+    """
+    protocol = NodeStateProtocol()
+    restore_dir = os.path.join(work_dir,
+                               "restored-%03d" % manifest["iteration"])
+    if os.path.isdir(restore_dir):
+        shutil.rmtree(restore_dir)
+    os.makedirs(restore_dir)
+    nodes_dir = os.path.join(checkpoint_dir, "nodes")
+    paths = [nodes_dir]
+    if not hasattr(job_class, "node_state_protocol"):
+        paths = [restore_dir]
+        for path in output_parts(nodes_dir):
+            out_path = os.path.join(restore_dir, os.path.basename(path))
+            with open(path, "rb") as f, open(out_path, "w") as out:
+                for line in f:
+                    key, value = protocol.read(line.rstrip(b"\n"))
+                    out.write("%s\t%s\n" % (json.dumps(key),
+                                            json.dumps(value)))
+    if manifest["aggregates"]:
+        aggregates_path = os.path.join(restore_dir, "aggregates")
+        with open(aggregates_path, "w") as out:
+            for key, value in sorted(manifest["aggregates"].items()):
+                out.write("%s\t%s\n" % (json.dumps(key),
+                                        json.dumps(value)))
+        if paths != [restore_dir]:
+            paths.append(aggregates_path)
+    return paths
+
+
+def prepare_input(job_class, input_paths, work_dir, job_args,
+                  schimmy_dir, range_sample_rate, preprocess):
+    """
+    Everything run_until_converged does
+    once before the first iteration.
+    Returns the job arguments and the
+    input paths of the first iteration.
+    """
+    phases = getattr(job_class, "PHASES", None)
+    job_args = list(job_args)
+    paths = list(input_paths)
+
+    n_reducers = job_class(args=paths + job_args).options.reducers
+    if preprocess:
+        graph_dir, meta_path = preprocess_graph(paths, work_dir, n_reducers)
+        paths = [graph_dir]
+        job_args += ["--graph_meta", meta_path]
+
+    partition_file = None
+    if range_sample_rate:
+        partition_file = os.path.join(work_dir, "partitions.json")
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        sample_range_partitions(input_files(paths), n_reducers,
+                                partition_file,
+                                sample_rate=range_sample_rate)
+        job_args += ["--partition_file", partition_file]
+
+    if schimmy_dir:
+        partitioner = NodePartitioner(n_reducers, partition_file)
+        write_schimmy_partitions(input_files(paths), schimmy_dir,
+                                 partitioner)
+        job_args += ["--schimmy_dir", schimmy_dir]
+
+    if phases and "clean" in phases:
+        output_dir = os.path.join(work_dir, "clean")
+        run_job(job_class, paths, output_dir,
+                job_args + ["--phase", "clean"])
+        paths = [output_dir]
+    return job_args, paths
+
+
+def run_until_converged(job_class, input_paths, work_dir, job_args=(),
+                        tolerance=1e-4, norm="l1", max_iterations=50,
+                        schimmy_dir=None, range_sample_rate=None,
+                        preprocess=False, checkpoint_every=None,
+                        checkpoint_dir=None, resume_from=None,
+                        aggregate_channel=True):
+    """
+    Launches one PageRank iteration at a
+    time and stops once the change in
+    rank reported by the "convergence"
+    counters falls below tolerance.
+
+    norm can be "l1" (sum of the absolute
+    changes) or "linf" (no node moved by
+    more than tolerance).
+
+    If range_sample_rate is set, nodes
+    are range partitioned using that
+    fraction of the input to balance
+    the edges per partition.
+
+    If schimmy_dir is set, the adjacency
+    lists are split by pseudo partition
+    into that directory once, and the
+    iterations only shuffle PR.
+
+    If preprocess is set, the input is
+    first relabeled with dense ids by
+    GraphPreprocess and the job is given
+    the exact node count (PageRank,
+    SimplePageRank and WikiPageRank).
+
+    If checkpoint_every is set, the node
+    state is saved in checkpoint_dir
+    (work_dir/checkpoints by default)
+    every that many iterations, with the
+    options needed to go on. resume_from
+    picks up from such a checkpoint with
+    the options it was saved with.
+
+    If aggregate_channel is set and the
+    job has an --aggregates option, the
+    totals its reducers report through
+    the "aggregates" counters are handed
+    to the next iteration, instead of
+    every mapper sending the special keys
+    to every reducer. The first iteration
+    after a resume still sends them, and
+    so does the first one unless the input
+    was preprocessed (see first_aggregates).
+
+    Jobs with --extrapolate_every report
+    the dot products of their last PRs on
+    the iterations it picks. The driver
+    solves for the weights of a quadratic
+    extrapolation and hands them to the
+    next iteration. Likewise the reducers
+    of a job with --split_degree write the
+    PR of the hubs as side records, which
+    are copied to a file shipped to the
+    next iteration as --hub_ranks.
+
+    Returns the directory holding the
+    final output and a list with the
+    delta, wall time and shuffle bytes
+    of every iteration. Shuffle bytes
+    are None if the runner has no
+    counter for them.
+    """
+    if norm not in ["l1", "linf"]:
+        raise Exception("norm should be l1 or linf")
+    # Jobs without PHASES only have
+    # iteration steps.
+    phases = getattr(job_class, "PHASES", None)
+    if checkpoint_dir is None:
+        checkpoint_dir = os.path.join(work_dir, "checkpoints")
+    if resume_from:
+        resume_dir, manifest = read_checkpoint(resume_from)
+        if manifest["job"] != job_class.__name__:
+            msg = """checkpoint was made
+                     by %s""" % manifest["job"]
+            raise Exception(msg)
+        job_args = manifest["job_args"]
+        tolerance = manifest["tolerance"]
+        norm = manifest["norm"]
+        max_iterations = manifest["max_iterations"]
+        history = manifest["history"]
+        first_iteration = manifest["iteration"] + 1
+        paths = restore_checkpoint(job_class, resume_dir, manifest,
+                                   work_dir)
+        if hasattr(job_class, "node_state_protocol"):
+            # The checkpoint is binary
+            # whatever the run used.
+            job_args = job_args + ["--node_protocol", "binary"]
+    else:
+        job_args, paths = prepare_input(job_class, input_paths, work_dir,
+                                        job_args, schimmy_dir,
+                                        range_sample_rate, preprocess)
+        history = []
+        first_iteration = 1
+
+    iterate_args = job_args + ["--iterations", "1",
+                               "--tolerance", repr(tolerance)]
+    if phases:
+        iterate_args += ["--phase", "iterate"]
+
+    aggregate_channel = (aggregate_channel
+                         and hasattr(job_class, "global_aggregates"))
+    aggregate_args = []
+    extrapolation_args = []
+    # Jobs that count iterations for
+    # --extrapolate_every.
+    extrapolates = hasattr(job_class, "extrapolate")
+    options = job_class(args=list(paths) + list(job_args)).options
+    # The graph meta file of a preprocessed
+    # input gives the first totals.
+    meta_path = getattr(options, "graph_meta", None)
+    if aggregate_channel and meta_path and first_iteration == 1:
+        aggregate_args = ["--aggregates",
+                          json.dumps(first_aggregates(meta_path))]
+    splits_hubs = getattr(options, "split_degree", 0)
+    output_dir = paths[0]
+    for iteration in range(first_iteration, max_iterations + 1):
+        output_dir = os.path.join(work_dir, "iteration-%03d" % iteration)
+        stats = {"iteration": iteration}
+        args = iterate_args + aggregate_args + extrapolation_args
+        if splits_hubs:
+            # Side records of the input, from
+            # the last iteration or checkpoint.
+            hub_path = os.path.join(work_dir,
+                                    "hub_ranks-%03d.txt" % iteration)
+            if write_hub_ranks(paths, hub_path):
+                args = args + ["--hub_ranks", hub_path]
+        if extrapolates:
+            # Keeps the dot products of the
+            # differences of the last PRs
+            # near 1 in the counters.
+            deltas = [step["L1 delta"] for step in history[-2:]]
+            scale = 1.0
+            if deltas and max(deltas) > 0:
+                scale = 1/max(deltas)**2
+            args = args + ["--start_iteration", str(iteration),
+                           "--extrapolation_scale", repr(scale)]
+        start = time.time()
+        counters = run_job(job_class, paths, output_dir, args, stats)
+        stats["seconds"] = time.time() - start
+        paths = [output_dir]
+        aggregates = read_aggregates(counters)
+        if aggregate_channel and aggregates:
+            aggregate_args = ["--aggregates", json.dumps(aggregates)]
+        extrapolation_args = []
+        weights = None
+        dots = read_aggregates(counters, group="extrapolation")
+        if dots:
+            weights = quadratic_extrapolation_weights(dots)
+        if weights:
+            extrapolation_args = ["--extrapolation", json.dumps(weights)]
+            # The totals were for the PRs
+            # before extrapolation.
+            aggregate_args = []
+        # Floats come through the counters
+        # as for the aggregates, so the
+        # delta is exact to about 1e-15.
+        deltas = read_aggregates(counters, group="convergence deltas")
+        l1_delta = deltas.get("L1 delta", 0.0)
+        n_above = sum_counter(counters, "convergence",
+                              "nodes above tolerance")
+        stats["L1 delta"] = l1_delta
+        stats["nodes above tolerance"] = n_above
+        # Only SimplePageRank and PageRank
+        # count their messages, and only
+        # SimplePageRank in delta mode has
+        # unsent change.
+        reported = set(name for step in counters
+                       for name in step.get("convergence", {}))
+        messages = ""
+        if "PR messages" in reported:
+            stats["PR messages"] = sum_counter(counters, "convergence",
+                                               "PR messages")
+            messages = ", %d PR messages" % stats["PR messages"]
+        if "unsent PR" in deltas:
+            stats["unsent PR"] = deltas["unsent PR"]
+        history.append(stats)
+        shuffled = "n/a"
+        if stats["shuffle bytes"] is not None:
+            shuffled = "%d bytes" % stats["shuffle bytes"]
+        print("iteration %d: L1 delta %g, %d nodes above tolerance%s, "
+              "shuffle %s (%.1fs)" % (iteration, l1_delta, n_above, messages,
+                                      shuffled, stats["seconds"]),
+              file=stderr)
+        if checkpoint_every and iteration % checkpoint_every == 0:
+            write_checkpoint(output_dir,
+                             os.path.join(checkpoint_dir,
+                                          "iteration-%03d" % iteration),
+                             {"job": job_class.__name__,
+                              "iteration": iteration,
+                              "job_args": job_args,
+                              "tolerance": tolerance,
+                              "norm": norm,
+                              "max_iterations": max_iterations,
+                              "history": history})
+        # The first iteration can discover
+        # dangling nodes, so never stop there
+        # unless the input was preprocessed.
+        if iteration > 1 or meta_path:
+            if norm == "l1" and l1_delta < tolerance:
+                break
+            if norm == "linf" and n_above == 0:
+                break
+
+    if history and "unsent PR" in history[-1]:
+        # Applying the unsent changes would
+        # move the in-link sums by at most
+        # that much (L1), and so the fixed
+        # point by at most d/(1-d) times it.
+        d = job_class(args=list(paths) + list(job_args)).options.d
+        unsent = history[-1]["unsent PR"]
+        print("unsent PR %g: ranks within %g (L1) of exact "
+              "propagation" % (unsent, d/(1 - d)*unsent), file=stderr)
+
+    if phases and "collect" in phases:
+        output_dir = os.path.join(work_dir, "collect")
+        run_job(job_class, paths, output_dir,
+                job_args + ["--phase", "collect"])
+    return output_dir, history
+
+
+def configure_options():
+    parser = argparse.ArgumentParser(
+        description="""Runs one of the
+        week9 PageRank jobs until the
+        ranks stop changing. Any option
+        not listed here is passed on to
+        the job.""")
+    parser.add_argument(
+        "job",
+        help="""SimplePageRank, PageRank,
+        ComplexPageRank, WikiPageRank
+        or TopicPageRank.""")
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument(
+        '--work_dir',
+        dest='work_dir',
+        default="pagerank_runs",
+        help="""directory that holds
+        the output of every step.""")
+    parser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        default=1e-4,
+        type=float,
+        help="""stop once the change
+        in PR falls below this value.""")
+    parser.add_argument(
+        '--norm',
+        dest='norm',
+        default="l1",
+        choices=["l1", "linf"],
+        help="""how the change in PR
+        is measured.""")
+    parser.add_argument(
+        '--max_iterations',
+        dest='max_iterations',
+        default=50,
+        type=int,
+        help="""upper bound on the
+        number of iterations.""")
+    parser.add_argument(
+        '--schimmy_dir',
+        dest='schimmy_dir',
+        help="""if set, keeps the
+        adjacency lists partitioned
+        in this directory instead of
+        shuffling them (PageRank and
+        WikiPageRank only).""")
+    parser.add_argument(
+        '--range_partitions',
+        dest='range_sample_rate',
+        type=float,
+        help="""fraction of the input
+        to sample for range partitions
+        balanced by edge count. Nodes
+        are hashed if not set.""")
+    parser.add_argument(
+        '--preprocess',
+        dest='preprocess',
+        action='store_true',
+        help="""relabel the graph with
+        dense ids and pass the exact
+        node count to the job (PageRank,
+        SimplePageRank and WikiPageRank
+        only).""")
+    parser.add_argument(
+        '--checkpoint_every',
+        dest='checkpoint_every',
+        type=int,
+        help="""save the node state
+        every this many iterations.""")
+    parser.add_argument(
+        '--checkpoint_dir',
+        dest='checkpoint_dir',
+        help="""where checkpoints go.
+        Defaults to checkpoints in
+        the work_dir.""")
+    parser.add_argument(
+        '--resume-from',
+        dest='resume_from',
+        help="""checkpoint, or directory
+        of checkpoints, to go on
+        from. The job options of the
+        checkpointed run are used and
+        no input paths are needed.""")
+    parser.add_argument(
+        '--broadcast_aggregates',
+        dest='broadcast_aggregates',
+        action='store_true',
+        help="""send the special keys to
+        every reducer each iteration
+        instead of handing the totals
+        of the previous iteration to
+        the next one.""")
+    return parser
+
+
+if __name__ == "__main__":
+    # mrjob only logs through handlers
+    # set up by the caller.
+    logging.basicConfig(stream=stderr, level=logging.INFO)
+    parser = configure_options()
+    options, job_args = parser.parse_known_args()
+    if not options.paths and not options.resume_from:
+        parser.error("input paths are required unless resuming")
+    module = importlib.import_module(options.job)
+    job_class = getattr(module, options.job)
+    output_dir, history = run_until_converged(
+        job_class,
+        options.paths,
+        options.work_dir,
+        job_args=job_args,
+        tolerance=options.tolerance,
+        norm=options.norm,
+        max_iterations=options.max_iterations,
+        schimmy_dir=options.schimmy_dir,
+        range_sample_rate=options.range_sample_rate,
+        preprocess=options.preprocess,
+        checkpoint_every=options.checkpoint_every,
+        checkpoint_dir=options.checkpoint_dir,
+        resume_from=options.resume_from,
+        aggregate_channel=not options.broadcast_aggregates)
+    print(output_dir)
@@ -0,0 +1,924 @@
+from __future__ import print_function, division
+import base64
+import bisect
+import json
+import math
+import os
+import random
+import re
+import struct
+import zlib
+from array import array
+from mrjob.protocol import JSONProtocol
+
+
+string_types = (str, type(u""))
+
+
+def parse_adjacency_line(line):
+    """
+    Parses one line of either input
+    format used by the week9 jobs:
+
+        1\t{'11': 1, '27': 1}
+        "B"\t["C"]
+
+    Returns the node and its list of
+    links, all as strings.
+    """
+    key, value = line.rstrip("\r\n").split("\t", 1)
+    if key.startswith('"'):
+        key = json.loads(key)
+    if value.startswith("{'"):
+        # The Wikipedia dump format. Link
+        # ids are the quoted parts, which
+        # is about twice as fast as fixing
+        # the quotes for json.loads.
+        return key, value.split("'")[1::2]
+    value = json.loads(value.replace("'", '"'))
+    if isinstance(value, dict):
+        value = value.get("links", value.keys())
+    return str(key), [str(link) for link in value]
+
+
+def node_partition(key, n_reducers):
+    """
+    Pseudo partition of a node. Unlike
+    hash(), crc32 gives the same answer
+    in every process, so a node's PR
+    and its links always meet.
+    """
+    key_hash = zlib.crc32(key.encode("utf-8")) & 0xffffffff
+    return key_hash % n_reducers
+
+
+class NodePartitioner(object):
+    def __init__(self, n_reducers, partition_file=None):
+        """
+        Maps a node to its pseudo partition.
+        Uses node_partition unless given a
+        partition_file written by
+        sample_range_partitions, in which
+        case nodes are split into sorted
+        ranges of about equal edge count.
+        """
+        self.n_reducers = n_reducers
+        self.boundaries = None
+        if partition_file:
+            with open(partition_file, "r") as f:
+                partitions = json.load(f)
+            if partitions["n_reducers"] != n_reducers:
+                msg = """partition file was made
+                         for %d reducers""" % partitions["n_reducers"]
+                raise Exception(msg)
+            self.boundaries = partitions["boundaries"]
+
+    def __call__(self, key):
+        if self.boundaries is None:
+            return node_partition(key, self.n_reducers)
+        return bisect.bisect_right(self.boundaries, key)
+
+
+def sample_range_partitions(input_paths, n_reducers, partition_file,
+                            sample_rate=.01, seed=0):
+    """
+    Picks range boundaries from a sample
+    of the input so that each partition
+    gets about the same number of records
+    in the reducer: one per node plus one
+    per link pointing at it.
+    """
+    sampler = random.Random(seed)
+    weights = {}
+    for path in input_paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip() or sampler.random() >= sample_rate:
+                    continue
+                key, links = parse_adjacency_line(line)
+                weights[key] = weights.get(key, 0) + 1
+                for link in links:
+                    weights[link] = weights.get(link, 0) + 1
+    nodes = sorted(weights)
+    total = sum(weights.values())
+    boundaries = []
+    cumulative = 0
+    for node in nodes:
+        # Start a new partition at the first
+        # node past each quantile.
+        quantile = total*(len(boundaries) + 1)/n_reducers
+        if cumulative >= quantile and len(boundaries) < n_reducers - 1:
+            boundaries.append(node)
+        cumulative += weights[node]
+    with open(partition_file, "w") as f:
+        json.dump({"n_reducers": n_reducers,
+                   "boundaries": boundaries}, f)
+    return boundaries
+
+
+# Fixed point scale of the fractional
+# part of an aggregate counter.
+AGGREGATE_SCALE = 10**15
+
+
+def report_aggregates(job, aggregates, group="aggregates"):
+    """
+    Sends floats to the driver through the
+    counters of group. Each value is
+    split into its whole part and a fixed
+    point fraction, so the sum over all
+    reducers stays exact to about 1e-15.
+    """
+    for name, value in sorted(aggregates.items()):
+        whole = math.floor(value)
+        fraction = int(round((value - whole)*AGGREGATE_SCALE))
+        job.increment_counter(group, name + " whole", int(whole))
+        job.increment_counter(group, name + " fraction", fraction)
+
+
+def read_aggregates(counters, group="aggregates"):
+    """
+    Adds up the values sent with
+    report_aggregates over the steps of
+    runner.counters().
+    """
+    wholes = {}
+    fractions = {}
+    for step in counters:
+        for counter, amount in step.get(group, {}).items():
+            name, part = counter.rsplit(" ", 1)
+            if part == "whole":
+                wholes[name] = wholes.get(name, 0) + amount
+            else:
+                fractions[name] = fractions.get(name, 0) + amount
+    return dict((name, wholes.get(name, 0)
+                 + fractions.get(name, 0)/AGGREGATE_SCALE)
+                for name in set(wholes) | set(fractions))
+
+
+def load_aggregates(aggregates):
+    """
+    Parses the --aggregates option of a
+    job, None if it was not given.
+    """
+    if not aggregates:
+        return None
+    return json.loads(aggregates)
+
+
+HUB_PR_KEY = "*Hub PR"
+
+
+def write_hub_ranks(paths, out_path):
+    """
+    Copies the HUB_PR_KEY records that
+    the reducers of a --split_degree job
+    write next to the node state into
+    out_path, one hub per line:
+
+        "hub"\t0.0123
+
+    paths are output directories or
+    files. Other lines are not decoded.
+    Returns the number of hubs.
+    """
+    prefix = (json.dumps(HUB_PR_KEY) + "\t").encode("utf-8")
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name)
+                         for name in sorted(os.listdir(path))
+                         if not name.startswith((".", "_")))
+        else:
+            files.append(path)
+    n_hubs = 0
+    with open(out_path, "w") as out:
+        for path in files:
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.startswith(prefix):
+                        continue
+                    hub, pr = json.loads(line[len(prefix):].decode("utf-8"))
+                    out.write("%s\t%r\n" % (json.dumps(hub), pr))
+                    n_hubs += 1
+    return n_hubs
+
+
+def read_hub_ranks(path):
+    """
+    Reads a file written by
+    write_hub_ranks into a dict.
+    """
+    hub_ranks = {}
+    with open(path, "r") as f:
+        for line in f:
+            hub, pr = line.rstrip("\n").split("\t", 1)
+            hub_ranks[json.loads(hub)] = float(pr)
+    return hub_ranks
+
+
+def quadratic_extrapolation_weights(dots):
+    """
+    Weights of x(k-2), x(k-1) and x(k) in
+    the quadratic extrapolation of Kamvar
+    et al., from the dot products of
+
+        y1 = x(k-2) - x(k-3)
+        y2 = x(k-1) - x(k-3)
+        y3 = x(k) - x(k-3)
+
+    as reported by the jobs ("y1.y1",
+    "y1.y2", ...). Solves the 2x2 least
+    squares problem for g1 y1 + g2 y2 + y3
+    = 0. The weights sum to 1, so the
+    extrapolated PR keeps the total. None
+    if the system is singular.
+    """
+    a11 = dots.get("y1.y1", 0.0)
+    a12 = dots.get("y1.y2", 0.0)
+    a22 = dots.get("y2.y2", 0.0)
+    b1 = -dots.get("y1.y3", 0.0)
+    b2 = -dots.get("y2.y3", 0.0)
+    det = a11*a22 - a12*a12
+    if abs(det) <= 1e-12*max(a11*a22, 1e-300):
+        return None
+    g1 = (b1*a22 - b2*a12)/det
+    g2 = (a11*b2 - a12*b1)/det
+    weights = [g1 + g2 + 1, g2 + 1, 1.0]
+    total = sum(weights)
+    if not total:
+        return None
+    return [weight/total for weight in weights]
+
+
+GRAPH_META_KEY = "***graph_meta"
+# Order of the fields in a graph meta
+# file.
+GRAPH_META_FIELDS = ["n_nodes", "n_edges", "n_dangling"]
+NODE_NAME_KEY = "***node_name"
+
+
+def split_graph_meta(graph_dir, meta_path, names_path):
+    """
+    Moves the GRAPH_META_KEY records out
+    of the output of GraphPreprocess and
+    into meta_path, one field per line:
+
+        n_nodes\t1000
+
+    and the NODE_NAME_KEY records into
+    names_path, one node per line:
+
+        17\t"Main_Page"
+
+    Leaves graph_dir with only the
+    adjacency lists, keyed by dense id.
+    """
+    meta_prefix = json.dumps(GRAPH_META_KEY) + "\t"
+    name_prefix = json.dumps(NODE_NAME_KEY) + "\t"
+    meta = {}
+    with open(names_path, "w") as names:
+        for name in sorted(os.listdir(graph_dir)):
+            if name.startswith((".", "_")):
+                continue
+            path = os.path.join(graph_dir, name)
+            tmp_path = os.path.join(graph_dir, "_" + name)
+            with open(path, "r") as f, open(tmp_path, "w") as out:
+                for line in f:
+                    if line.startswith(meta_prefix):
+                        field, value = json.loads(line[len(meta_prefix):])
+                        meta[field] = value
+                    elif line.startswith(name_prefix):
+                        node_id, node = json.loads(line[len(name_prefix):])
+                        names.write("%d\t%s\n" % (node_id, json.dumps(node)))
+                    else:
+                        out.write(line)
+            os.rename(tmp_path, path)
+    with open(meta_path, "w") as f:
+        for field in GRAPH_META_FIELDS:
+            f.write("%s\t%s\n" % (field, json.dumps(meta[field])))
+    return meta
+
+
+def read_graph_meta(meta_path, fields=None):
+    """
+    Reads a file written by
+    split_graph_meta. If fields is
+    given, stops reading once they
+    are all found.
+    """
+    meta = {}
+    with open(meta_path, "r") as f:
+        for line in f:
+            field, value = line.rstrip("\n").split("\t", 1)
+            if fields is None or field in fields:
+                meta[field] = json.loads(value)
+            if fields is not None and all(x in meta for x in fields):
+                break
+    return meta
+
+
+def sort_key(key):
+    """
+    Order in which a reducer sees the
+    nodes of its partition when
+    SORT_VALUES is on. Values are sorted
+    by their serialized form, which
+    starts with the JSON encoded node.
+    """
+    return json.dumps(key)
+
+
+def partition_path(graph_dir, hash_key):
+    return os.path.join(graph_dir, "part-%05d" % hash_key)
+
+
+def write_schimmy_partitions(input_paths, graph_dir, partitioner):
+    """
+    Splits the adjacency lists of the
+    input into one file per pseudo
+    partition, sorted in reducer order,
+    so that the reducers can merge join
+    them instead of receiving the links
+    through the shuffle. partitioner has
+    to be the NodePartitioner of the job.
+    """
+    partitions = [[] for _ in range(partitioner.n_reducers)]
+    for path in input_paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                key, links = parse_adjacency_line(line)
+                hash_key = partitioner(key)
+                partitions[hash_key].append((sort_key(key), links))
+    if not os.path.isdir(graph_dir):
+        os.makedirs(graph_dir)
+    for hash_key, nodes in enumerate(partitions):
+        nodes.sort(key=lambda x: x[0])
+        with open(partition_path(graph_dir, hash_key), "w") as f:
+            for node, links in nodes:
+                f.write("%s\t%s\n" % (node, json.dumps(links)))
+
+
+class SchimmyPartition(object):
+    def __init__(self, graph_dir, hash_key):
+        """
+        Reads the adjacency lists of one
+        pseudo partition in step with the
+        sorted node keys of a reducer.
+        """
+        self.f = open(partition_path(graph_dir, hash_key), "r")
+        self.current = None
+        self._advance()
+
+    def _advance(self):
+        line = self.f.readline()
+        if line:
+            node, links = line.rstrip("\n").split("\t", 1)
+            self.current = (node, links)
+        else:
+            self.current = None
+
+    def links_for(self, key):
+        """
+        Returns the links of key. Keys have
+        to be asked for in sorted order.
+        Nodes without a line in the
+        partition (dangling nodes) have no
+        links.
+        """
+        target = sort_key(key)
+        while self.current is not None and self.current[0] < target:
+            self._advance()
+        if self.current is not None and self.current[0] == target:
+            return json.loads(self.current[1])
+        return []
+
+    def close(self):
+        self.f.close()
+
+
+# Flags of a NodeStateProtocol record
+KEY_NUMERIC = 1
+HAS_PR = 2
+HAS_LINKS = 4
+LINKS_NUMERIC = 8
+HAS_TOPIC = 16
+TOPIC_NUMERIC = 32
+PR_VECTOR = 64
+HAS_SENT = 128
+HAS_IN = 256
+# Delta mode fields of SimplePageRank,
+# with the flag that marks each.
+DELTA_FIELDS = [("sent", HAS_SENT), ("in", HAS_IN)]
+
+NUMERIC_ID = re.compile(r"^(0|[1-9][0-9]*)$")
+
+
+def _is_numeric(node):
+    return NUMERIC_ID.match(node) is not None
+
+
+def _write_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_string(out, node):
+    encoded = node.encode("utf-8")
+    _write_varint(out, len(encoded))
+    out.extend(encoded)
+
+
+def _read_string(data, pos):
+    length, pos = _read_varint(data, pos)
+    end = pos + length
+    return bytes(data[pos:end]).decode("utf-8"), end
+
+
+def encode_node_state(key, value):
+    """
+    Packs a node into bytes:
+
+        flags, key, [PR], [links], [topic],
+        [sent], [in]
+
+    Flags and numeric ids are varints,
+    links are sorted and delta encoded,
+    PR is a float64 or a list of them
+    (one per topic), and sent and in, the
+    running sums of the delta mode of
+    SimplePageRank, are float64. Returns
+    None for anything that is not a node,
+    such as special keys or shuffle
+    records.
+    """
+    if not isinstance(key, string_types):
+        return None
+    if isinstance(value, list):
+        pr, links, topic = None, value, None
+    elif isinstance(value, dict):
+        if "PR" not in value or "links" not in value:
+            return None
+        if set(value) - set(["PR", "links", "topic", "sent", "in"]):
+            return None
+        pr, links, topic = value["PR"], value["links"], value.get("topic")
+        prs = pr if isinstance(pr, list) else [pr]
+        for x in prs + [value[field] for field, _ in DELTA_FIELDS
+                        if field in value]:
+            if isinstance(x, bool) or not isinstance(x, (int, float)):
+                return None
+    else:
+        return None
+    if not all(isinstance(link, string_types) for link in links):
+        return None
+    if topic is not None and not isinstance(topic, string_types):
+        return None
+
+    flags = HAS_LINKS
+    key_numeric = _is_numeric(key)
+    links_numeric = all(_is_numeric(link) for link in links)
+    if key_numeric:
+        flags |= KEY_NUMERIC
+    if pr is not None:
+        flags |= HAS_PR
+        if isinstance(pr, list):
+            flags |= PR_VECTOR
+    if links_numeric:
+        flags |= LINKS_NUMERIC
+    if topic is not None:
+        flags |= HAS_TOPIC
+        if _is_numeric(topic):
+            flags |= TOPIC_NUMERIC
+    for field, flag in DELTA_FIELDS:
+        if isinstance(value, dict) and field in value:
+            flags |= flag
+
+    out = bytearray()
+    # One byte unless a delta field
+    # is set.
+    _write_varint(out, flags)
+    if key_numeric:
+        _write_varint(out, int(key))
+    else:
+        _write_string(out, key)
+    if flags & PR_VECTOR:
+        _write_varint(out, len(pr))
+        out.extend(struct.pack("<%dd" % len(pr), *pr))
+    elif pr is not None:
+        out.extend(struct.pack("<d", pr))
+    _write_varint(out, len(links))
+    if links_numeric:
+        previous = 0
+        for link in sorted(int(link) for link in links):
+            _write_varint(out, link - previous)
+            previous = link
+    else:
+        for link in links:
+            _write_string(out, link)
+    if topic is not None:
+        if flags & TOPIC_NUMERIC:
+            _write_varint(out, int(topic))
+        else:
+            _write_string(out, topic)
+    for field, flag in DELTA_FIELDS:
+        if flags & flag:
+            out.extend(struct.pack("<d", value[field]))
+    return bytes(out)
+
+
+def decode_node_state(record):
+    data = bytearray(record)
+    flags, pos = _read_varint(data, 0)
+    if flags & KEY_NUMERIC:
+        key, pos = _read_varint(data, pos)
+        key = str(key)
+    else:
+        key, pos = _read_string(data, pos)
+    pr = None
+    if flags & PR_VECTOR:
+        n_topics, pos = _read_varint(data, pos)
+        end = pos + 8*n_topics
+        pr = list(struct.unpack("<%dd" % n_topics, bytes(data[pos:end])))
+        pos = end
+    elif flags & HAS_PR:
+        pr = struct.unpack_from("<d", bytes(data[pos:pos + 8]))[0]
+        pos += 8
+    n_links, pos = _read_varint(data, pos)
+    links = []
+    if flags & LINKS_NUMERIC:
+        link = 0
+        for _ in range(n_links):
+            delta, pos = _read_varint(data, pos)
+            link += delta
+            links.append(str(link))
+    else:
+        for _ in range(n_links):
+            link, pos = _read_string(data, pos)
+            links.append(link)
+    if not flags & HAS_PR:
+        return key, links
+    value = {"PR": pr, "links": links}
+    if flags & HAS_TOPIC:
+        if flags & TOPIC_NUMERIC:
+            topic, pos = _read_varint(data, pos)
+            value["topic"] = str(topic)
+        else:
+            value["topic"], pos = _read_string(data, pos)
+    for field, flag in DELTA_FIELDS:
+        if flags & flag:
+            value[field] = struct.unpack_from("<d", bytes(data[pos:pos + 8]))[0]
+            pos += 8
+    return key, value
+
+
+class NodeStateProtocol(object):
+    """
+    Protocol for node state between steps.
+    Nodes are written as one base64 encoded
+    encode_node_state record per line, so
+    the lines stay safe for streaming.
+    Everything else falls back to the
+    JSONProtocol format, which is also
+    what tells the two apart on read.
+    """
+    def read(self, line):
+        key, sep, value = line.partition(b"\t")
+        # Hadoop adds a tab after lines
+        # that have no value.
+        if sep and value:
+            return (json.loads(key.decode("utf-8")),
+                    json.loads(value.decode("utf-8")))
+        return decode_node_state(base64.b64decode(key))
+
+    def write(self, key, value):
+        record = encode_node_state(key, value)
+        if record is None:
+            return b"\t".join([json.dumps(key).encode("utf-8"),
+                               json.dumps(value).encode("utf-8")])
+        return base64.b64encode(record)
+
+
+class NodeProtocolOption(object):
+    """
+    Mixin for the jobs that pagerank_driver.py
+    runs one --phase at a time. Adds
+    --node_protocol and uses it between
+    steps and between the runs of the
+    phases. Goes before MRJob:
+
+        class SimplePageRank(NodeProtocolOption, MRJob):
+    """
+    def configure_options(self):
+        super(NodeProtocolOption, self).configure_options()
+
+        self.add_passthrough_option(
+            '--node_protocol', 
+            dest='node_protocol', 
+            type='str',
+            default="json",
+            help="""Can be json or binary.
+            binary writes the node state
+            between steps with
+            pagerank_utils.NodeStateProtocol,
+            which is several times smaller
+            than JSON.""")
+
+    def node_state_protocol(self):
+        node_protocol = self.options.node_protocol
+        if node_protocol == "binary":
+            return NodeStateProtocol()
+        elif node_protocol == "json":
+            return JSONProtocol()
+        msg = """--node_protocol should
+                   be json or binary"""
+        raise Exception(msg)
+
+    def internal_protocol(self):
+        return self.node_state_protocol()
+
+    def output_protocol(self):
+        # Phases that feed another run
+        # keep the node state format.
+        if self.options.phase in ["clean", "iterate"]:
+            return self.node_state_protocol()
+        return super(NodeProtocolOption, self).output_protocol()
+
+    def input_protocol(self):
+        # Steps after the clean step read
+        # the output of a previous run.
+        if self.options.phase in ["iterate", "collect"]:
+            return self.node_state_protocol()
+        return super(NodeProtocolOption, self).input_protocol()
+
+
+class GraphMetaOption(object):
+    """
+    Mixin for MRJob that adds --graph_meta,
+    the file split_graph_meta writes, and
+    graph_n_nodes to read the exact node
+    count from it. Goes before MRJob.
+    """
+    def configure_options(self):
+        super(GraphMetaOption, self).configure_options()
+
+        self.add_file_option(
+            '--graph_meta', 
+            dest='graph_meta', 
+            help="""Graph meta file made by
+            GraphPreprocess (see
+            pagerank_utils.split_graph_meta).
+            If set, the exact node count
+            is read from it instead of
+            being counted every iteration.""")
+
+    def graph_n_nodes(self):
+        # Exact node count from
+        # GraphPreprocess, if given.
+        if self.options.graph_meta:
+            meta = read_graph_meta(self.options.graph_meta, ["n_nodes"])
+            return meta["n_nodes"]
+        return None
+
+
+class AggregatesOption(object):
+    """
+    Mixin for MRJob that adds --aggregates,
+    the totals the reducers of the previous
+    iteration sent with report_aggregates,
+    and global_aggregates to read them.
+    pagerank_driver.py only hands them on
+    to jobs that have it. Goes before MRJob.
+    """
+    def configure_options(self):
+        super(AggregatesOption, self).configure_options()
+
+        self.add_passthrough_option(
+            '--aggregates', 
+            dest='aggregates', 
+            type='str',
+            help="""JSON with the totals
+            reported by the reducers of
+            the previous iteration (see
+            pagerank_utils.read_aggregates).
+            If set, the mappers do not
+            send the special keys to every
+            reducer. Only valid for a
+            single iteration.""")
+
+    def global_aggregates(self):
+        # Totals of the previous iteration
+        # from the driver, if given.
+        return load_aggregates(self.options.aggregates)
+
+
+class ExtrapolationOption(object):
+    """
+    Mixin for MRJob that adds quadratic
+    extrapolation: --extrapolate_every and
+    the options pagerank_driver.py sets for
+    it. The reducers keep the last PRs of
+    every node with keep_iterates and send
+    their dot products with
+    report_extrapolation; the mappers of
+    the next iteration apply the weights
+    the driver picked with extrapolate.
+    Goes before MRJob.
+    """
+    def configure_options(self):
+        super(ExtrapolationOption, self).configure_options()
+
+        self.add_passthrough_option(
+            '--extrapolate_every', 
+            dest='extrapolate_every', 
+            type='int',
+            default=0,
+            help="""If set, every this many
+            iterations the reducers report
+            the dot products pagerank_driver.py
+            needs to pick a quadratic
+            extrapolation of the last PRs,
+            which the mappers of the next
+            iteration apply. The two PRs
+            before the current one travel
+            with the node as "old_PR". Can
+            not be used with
+            --smart_updating.""")
+        
+        self.add_passthrough_option(
+            '--start_iteration', 
+            dest='start_iteration', 
+            type='int',
+            default=1,
+            help="""Number of the first
+            iteration of this run, so that
+            --extrapolate_every counts
+            across runs. Set by
+            pagerank_driver.py.""")
+        
+        self.add_passthrough_option(
+            '--extrapolation', 
+            dest='extrapolation', 
+            type='str',
+            help="""JSON weights of the
+            PRs of the last three
+            iterations (oldest first) for
+            the mappers to extrapolate
+            with. Set by
+            pagerank_driver.py.""")
+        
+        self.add_passthrough_option(
+            '--extrapolation_scale', 
+            dest='extrapolation_scale', 
+            type='float',
+            default=1.0,
+            help="""Factor for the reported
+            dot products, so that they stay
+            well above the resolution of
+            the counters. Set by
+            pagerank_driver.py.""")
+
+    def extrapolation_weights(self):
+        # Weights picked by the driver,
+        # if any.
+        if self.options.extrapolation:
+            return json.loads(self.options.extrapolation)
+        return None
+
+    def reporting_iteration(self):
+        # mrjob numbers the steps of a
+        # run from 0.
+        iteration = self.options.start_iteration + self.options.step_num
+        every = self.options.extrapolate_every
+        return every > 0 and iteration % every == 0
+
+    def extrapolate(self, node_info):
+        """
+        PR of a node from the weights in
+        self.extrapolation, which mapper_init
+        sets from extrapolation_weights. Its
+        old PRs start over from the new value.
+        """
+        older_pr, oldest_pr = node_info.pop("old_PR")
+        weights = self.extrapolation
+        pr = (weights[0]*oldest_pr + weights[1]*older_pr
+              + weights[2]*node_info["PR"])
+        # Far from the limit a small rank
+        # can overshoot below zero.
+        if pr <= 0:
+            return node_info["PR"]
+        return pr
+
+    def keep_iterates(self, node_info, new_pr, old_pr, dots):
+        """
+        Keeps the two PRs before new_pr in
+        node_info["old_PR"], newest first.
+        If self.reporting, which reducer_init
+        sets from reporting_iteration, adds
+        the dot products of the node to dots
+        (see quadratic_extrapolation_weights).
+        """
+        old_prs = node_info.get("old_PR", [])
+        if self.reporting and len(old_prs) == 2:
+            base = old_prs[1]
+            y1 = old_prs[0] - base
+            y2 = old_pr - base
+            y3 = new_pr - base
+            dots["y1.y1"] += y1*y1
+            dots["y1.y2"] += y1*y2
+            dots["y2.y2"] += y2*y2
+            dots["y1.y3"] += y1*y3
+            dots["y2.y3"] += y2*y3
+        node_info["old_PR"] = [old_pr] + old_prs[:1]
+
+    def report_extrapolation(self, dots):
+        scale = self.options.extrapolation_scale
+        report_aggregates(self, dict((name, dot*scale)
+                                     for name, dot in dots.items()),
+                          group="extrapolation")
+
+
+def _id_order(node):
+    # Numeric ids in numeric order,
+    # then everything else.
+    if _is_numeric(node):
+        return (0, int(node), node)
+    return (1, 0, node)
+
+
+def rank_order(item):
+    """
+    Sort key of a (node, PR) pair in a
+    top k list: by PR, then by node id,
+    so that the larger id wins a tie.
+    Mappers, reducers and CSRPageRank
+    then keep the same nodes at the
+    cutoff whatever order they saw.
+    """
+    node, pr = item
+    return (pr, _id_order(node))
+
+
+class TopicLookup(object):
+    def __init__(self, topics_file):
+        """
+        Topic of every node, read from
+        lines of the form
+
+            node\ttopic
+
+        as in randNet_topics.txt. Topics
+        are numbered in sorted order.
+        When every node id is numeric the
+        lookup is an array indexed by id
+        instead of a dict.
+        """
+        pairs = []
+        with open(topics_file, "r") as f:
+            for line in f:
+                if line.strip():
+                    node, topic = line.split()
+                    pairs.append((node, topic))
+        self.topics = sorted(set(topic for _, topic in pairs),
+                             key=_id_order)
+        index = dict((topic, i) for i, topic in enumerate(self.topics))
+        self.n_nodes = len(pairs)
+        self.sizes = [0]*len(self.topics)
+        for _, topic in pairs:
+            self.sizes[index[topic]] += 1
+        if pairs and all(_is_numeric(node) for node, _ in pairs):
+            max_id = max(int(node) for node, _ in pairs)
+            self.lookup = array("i", [-1])*(max_id + 1)
+            for node, topic in pairs:
+                self.lookup[int(node)] = index[topic]
+        else:
+            self.lookup = dict((node, index[topic])
+                               for node, topic in pairs)
+
+    def __getitem__(self, node):
+        """
+        Index of the topic of node in
+        self.topics, None if the node is
+        not in the file.
+        """
+        if isinstance(self.lookup, dict):
+            return self.lookup.get(node)
+        if not _is_numeric(node) or int(node) >= len(self.lookup):
+            return None
+        topic = self.lookup[int(node)]
+        return topic if topic >= 0 else None
@@ -0,0 +1,673 @@
+from __future__ import division
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import ParallelPageRank as parallel
+import pagerank_driver
+from CSRPageRank import (AdjacencyGraph, CSRPageRank, IncrementalPageRank,
+                         load_results, personalized_pagerank, top_k)
+from ComplexPageRank import ComplexPageRank
+from PageRank import PageRank
+from PersonalizedPageRank import WalkIndex, build_walk_index
+from SimplePageRank import SimplePageRank
+from TopicPageRank import TopicPageRank
+from WikiPageRank import WikiPageRank
+from pagerank_benchmark import iteration_protocol, read_ranks
+from pagerank_driver import (output_parts, preprocess_graph,
+                             run_until_converged)
+from pagerank_utils import (NodeStateProtocol, TopicLookup, node_partition,
+                            parse_adjacency_line, read_aggregates,
+                            read_graph_meta)
+
+# mrjob writes its log lines as bytes to an
+# unconfigured stderr handler otherwise.
+logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
+
+RAND_NET = os.path.join(HERE, "data", "randNet.txt")
+PAGERANK_TEST = os.path.join(HERE, "data", "PageRank-test.txt")
+RAND_NET_TOPICS = os.path.join(HERE, "data", "randNet_topics.txt")
+
+
+def read_output(output_dir):
+    records = {}
+    for path in output_parts(output_dir):
+        with open(path) as f:
+            for line in f:
+                key, value = line.rstrip("\n").split("\t", 1)
+                records[json.loads(key)] = json.loads(value)
+    return records
+
+
+def node_ranks(output_dir):
+    # Leaves out the slices of split hubs
+    # and the special records.
+    return dict((key, value["PR"])
+                for key, value in read_output(output_dir).items()
+                if not key.startswith("*") and "hub" not in value)
+
+
+def run_pagerank(work_dir, job_args, max_iterations=3):
+    output_dir, history = run_until_converged(
+        PageRank, [RAND_NET], str(work_dir),
+        job_args=["--reduce.tasks", "3"] + job_args,
+        tolerance=0.0, max_iterations=max_iterations, preprocess=True)
+    return output_dir, history
+
+
+def test_split_hubs_match_unsplit_run(tmp_path):
+    plain_dir, plain_history = run_pagerank(tmp_path / "plain", [])
+    split_dir, split_history = run_pagerank(tmp_path / "split",
+                                            ["--split_degree", "5"])
+    assert len(split_history) == 3
+    output = read_output(split_dir)
+    assert any("hub" in value for value in output.values()
+               if isinstance(value, dict))
+    assert any(key == "*Hub PR" for key in output)
+    plain = node_ranks(plain_dir)
+    split = node_ranks(split_dir)
+    assert set(plain) == set(split)
+    for key in plain:
+        assert split[key] == pytest.approx(plain[key], abs=1e-12)
+    for plain_stats, split_stats in zip(plain_history, split_history):
+        assert split_stats["L1 delta"] == pytest.approx(
+            plain_stats["L1 delta"], abs=1e-9)
+
+
+def stuck_or_failing_worker(worker, specs, bounds, barrier, *args):
+    # Worker 0 never reaches the end on
+    # its own; worker 1 fails at once.
+    if worker == 1:
+        raise Exception("worker 1 failed")
+    time.sleep(60)
+
+
+def test_parallel_worker_failure_stops_the_run(monkeypatch):
+    monkeypatch.setattr(parallel, "run_worker", stuck_or_failing_worker)
+    page_rank = parallel.ParallelPageRank(AdjacencyGraph.from_file(RAND_NET),
+                                          workers=2)
+    start = time.time()
+    try:
+        with pytest.raises(Exception, match="exit code 1"):
+            page_rank.run(2)
+    finally:
+        page_rank.close()
+    assert time.time() - start < 30
+
+
+def test_preprocess_keeps_the_graph_for_any_partitions(tmp_path):
+    graphs = []
+    for n_reducers in [1, 3]:
+        work_dir = str(tmp_path / str(n_reducers))
+        graph_dir, meta_path = preprocess_graph([RAND_NET], work_dir,
+                                                n_reducers)
+        meta = read_graph_meta(meta_path)
+        names = {}
+        with open(os.path.join(work_dir, "names.txt")) as f:
+            for line in f:
+                node_id, node = line.rstrip("\n").split("\t")
+                names[node_id] = json.loads(node)
+        assert sorted(int(x) for x in names) == list(range(meta["n_nodes"]))
+        # Same graph once mapped back to
+        # the original names.
+        graph = {}
+        for key, links in read_output(graph_dir).items():
+            graph[names[key]] = sorted(names[link] for link in links)
+        assert meta["n_edges"] == sum(len(x) for x in graph.values())
+        assert meta["n_dangling"] == sum(1 for x in graph.values() if not x)
+        graphs.append(graph)
+    assert graphs[0] == graphs[1]
+    original = {}
+    with open(RAND_NET) as f:
+        for line in f:
+            key, links = parse_adjacency_line(line)
+            original[key] = sorted(links)
+    for key, links in original.items():
+        assert graphs[0][key] == links
+
+
+@pytest.mark.parametrize("range_sample_rate, schimmy", [
+    (1.0, False),
+    (None, True),
+    (1.0, True),
+])
+def test_preprocess_with_range_partitions_and_schimmy(tmp_path,
+                                                      range_sample_rate,
+                                                      schimmy):
+    job_args = ["--reduce.tasks", "3", "--n_nodes", "100"]
+    plain_dir, _ = run_until_converged(
+        WikiPageRank, [RAND_NET], str(tmp_path / "plain"),
+        job_args=job_args, tolerance=0.0, max_iterations=3, preprocess=True)
+    schimmy_dir = None
+    if schimmy:
+        schimmy_dir = str(tmp_path / "schimmy")
+    output_dir, _ = run_until_converged(
+        WikiPageRank, [RAND_NET], str(tmp_path / "run"),
+        job_args=job_args, tolerance=0.0, max_iterations=3, preprocess=True,
+        range_sample_rate=range_sample_rate, schimmy_dir=schimmy_dir)
+    plain = load_results(plain_dir)
+    ranks = load_results(output_dir)
+    assert set(ranks) == set(plain)
+    for key, pr in plain.items():
+        assert ranks[key] == pytest.approx(pr, abs=1e-12)
+
+
+def test_binary_and_json_node_protocols_agree(tmp_path):
+    ranks = {}
+    for node_protocol in ["json", "binary"]:
+        job_args = ["--reduce.tasks", "3", "--node_protocol", node_protocol]
+        work_dir = str(tmp_path / node_protocol)
+        _, history = run_until_converged(
+            SimplePageRank, [RAND_NET], work_dir,
+            job_args=job_args, tolerance=0.0, max_iterations=3)
+        assert history[-1]["shuffle bytes"] is None
+        output_dir = os.path.join(work_dir, "iteration-003")
+        protocol = iteration_protocol(SimplePageRank, job_args)
+        ranks[node_protocol] = read_ranks(output_dir, 101, protocol)
+    assert ranks["json"].sum() > 0
+    assert list(ranks["binary"]) == list(ranks["json"])
+
+
+def test_delta_counters_without_tolerance(tmp_path):
+    job = SimplePageRank(args=[RAND_NET, "--reduce.tasks", "3",
+                               "--iterations", "2", "--delta_epsilon", "0.01",
+                               "--output-dir", str(tmp_path), "--no-output"])
+    with job.make_runner() as runner:
+        runner.run()
+        counters = runner.counters()
+    # Clean, two iterations and collect.
+    for step in counters[1:3]:
+        assert "PR messages" in step["convergence"]
+        assert "unsent PR" in read_aggregates([step], "convergence deltas")
+
+
+@pytest.mark.parametrize("node_protocol", ["json", "binary"])
+def test_delta_mode_within_the_unsent_bound(tmp_path, node_protocol):
+    runs = {}
+    for name, args in [("plain", []),
+                       ("delta", ["--delta_epsilon", "1e-4",
+                                  "--node_protocol", node_protocol])]:
+        work_dir = str(tmp_path / name)
+        _, history = run_until_converged(
+            SimplePageRank, [RAND_NET], work_dir,
+            job_args=["--reduce.tasks", "3"] + args, tolerance=1e-12,
+            max_iterations=100)
+        output_dir = os.path.join(work_dir, "iteration-%03d" % len(history))
+        runs[name] = (history, output_dir)
+    plain_history, plain_dir = runs["plain"]
+    history, output_dir = runs["delta"]
+    plain = load_results(plain_dir)
+    ranks = load_results(output_dir)
+    # Ranks within d/(1-d) of the unsent
+    # PR of exact propagation.
+    unsent = history[-1]["unsent PR"]
+    error = sum(abs(ranks[key] - pr) for key, pr in plain.items())
+    assert 0 < error <= .85/.15*unsent + 1e-9
+    assert (sum(stats["PR messages"] for stats in history)
+            < sum(stats["PR messages"] for stats in plain_history)/2)
+    if node_protocol == "binary":
+        # The sent and in sums are part
+        # of the binary record.
+        for path in output_parts(output_dir):
+            with open(path, "rb") as f:
+                assert not any(b"\t" in line for line in f)
+
+
+def test_tolerance_below_the_old_counter_resolution(tmp_path):
+    # The L1 delta used to be rounded to
+    # 1e-9 in every reducer.
+    tolerance = 1e-11
+    _, history = run_until_converged(
+        SimplePageRank, [RAND_NET], str(tmp_path),
+        job_args=["--reduce.tasks", "3"], tolerance=tolerance,
+        max_iterations=50)
+    deltas = [stats["L1 delta"] for stats in history]
+    assert len(deltas) < 50
+    assert deltas[-1] < tolerance
+    assert all(delta >= tolerance for delta in deltas[1:-1])
+
+
+def test_block_mode_needs_fewer_passes(tmp_path):
+    passes = {}
+    ranks = {}
+    for block_iterations in [0, 1, 5]:
+        work_dir = str(tmp_path / str(block_iterations))
+        job_args = ["--reduce.tasks", "3", "--n_nodes", "100"]
+        if block_iterations:
+            job_args += ["--block_iterations", str(block_iterations),
+                         "--block_tolerance", "1e-13"]
+        output_dir, history = run_until_converged(
+            WikiPageRank, [RAND_NET], work_dir, job_args=job_args,
+            tolerance=1e-10, max_iterations=100, range_sample_rate=1.0)
+        passes[block_iterations] = len(history)
+        ranks[block_iterations] = load_results(output_dir)
+    # One sweep is the global update in
+    # Gauss-Seidel order.
+    assert passes[1] <= passes[0]
+    assert passes[5] < passes[0]
+    for key, pr in ranks[0].items():
+        assert ranks[5][key] == pytest.approx(pr, abs=1e-10)
+
+
+@pytest.mark.parametrize("job_class, path, job_args", [
+    (SimplePageRank, RAND_NET, []),
+    (PageRank, PAGERANK_TEST, ["--n_nodes", "11"]),
+])
+def test_resume_matches_an_uninterrupted_run(tmp_path, monkeypatch,
+                                             job_class, path, job_args):
+    job_args = ["--reduce.tasks", "3"] + job_args
+    straight_dir = str(tmp_path / "straight")
+    run_until_converged(job_class, [path], straight_dir, job_args=job_args,
+                        tolerance=0.0, max_iterations=6)
+
+    run_job = pagerank_driver.run_job
+
+    def interrupted(job_class, input_paths, output_dir, *args, **kwargs):
+        if output_dir.endswith("iteration-005"):
+            raise Exception("interrupted")
+        return run_job(job_class, input_paths, output_dir, *args, **kwargs)
+
+    work_dir = str(tmp_path / "resumed")
+    monkeypatch.setattr(pagerank_driver, "run_job", interrupted)
+    with pytest.raises(Exception, match="interrupted"):
+        run_until_converged(job_class, [path], work_dir, job_args=job_args,
+                            tolerance=0.0, max_iterations=6,
+                            checkpoint_every=2)
+    monkeypatch.setattr(pagerank_driver, "run_job", run_job)
+    # The last checkpoint lost its
+    # manifest, so the one before is used.
+    checkpoints = os.path.join(work_dir, "checkpoints")
+    os.remove(os.path.join(checkpoints, "iteration-004", "manifest.json"))
+    _, history = run_until_converged(job_class, [], work_dir,
+                                     resume_from=checkpoints)
+    assert [stats["iteration"] for stats in history] == list(range(1, 7))
+
+    straight = load_results(os.path.join(straight_dir, "iteration-006"))
+    resumed = load_results(os.path.join(work_dir, "iteration-006"))
+    assert set(resumed) == set(straight)
+    for key, pr in straight.items():
+        assert resumed[key] == pytest.approx(pr, abs=1e-15)
+
+
+def test_resume_refuses_a_checkpoint_without_manifest(tmp_path):
+    work_dir = str(tmp_path)
+    run_until_converged(SimplePageRank, [RAND_NET], work_dir,
+                        job_args=["--reduce.tasks", "3"], tolerance=0.0,
+                        max_iterations=2, checkpoint_every=2)
+    checkpoint = os.path.join(work_dir, "checkpoints", "iteration-002")
+    os.remove(os.path.join(checkpoint, "manifest.json"))
+    for resume_from in [checkpoint, os.path.dirname(checkpoint)]:
+        with pytest.raises(Exception, match="no complete checkpoint"):
+            run_until_converged(SimplePageRank, [], work_dir,
+                                resume_from=resume_from)
+
+
+def test_warm_start_from_full_state_dump(tmp_path):
+    work_dir = str(tmp_path / "wiki")
+    run_until_converged(WikiPageRank, [RAND_NET], work_dir,
+                        job_args=["--reduce.tasks", "3", "--n_nodes", "100"],
+                        tolerance=0.0, max_iterations=30)
+    ranks = load_results(os.path.join(work_dir, "iteration-030"))
+    graph = AdjacencyGraph.from_file(RAND_NET)
+    assert set(ranks) == set(graph.ids)
+    for name, edge_deltas in [("existing", "+\t1\t2\n-\t2\t26\n"),
+                              ("new", "+\t1\tnew\n+\tnew\t2\n"
+                                      "+\t3\tsink\n")]:
+        deltas = tmp_path / ("%s.txt" % name)
+        deltas.write_text(edge_deltas)
+        new_graph, frontier = graph.with_edge_deltas(str(deltas))
+        assert new_graph.n_old == graph.n
+        page_rank = IncrementalPageRank(new_graph, ranks,
+                                        variant="WikiPageRank")
+        assert page_rank.missing.sum() == new_graph.n - graph.n
+        page_rank.run(frontier, tolerance=1e-12, max_rounds=1000)
+        # Every node is known, as in the
+        # incremental run.
+        known = AdjacencyGraph(new_graph.ids, new_graph.indptr,
+                               new_graph.indices, new_graph.n)
+        cold = CSRPageRank(known, variant="WikiPageRank").run(200)
+        assert page_rank.pr == pytest.approx(cold.pr, abs=1e-9)
+
+
+def test_partial_warm_start_is_refused():
+    graph = AdjacencyGraph.from_file(RAND_NET)
+    top = dict(CSRPageRank(graph, variant="WikiPageRank").run(5).top_k(10))
+    with pytest.raises(Exception, match="missing"):
+        IncrementalPageRank(graph, top, variant="WikiPageRank")
+    page_rank = IncrementalPageRank(graph, top, variant="WikiPageRank",
+                                    allow_partial=True)
+    assert page_rank.missing.sum() == graph.n - 10
+
+
+@pytest.mark.parametrize("args", [
+    ["--iterations", "2", "--aggregates", "{}"],
+    ["--iterations", "1", "--aggregates", "{}", "--extrapolation", "[0, 0, 1]",
+     "--extrapolate_every", "2"],
+    ["--iterations", "1", "--extrapolation", "[0, 0, 1]"],
+    ["--iterations", "1", "--extrapolate_every", "2",
+     "--smart_updating", "True"],
+    ["--iterations", "1", "--split_degree", "5", "--schimmy_dir", "graph"],
+    ["--iterations", "2", "--split_degree", "5"],
+])
+def test_incompatible_pagerank_options(args):
+    job = PageRank(args=[RAND_NET, "--n_nodes", "100",
+                         "--reduce.tasks", "3"] + args)
+    for method in [job.mapper_init, job.reducer_init, job.steps]:
+        with pytest.raises(Exception):
+            method()
+
+
+@pytest.mark.parametrize("job_class, path, n_nodes", [
+    (SimplePageRank, RAND_NET, None),
+    (WikiPageRank, RAND_NET, 100),
+    (PageRank, PAGERANK_TEST, 11),
+    (ComplexPageRank, PAGERANK_TEST, 11),
+])
+def test_csr_matches_mr_jobs(tmp_path, job_class, path, n_nodes):
+    job_args = ["--reduce.tasks", "3"]
+    if n_nodes:
+        job_args += ["--n_nodes", str(n_nodes)]
+    work_dir = str(tmp_path)
+    run_until_converged(job_class, [path], work_dir, job_args=job_args,
+                        tolerance=0.0, max_iterations=5)
+    mr_ranks = load_results(os.path.join(work_dir, "iteration-005"))
+    page_rank = CSRPageRank(AdjacencyGraph.from_file(path),
+                            variant=job_class.__name__, n_nodes=n_nodes)
+    csr_ranks = dict(page_rank.run(5).results())
+    assert set(csr_ranks) == set(mr_ranks)
+    for key, pr in csr_ranks.items():
+        assert mr_ranks[key] == pytest.approx(pr, rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize("job_class, path, job_args, preprocess", [
+    (PageRank, PAGERANK_TEST, ["--n_nodes", "11"], False),
+    (PageRank, PAGERANK_TEST, [], True),
+    (WikiPageRank, RAND_NET, ["--n_nodes", "100"], False),
+    (WikiPageRank, RAND_NET, [], True),
+    (TopicPageRank, RAND_NET, ["--topics_file", RAND_NET_TOPICS], False),
+])
+def test_aggregate_channel_matches_broadcast(tmp_path, monkeypatch,
+                                             job_class, path, job_args,
+                                             preprocess):
+    job_args = ["--reduce.tasks", "3"] + job_args
+    run_job = pagerank_driver.run_job
+    sent = []
+
+    def recording(job_class, input_paths, output_dir, args, *rest):
+        if "iteration-" in output_dir:
+            sent.append("--aggregates" in args)
+        return run_job(job_class, input_paths, output_dir, args, *rest)
+
+    monkeypatch.setattr(pagerank_driver, "run_job", recording)
+    ranks = []
+    for aggregate_channel in [False, True]:
+        del sent[:]
+        work_dir = str(tmp_path / str(aggregate_channel))
+        run_until_converged(job_class, [path], work_dir, job_args=job_args,
+                            tolerance=0.0, max_iterations=5,
+                            aggregate_channel=aggregate_channel,
+                            preprocess=preprocess)
+        # Only the first iteration of the
+        # channel run broadcasts the totals,
+        # unless the graph meta file has them.
+        assert sent == [aggregate_channel and preprocess] + \
+            [aggregate_channel]*4
+        ranks.append(node_ranks(os.path.join(work_dir, "iteration-005")))
+    broadcast, channel = ranks
+    assert set(channel) == set(broadcast)
+    for key, pr in broadcast.items():
+        assert channel[key] == pytest.approx(pr, abs=1e-14)
+
+
+@pytest.mark.parametrize("job_class, job_args", [
+    (SimplePageRank, []),
+    (PageRank, ["--n_nodes", "11"]),
+])
+def test_combine_buffer_sends_fewer_messages(tmp_path, job_class, job_args):
+    job_args = ["--reduce.tasks", "3"] + job_args
+    # Most nodes link to B, so even three
+    # targets in the buffer combine some.
+    ranks = []
+    messages = []
+    for buffer_size in [0, 3]:
+        work_dir = str(tmp_path / str(buffer_size))
+        _, history = run_until_converged(
+            job_class, [PAGERANK_TEST], work_dir,
+            job_args=job_args + ["--combine_buffer", str(buffer_size)],
+            tolerance=0.0, max_iterations=5)
+        ranks.append(load_results(os.path.join(work_dir, "iteration-005")))
+        messages.append(sum(stats["PR messages"] for stats in history))
+    unbuffered, buffered = ranks
+    assert set(buffered) == set(unbuffered)
+    for key, pr in unbuffered.items():
+        # Only the order of the sums
+        # changes.
+        assert buffered[key] == pytest.approx(pr, rel=1e-12)
+    assert messages[1] < messages[0]
+
+
+@pytest.mark.parametrize("job_class", [PageRank, ComplexPageRank])
+def test_extrapolation_reaches_the_fixed_point_sooner(tmp_path, job_class):
+    job_args = ["--reduce.tasks", "3", "--n_nodes", "11"]
+    runs = {}
+    for extrapolate_every in [0, 5]:
+        args = job_args
+        if extrapolate_every:
+            args = args + ["--extrapolate_every", str(extrapolate_every)]
+        output_dir, history = run_until_converged(
+            job_class, [PAGERANK_TEST], str(tmp_path / str(extrapolate_every)),
+            job_args=args, tolerance=1e-10, max_iterations=300)
+        runs[extrapolate_every] = (len(history), load_results(output_dir))
+    plain_iterations, plain = runs[0]
+    iterations, ranks = runs[5]
+    assert plain_iterations < 300
+    assert iterations < plain_iterations/2
+    assert set(ranks) == set(plain)
+    for key, pr in plain.items():
+        assert ranks[key] == pytest.approx(pr, abs=1e-9)
+
+
+def dense_topic_ranks(graph, topics, d=.85, beta=.99, iterations=500):
+    """
+    Topic-sensitive PageRank of every
+    topic, one power iteration per topic.
+    """
+    n_nodes = topics.n_nodes
+    topic_of = np.array([-1 if topics[node] is None else topics[node]
+                         for node in graph.ids])
+    dangling = graph.out_degree == 0
+    out_degree = np.maximum(graph.out_degree, 1)
+    ranks = []
+    for j, size in enumerate(topics.sizes):
+        teleport = np.where(topic_of == j,
+                            (1-d)*beta/size,
+                            (1-d)*(1-beta)/(n_nodes - size))
+        pr = np.full(graph.n, 1/n_nodes)
+        for _ in range(iterations):
+            incoming = np.bincount(graph.indices,
+                                   weights=(pr/out_degree)[graph.edge_source],
+                                   minlength=graph.n)
+            pr = d*(incoming + pr[dangling].sum()/n_nodes) + teleport
+        ranks.append(pr)
+    return np.array(ranks).T
+
+
+def test_topic_pagerank_matches_dense_topic_ranks(tmp_path):
+    work_dir = str(tmp_path)
+    _, history = run_until_converged(
+        TopicPageRank, [RAND_NET], work_dir,
+        job_args=["--reduce.tasks", "3", "--topics_file", RAND_NET_TOPICS],
+        tolerance=1e-12, max_iterations=200)
+    assert len(history) < 200
+    output = read_output(os.path.join(work_dir,
+                                      "iteration-%03d" % len(history)))
+    graph = AdjacencyGraph.from_file(RAND_NET)
+    topics = TopicLookup(RAND_NET_TOPICS)
+    expected = dense_topic_ranks(graph, topics)
+    assert set(output) == set(graph.ids)
+    for i, node in enumerate(graph.ids):
+        assert output[node]["PR"] == pytest.approx(list(expected[i]),
+                                                   abs=1e-11)
+
+
+def assert_same_graph(graph, expected):
+    assert graph.ids == expected.ids
+    assert graph.n_sources == expected.n_sources
+    assert np.array_equal(graph.indptr, expected.indptr)
+    assert np.array_equal(graph.indices, expected.indices)
+
+
+def test_edge_cache_is_reused_until_the_input_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "graph.txt")
+    shutil.copy(RAND_NET, path)
+    cache_dir = str(tmp_path / "cache")
+    parsed = AdjacencyGraph.from_file(path)
+    assert_same_graph(AdjacencyGraph.from_cache(cache_dir, path), parsed)
+
+    from_file = AdjacencyGraph.from_file
+
+    def not_parsed(*paths):
+        raise Exception("cache missed")
+
+    monkeypatch.setattr(AdjacencyGraph, "from_file", not_parsed)
+    assert_same_graph(AdjacencyGraph.from_cache(cache_dir, path), parsed)
+
+    with open(path, "a") as f:
+        f.write("1000\t{'1': 1}\n")
+    with pytest.raises(Exception, match="cache missed"):
+        AdjacencyGraph.from_cache(cache_dir, path)
+    monkeypatch.setattr(AdjacencyGraph, "from_file", from_file)
+    rebuilt = AdjacencyGraph.from_cache(cache_dir, path)
+    assert rebuilt.n == parsed.n + 1
+    assert_same_graph(rebuilt, AdjacencyGraph.from_file(path))
+    monkeypatch.setattr(AdjacencyGraph, "from_file", not_parsed)
+    assert_same_graph(AdjacencyGraph.from_cache(cache_dir, path), rebuilt)
+
+
+@pytest.mark.parametrize("n_walks", [1000, 4000])
+def test_walk_index_matches_exact_personalized_pagerank(tmp_path, n_walks):
+    graph = AdjacencyGraph.from_file(RAND_NET)
+    index_dir = str(tmp_path / "index")
+    build_walk_index(graph, index_dir, n_walks=n_walks)
+    index = WalkIndex(index_dir)
+    # The estimates are means over the
+    # walks, so the error shrinks like
+    # 1/sqrt(n_walks).
+    tolerance = .25/np.sqrt(n_walks)
+    for source in [0, 17, 42]:
+        exact = personalized_pagerank(graph, source)
+        assert exact.sum() == pytest.approx(1, abs=1e-12)
+        found = index.top_k(graph.ids[source], 10)
+        assert found[0][0] == graph.ids[source]
+        for node, pr in found:
+            assert pr == pytest.approx(exact[graph.ids.index(node)],
+                                       abs=tolerance)
+        # Anything clearly above the 10th
+        # estimate made the list.
+        clearly_above = exact > found[-1][1] + 2*tolerance
+        assert (set(graph.ids[i] for i in np.flatnonzero(clearly_above))
+                <= set(node for node, _ in found))
+
+
+def read_output_lines(output_dir):
+    # In output order, unlike read_output.
+    records = []
+    for path in output_parts(output_dir):
+        with open(path) as f:
+            for line in f:
+                key, value = line.rstrip("\n").split("\t", 1)
+                records.append((json.loads(key), json.loads(value)))
+    return records
+
+
+# D and F tie for 4th, G to K for 7th.
+@pytest.mark.parametrize("k", [4, 8])
+def test_simple_pagerank_top_k_matches_csr(tmp_path, k):
+    output_dir, _ = run_until_converged(
+        SimplePageRank, [PAGERANK_TEST], str(tmp_path),
+        job_args=["--reduce.tasks", "3", "--return_top_k", str(k)],
+        tolerance=0.0, max_iterations=5)
+    found = read_output_lines(output_dir)
+    page_rank = CSRPageRank(AdjacencyGraph.from_file(PAGERANK_TEST))
+    expected = page_rank.run(5).top_k(k)
+    assert [node for node, _ in found] == [node for node, _ in expected]
+    for (_, pr), (_, expected_pr) in zip(found, expected):
+        # The job rounds its output.
+        assert pr == pytest.approx(expected_pr, abs=1e-4)
+
+
+@pytest.mark.parametrize("k", [4, 8])
+def test_topic_pagerank_top_k_matches_csr(tmp_path, k):
+    topics_path = str(tmp_path / "topics.txt")
+    with open(topics_path, "w") as f:
+        for node in "ABCDEFGHIJK":
+            f.write("%s\t%d\n" % (node, 1 if node < "G" else 2))
+    output_dir, _ = run_until_converged(
+        TopicPageRank, [PAGERANK_TEST], str(tmp_path / "work"),
+        job_args=["--reduce.tasks", "3", "--topics_file", topics_path,
+                  "--return_top_k", str(k)],
+        tolerance=1e-12, max_iterations=200)
+    found = {}
+    for topic, (node, pr) in read_output_lines(output_dir):
+        found.setdefault(topic, []).append((node, pr))
+    graph = AdjacencyGraph.from_file(PAGERANK_TEST)
+    topics = TopicLookup(topics_path)
+    ranks = dense_topic_ranks(graph, topics)
+    assert len(found) == len(topics.topics)
+    for j, topic in enumerate(topics.topics):
+        expected = top_k(graph.ids, ranks[:, j], np.arange(graph.n), k)
+        assert [node for node, _ in found[topic]] == [node for node, _
+                                                      in expected]
+        for (_, pr), (_, expected_pr) in zip(found[topic], expected):
+            assert pr == pytest.approx(expected_pr, abs=1e-11)
+
+
+def test_node_partition_is_the_same_in_every_process():
+    # hash() of a str changes with
+    # PYTHONHASHSEED, crc32 does not.
+    nodes = ["%d" % i for i in range(200)] + ["Main_Page", u"été"]
+    expected = [node_partition(node, 7) for node in nodes]
+    script = ("import json, sys; from pagerank_utils import node_partition; "
+              "print(json.dumps([node_partition(x, 7) "
+              "for x in json.loads(sys.argv[1])]))")
+    for seed in ["1", "2"]:
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        output = subprocess.check_output(
+            [sys.executable, "-c", script, json.dumps(nodes)],
+            cwd=HERE, env=env)
+        assert json.loads(output.decode("utf-8")) == expected
+    assert set(expected) == set(range(7))
+
+
+@pytest.mark.parametrize("key, value", [
+    ("17", {"PR": 0.125, "links": ["3", "12", "40"]}),
+    ("Main_Page", {"PR": 1.0, "links": [u"été", "Talk:Main_Page"]}),
+    ("5", {"PR": [0.1, 0.2, 0.7], "links": ["1"], "topic": "2"}),
+    ("5", {"PR": [0.5, 0.5], "links": [], "topic": "news"}),
+    ("8", ["1", "2"]),
+    ("****Total PR", 0.99),
+    ("9", {"PR": 0.5, "links": ["1"], "old_PR": [0.4, 0.3]}),
+    ("10", {"PR": 0.5, "links": ["1", "4"], "sent": 0.25, "in": 0.75}),
+    ("11", {"PR": 0.5, "links": [], "in": 0.125}),
+])
+def test_node_state_protocol_round_trip(key, value):
+    protocol = NodeStateProtocol()
+    line = protocol.write(key, value)
+    assert b"\n" not in line
+    decoded_key, decoded = protocol.read(line)
+    assert decoded_key == key
+    if isinstance(decoded, dict) and "links" in decoded:
+        # Numeric links are sorted.
+        decoded["links"] = sorted(decoded["links"])
+        value = dict(value, links=sorted(value["links"]))
+    assert decoded == value